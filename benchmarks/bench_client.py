@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark of the client, stage by stage, with regression tracking.
+
+Micro-benchmarks time each stage of a request on its own:
+
+    validation     -- the validators run before a request is built
+    serialization  -- _build_request, which encodes (and compresses) the body
+    dispatch       -- _send_request, an HTTP round trip to a local emulator
+    parse          -- _handler_request, decoding a response and checking it
+                      for API errors through SDHandlerResponse
+
+Macro-benchmarks time whole client calls against the local emulator of
+pyslicer.emulator: a 1000 entity insert, a count of 10 queries and a
+data extraction page of several megabytes. Their stage times, taken from
+the RequestEvent of every call, are reported alongside.
+
+Results are written as JSON with --output. Given a previous output with
+--baseline, every benchmark slower than the baseline by more than
+--threshold is reported and the exit status is 1.
+
+Usage:
+
+    python benchmarks/bench_client.py --output baseline.json
+    python benchmarks/bench_client.py --baseline baseline.json \\
+        --threshold 0.15
+"""
+import argparse
+import os
+import platform
+import sys
+import time
+import timeit
+
+import ujson
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyslicer import SlicingDice  # noqa: E402
+from pyslicer.core.instrumentation import RequestHook  # noqa: E402
+from pyslicer.emulator.server import EmulatorServer  # noqa: E402
+from pyslicer.url_resources import URLResources  # noqa: E402
+from pyslicer.utils import validators  # noqa: E402
+
+# Version of the JSON results, bumped when benchmarks change meaning
+RESULTS_VERSION = 1
+
+STAGES = ('validation_time', 'serialization_time', 'latency', 'parse_time',
+          'total_time')
+
+
+def make_insertion(entities=1000):
+    insertion = {}
+    for i in range(entities):
+        insertion['user{0}@slicingdice.com'.format(i)] = {
+            'name': 'User {0}'.format(i),
+            'age': 20 + i % 50,
+            'tags': ['a', 'b', 'c'],
+            'clicks': [
+                {'value': 'Pay Now', 'date': '2017-05-20T13:00:00Z'},
+                {'value': 'Add to cart', 'date': '2017-05-21T10:00:00Z'},
+            ],
+        }
+    insertion['auto-create'] = ['column']
+    return insertion
+
+
+def make_count_query(queries=10):
+    return [{
+        'query-name': 'query-{0}'.format(i),
+        'query': [
+            {'age': {'range': [18, 30 + i]}},
+            'and',
+            {'clicks': {'equals': 'Pay Now',
+                        'between': ['2017-05-01T00:00:00Z',
+                                    '2017-06-01T00:00:00Z']}},
+        ],
+    } for i in range(queries)]
+
+
+def iter_extraction_entities(entities, text_bytes):
+    text = 'x' * text_bytes
+    for i in range(entities):
+        yield 'page{0}'.format(i), {
+            'segment': 'bench',
+            'bio': '{0} {1}'.format(i, text),
+            'score': i,
+        }
+
+
+def make_extraction_body(entities, text_bytes):
+    """Returns the bytes of a data extraction response, a list of rows
+    holding their entity id with values as text, as the API answers"""
+    text = 'x' * text_bytes
+    data = [{'entity-id': 'page{0}'.format(i),
+             'bio': '{0} {1}'.format(i, text), 'score': str(i),
+             'segment': 'bench'} for i in range(entities)]
+    return ujson.dumps({'status': 'success', 'data': data, 'page': 1,
+                        'next-page': None, 'took': 0.01}).encode('utf-8')
+
+
+class _Response(object):
+    """The attributes of a requests response read by _handler_request"""
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {'Content-Type': 'application/json'}
+
+
+class StageRecorder(RequestHook):
+    """Keeps the stage times of every request, by endpoint"""
+
+    def __init__(self):
+        self.times = {}
+
+    def after_request(self, event):
+        endpoint = self.times.setdefault(event.endpoint, {})
+        for name in STAGES:
+            value = getattr(event, name)
+            if value is not None:
+                endpoint.setdefault(name, []).append(value)
+
+    def medians(self, endpoint):
+        medians = {}
+        for name, values in self.times.get(endpoint, {}).items():
+            values = sorted(values)
+            medians[name] = values[len(values) // 2]
+        return medians
+
+
+class Suite(object):
+    def __init__(self, number, repeat, pattern=None):
+        self.number = number
+        self.repeat = repeat
+        self.pattern = pattern
+        self.results = {}
+
+    def wanted(self, name):
+        return self.pattern is None or self.pattern in name
+
+    def run(self, name, func, number=None, size=None):
+        """Time func, keeping the best time of an operation"""
+        if not self.wanted(name):
+            return
+        number = max(1, number or self.number)
+        best = min(timeit.repeat(func, number=number,
+                                 repeat=self.repeat)) / number
+        result = {'seconds': best}
+        if size:
+            result['bytes'] = size
+            result['mb_per_second'] = size / best / 1e6
+        self.results[name] = result
+        print('{0:<40} {1:>12.1f} us{2}'.format(
+            name, best * 1e6, '  {0:>8.1f} MB/s'.format(
+                result['mb_per_second']) if size else ''))
+
+
+def run_micro(suite, server):
+    SlicingDice.BASE_URL = server.url
+    client = SlicingDice(master_key='bench')
+    insertion = make_insertion()
+    count_query = make_count_query()
+    insert_url = SlicingDice.BASE_URL + URLResources.INSERT
+    count_url = SlicingDice.BASE_URL + URLResources.QUERY_COUNT_ENTITY
+    insert_size = len(ujson.dumps(insertion))
+
+    for level in validators.VALIDATION_LEVELS[:-1]:
+        suite.run('validation.insert_1000.' + level,
+                  lambda: validators.InsertValidator(
+                      insertion, level).validator())
+        suite.run('validation.count_10.' + level,
+                  lambda: validators.QueryCountValidator(
+                      count_query, level).validator(),
+                  number=suite.number * 50)
+
+    suite.run('serialization.insert_1000',
+              lambda: client._build_request(insert_url, 'post', 1,
+                                            insertion), size=insert_size)
+    suite.run('serialization.count_10',
+              lambda: client._build_request(count_url, 'post', 0,
+                                            count_query),
+              number=suite.number * 50)
+    client.compress = True
+    suite.run('serialization.insert_1000.gzip',
+              lambda: client._build_request(insert_url, 'post', 1,
+                                            insertion), size=insert_size)
+    client.compress = False
+
+    total_url = SlicingDice.BASE_URL + URLResources.QUERY_COUNT_ENTITY_TOTAL
+    request = client._build_request(total_url, 'post', 0, {})
+    suite.run('dispatch.count_entity_total',
+              lambda: client._send_request(request),
+              number=suite.number * 5)
+
+    for name, body in (
+            ('parse.count_10', ujson.dumps({
+                'status': 'success', 'took': 0.01,
+                'result': dict(('query-{0}'.format(i), i * 1000)
+                               for i in range(10))}).encode('utf-8')),
+            ('parse.result_page_4mb', make_extraction_body(1000, 4000))):
+        response = _Response(body)
+        number = suite.number * 50 if len(body) < 1024 else suite.number
+        suite.run(name, lambda: client._handler_request(response),
+                  number=number, size=len(body))
+
+
+def run_macro(suite, server, stages):
+    SlicingDice.BASE_URL = server.url
+    recorder = StageRecorder()
+    client = SlicingDice(master_key='bench', hooks=[recorder])
+    insertion = make_insertion()
+    count_query = make_count_query()
+    client.insert(insertion)
+    client.bulk_insert(iter_extraction_entities(1000, 4000),
+                       auto_create=['column'])
+    extraction = {'query': [{'segment': {'equals': 'bench'}}],
+                  'columns': ['bio', 'score', 'segment'], 'limit': 1000}
+
+    for name, endpoint, func, number in (
+            ('macro.insert_1000', URLResources.INSERT,
+             lambda: client.insert(insertion), suite.number),
+            ('macro.count_10', URLResources.QUERY_COUNT_ENTITY,
+             lambda: client.count_entity(count_query), suite.number * 5),
+            ('macro.result_page_4mb',
+             URLResources.QUERY_DATA_EXTRACTION_RESULT,
+             lambda: client.result(extraction), suite.number)):
+        if not suite.wanted(name):
+            continue
+        recorder.times.pop(endpoint, None)
+        suite.run(name, func, number=number)
+        stages[name] = recorder.medians(endpoint)
+        print('  ' + '  '.join('{0} {1:.1f} us'.format(
+            stage.replace('_time', ''), stages[name][stage] * 1e6)
+            for stage in STAGES if stage in stages[name]))
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every benchmark from the baseline, returning the
+    names of those slower by more than threshold"""
+    regressions = []
+    print('\n{0:<40} {1:>12} {2:>12} {3:>8}'.format(
+        'benchmark', 'baseline us', 'current us', 'change'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]['seconds']
+        after = results[name]['seconds']
+        change = after / before - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{0:<40} {1:>12.1f} {2:>12.1f} {3:>+7.1%}{4}'.format(
+            name, before * 1e6, after * 1e6, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=10,
+                        help="calls per timing of the slower benchmarks")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="timings of every benchmark, the best is kept")
+    parser.add_argument('--filter', help="run benchmarks whose name "
+                        "contains this text")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds of latency added by the emulator")
+    parser.add_argument('--output', help="write the results to this file")
+    parser.add_argument('--baseline', help="results to compare with")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="slowdown from the baseline reported as a "
+                        "regression, defaults to 0.10 (10%%)")
+    args = parser.parse_args()
+
+    suite = Suite(args.number, args.repeat, args.filter)
+    stages = {}
+    with EmulatorServer(latency=args.latency) as server:
+        run_micro(suite, server)
+        run_macro(suite, server, stages)
+
+    output = {
+        'version': RESULTS_VERSION,
+        'created-at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'number': args.number,
+        'repeat': args.repeat,
+        'results': suite.results,
+        'stages': stages,
+    }
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            results_file.write(ujson.dumps(output, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = ujson.loads(baseline_file.read())
+        if baseline.get('version') != RESULTS_VERSION:
+            sys.exit("The baseline was made by another version of the "
+                     "benchmarks.")
+        regressions = compare(suite.results, baseline['results'],
+                              args.threshold)
+        if regressions:
+            print('\n{0} benchmark(s) slower than the baseline by more than '
+                  '{1:.0%}'.format(len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
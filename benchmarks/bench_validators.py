@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Micro-benchmark of the client side validators.
+
+Compares the previous recursive validation engine, kept below for
+reference, with the current one at every validation level. No request is
+sent, only the validation done before it is measured.
+
+Usage:
+
+    python benchmarks/bench_validators.py [--number N] [--repeat R]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyslicer import exceptions  # noqa: E402
+from pyslicer.utils import validators  # noqa: E402
+
+
+class LegacyInsertValidator(object):
+    """The validation done by InsertValidator before the validation levels
+    were added: a recursive walk plus str() of every entity."""
+
+    def __init__(self, dictionary):
+        if not dictionary:
+            raise exceptions.InvalidQueryException(
+                "This query has invalid keys or values.")
+        self.check_dictionary(dictionary)
+        self.data = dictionary
+
+    def check_dictionary_value(self, dictionary_value):
+        if isinstance(dictionary_value, dict):
+            self.check_dictionary(dictionary_value)
+        elif isinstance(dictionary_value, list):
+            self.check_list(dictionary_value)
+        elif dictionary_value is None or dictionary_value == "":
+            raise exceptions.InvalidQueryException(
+                "This query has invalid keys or values.")
+
+    def check_dictionary(self, dictionary):
+        if not dictionary:
+            raise exceptions.InvalidQueryException(
+                "This query has invalid keys or values.")
+        for key in dictionary:
+            if isinstance(key, dict):
+                dictionary_value = key.get('query')
+            else:
+                dictionary_value = dictionary[key]
+            self.check_dictionary_value(dictionary_value)
+
+    def check_list(self, dictionary_list):
+        if not dictionary_list:
+            raise exceptions.InvalidQueryException(
+                "This query has invalid keys or values.")
+        for dictionary_value in dictionary_list:
+            self.check_dictionary_value(dictionary_value)
+
+    def validator(self):
+        for value in self.data.values():
+            if not isinstance(
+                    value, (dict, list)) or value is None or len(
+                        str(value)) == 0:
+                raise exceptions.WrongTypeException(
+                    "The value for an id should be a dictionary")
+        return len(self.data) <= validators.MAX_INSERTION_BATCH_SIZE
+
+
+def make_insertion(entities=1000):
+    insertion = {}
+    for i in range(entities):
+        insertion['user{0}@slicingdice.com'.format(i)] = {
+            'name': 'User {0}'.format(i),
+            'age': 20 + i % 50,
+            'tags': ['a', 'b', 'c'],
+            'clicks': [
+                {'value': 'Pay Now', 'date': '2017-05-20T13:00:00Z'},
+                {'value': 'Add to cart', 'date': '2017-05-21T10:00:00Z'},
+            ],
+            'table': 'users',
+        }
+    insertion['auto-create'] = ['table', 'column']
+    return insertion
+
+
+def make_count_query(queries=10):
+    return [{
+        'query-name': 'query-{0}'.format(i),
+        'query': [
+            {'age': {'range': [18, 30 + i]}},
+            'and',
+            {'clicks': {'equals': 'Pay Now',
+                        'between': ['7 days ago', 'now']}},
+        ],
+        'bypass-cache': False,
+    } for i in range(queries)]
+
+
+def run(name, func, number, repeat):
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print('{0:<32} {1:>10.1f} us'.format(name, best * 1e6))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    insertion = make_insertion()
+    count_query = make_count_query()
+
+    print('Insert of {0} entities'.format(len(insertion) - 1))
+    legacy = run('legacy', lambda: LegacyInsertValidator(
+        insertion).validator(), args.number, args.repeat)
+    for level in validators.VALIDATION_LEVELS[:-1]:
+        best = run(level, lambda: validators.InsertValidator(
+            insertion, level).validator(), args.number, args.repeat)
+        print('{0:<32} {1:>10.1f}x'.format('  speedup', legacy / best))
+
+    print('\nCount query of {0} queries'.format(len(count_query)))
+    number = args.number * 100
+    legacy = run('legacy', lambda: LegacyInsertValidator.check_dictionary(
+        LegacyInsertValidator.__new__(LegacyInsertValidator), count_query),
+        number, args.repeat)
+    for level in validators.VALIDATION_LEVELS[:-1]:
+        best = run(level, lambda: validators.QueryCountValidator(
+            count_query, level).validator(), number, args.repeat)
+        print('{0:<32} {1:>10.1f}x'.format('  speedup', legacy / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,41 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import ujson
 import requests
 
+import six
+
 from . import exceptions
-from .core.handler_response import SDHandlerResponse
+from .core.cache import wants_bypass
+from .core.handler_response import SDHandlerResponse, parse_retry_after
+from .core.instrumentation import RequestEvent, timer
 from .core.requester import Requester
+from .core.response_info import ContextLocal, ResponseInfo
+from .utils.data_utils import gzip_compress
+
+
+class _Request(object):
+    """A request ready to be sent, as built by SlicingDiceAPI._build_request"""
+
+    def __init__(self, url, req_type, data, headers, cache_key=None,
+                 cache_ttl=None, cache_bypass=False, invalidates_cache=False,
+                 idempotent=False, key_level=0, raw=False, event=None):
+        self.url = url
+        self.req_type = req_type
+        self.data = data
+        self.headers = headers
+        self.cache_key = cache_key
+        self.cache_ttl = cache_ttl
+        self.cache_bypass = cache_bypass
+        self.invalidates_cache = invalidates_cache
+        self.idempotent = idempotent
+        self.key_level = key_level
+        self.raw = raw
+        self.event = event
+        self.latency = None
+        self.attempts = 0
 
 
 class SlicingDiceAPI(object):
@@ -19,7 +48,11 @@ class SlicingDiceAPI(object):
 
     def __init__(
         self, master_key=None, write_key=None, read_key=None,
-            custom_key=None, use_ssl=True, timeout=60):
+            custom_key=None, use_ssl=True, timeout=60, max_workers=1,
+            cache=None, retry_policy=None, rate_limiter=None,
+            compress=False, compress_min_size=1024, hooks=None,
+            pool_maxsize=None, pool_block=False, keep_alive=None,
+            connect_timeout=None):
         """Instantiate a new SlicerDicer object.
 
         Keyword arguments:
@@ -28,21 +61,125 @@ class SlicingDiceAPI(object):
             HTTPS requests. Defaults False.(Optional)
         timeout(int) -- Define timeout to request,
             defaults 60 secs(Optional).
+        max_workers(int) -- Number of requests sent concurrently by the
+            batch methods, defaults 1(Optional).
+        cache(QueryCache) -- Cache for read query results, defaults
+            None(Optional).
+        retry_policy(RetryPolicy) -- Define how failed requests are retried,
+            defaults None, no retries(Optional).
+        rate_limiter(RateLimiter) -- Paces outgoing requests, can be shared
+            between clients, defaults None(Optional).
+        compress(bool) -- Define if request bodies are sent gzip
+            compressed, defaults False(Optional).
+        compress_min_size(int) -- Smallest body compressed, defaults
+            1024 bytes(Optional).
+        hooks(list) -- RequestHook objects notified around every request,
+            defaults None(Optional).
+        pool_maxsize(int) -- Connections kept open, defaults to
+            max(10, max_workers)(Optional).
+        pool_block(bool) -- Wait for a free pooled connection instead of
+            opening a short-lived one when all are in use, defaults
+            False(Optional).
+        keep_alive -- True or a dictionary with 'idle', 'interval' and
+            'count' to enable TCP keep-alive probes, defaults
+            None(Optional).
+        connect_timeout(float) -- Define timeout to establish a connection,
+            defaults to timeout(Optional).
         """
         self.keys = self._organize_keys(
             master_key, custom_key, read_key, write_key)
         self._api_key = self._get_key()[0]
-        self._requester = Requester(use_ssl, timeout)
-        self.__status_code = None
-        self.__headers = None
+        self.max_workers = max(1, max_workers)
+        self._cache = cache
+        self._retry_policy = retry_policy
+        self._rate_limiter = rate_limiter
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+        if pool_maxsize is None:
+            pool_maxsize = max(10, self.max_workers)
+        self._requester = self._create_requester(
+            use_ssl, timeout, pool_maxsize, pool_block, keep_alive,
+            connect_timeout)
+        self._hooks = list(hooks or ())
+        # Client side times measured before a request is built, such as
+        # validation, waiting for the next request of the same thread or
+        # task
+        self._pending_times = ContextLocal('pyslicer_pending_times')
+        self._response_info = ContextLocal('pyslicer_response_info')
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def rate_limiter(self):
+        return self._rate_limiter
+
+    @property
+    def hooks(self):
+        return tuple(self._hooks)
+
+    def _create_requester(self, use_ssl, timeout, pool_maxsize, pool_block,
+                          keep_alive, connect_timeout):
+        """Returns the Requester sending the requests of the client"""
+        return Requester(
+            use_ssl, timeout, pool_maxsize=pool_maxsize,
+            pool_block=pool_block, keep_alive=keep_alive,
+            connect_timeout=connect_timeout)
+
+    def pool_stats(self):
+        """Returns the utilization of the HTTP connection pools, see
+        Requester.pool_stats"""
+        return self._requester.pool_stats()
+
+    def add_hook(self, hook):
+        """Notify a RequestHook around every request
+
+        Keyword arguments:
+        hook(RequestHook) -- The hook to add
+        """
+        self._hooks.append(hook)
+
+    def _add_pending_time(self, name, seconds):
+        """Add time spent preparing the next request of this thread or task
+        to the RequestEvent attribute name"""
+        # A new dictionary, as tasks started from this one share its values
+        pending = dict(self._pending_times.get({}))
+        pending[name] = pending.get(name, 0) + seconds
+        self._pending_times.set(pending)
+
+    def _take_pending_times(self):
+        pending = self._pending_times.get({})
+        if pending:
+            self._pending_times.set({})
+        return pending
+
+    def _before_request(self, request):
+        if request.event is not None:
+            for hook in self._hooks:
+                hook.before_request(request.event)
+
+    def _after_request(self, request, error=None):
+        if request.event is not None:
+            request.event.finish(error)
+            for hook in self._hooks:
+                hook.after_request(request.event)
+
+    @property
+    def last_response(self):
+        """ResponseInfo of the last successful call made by the current
+        thread, or asyncio task, or None"""
+        return self._response_info.get()
 
     @property
     def status_code(self):
-        return self.__status_code
+        info = self._response_info.get()
+        return info.status_code if info is not None else None
 
     @property
     def headers(self):
-        return self.__headers
+        info = self._response_info.get()
+        return info.headers if info is not None else None
 
     @staticmethod
     def _organize_keys(master_key, custom_key, read_key, write_key):
@@ -79,48 +216,266 @@ class SlicingDiceAPI(object):
         return current_key_level[0]
 
     def _make_request(self, url, req_type, key_level, json_data=None,
-                      string_data=None, content_type='application/json'):
+                      string_data=None, content_type='application/json',
+                      cache_query=None, invalidates_cache=False, raw=False):
         """Returns a object request result
 
         Keyword arguments:
         url(string) -- the url to make a request
         req_type(string) -- the request type (POST, PUT, DELETE or GET)
         key_level(int) -- Define the key level needed
-        json_data(json) -- The json to use on request (default None)
+        json_data -- The body to send, a query serialized as JSON unless it
+            is already a string (default None)
         content_type(string) -- The content_type to use in the request (default
          'application/json')
+        cache_query -- The query identifying a cacheable read request
+            (default None)
+        invalidates_cache(bool) -- Define if a successful request clears the
+            query cache (default False)
+        raw(bool) -- Return the response body as undecoded bytes instead of
+            the decoded result (default False)
+        """
+        request = self._build_request(
+            url, req_type, key_level, json_data, string_data, content_type,
+            cache_query, invalidates_cache, raw)
+        self._before_request(request)
+        try:
+            result = self._run_request(request)
+        except Exception as e:
+            self._after_request(request, e)
+            raise
+        self._after_request(request)
+        return result
+
+    def _run_request(self, request):
+        """Returns the result of a request from the cache or the API,
+        retrying and rate limiting as configured
+
+        Keyword arguments:
+        request(_Request) -- A request built by _build_request
         """
+        cached = self._get_cached_result(request)
+        if cached is not None:
+            return cached
+        attempt = 1
+        while True:
+            delay = self._throttle_delay(request)
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                started = timer()
+                req = self._send_request(request)
+                self._record_response(request, req, started, attempt)
+                return self._handle_request_result(request, req)
+            except exceptions.SlicingDiceException as e:
+                delay = self._retry_delay(request, e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    def _throttle_delay(self, request):
+        """Returns the seconds the rate limiter wants a request to wait
+
+        Keyword arguments:
+        request(_Request) -- A request built by _build_request
+        """
+        if self._rate_limiter is None:
+            return 0
+        size = len(request.data) if request.data else 0
+        return self._rate_limiter.reserve(request.key_level, size)
+
+    def _retry_delay(self, request, error, attempt):
+        """Returns the seconds to wait before sending a failed request
+        again, or None if it must not be retried
+
+        Keyword arguments:
+        request(_Request) -- A request built by _build_request
+        error(SlicingDiceException) -- The error raised by the attempt
+        attempt(int) -- Number of the failed attempt, starting at 1
+        """
+        request.attempts = attempt
+        if request.event is not None:
+            request.event.attempts = attempt
+        policy = self._retry_policy
+        if policy is None or not policy.should_retry(
+                error, attempt, request.idempotent):
+            return None
+        return policy.delay(error, attempt)
+
+    def _build_request(self, url, req_type, key_level, json_data=None,
+                       string_data=None, content_type='application/json',
+                       cache_query=None, invalidates_cache=False, raw=False):
+        """Check the key and gather everything needed to send a request.
+        Takes the same arguments as _make_request."""
         self._check_key(key_level)
+        event = None
+        if self._hooks:
+            event = RequestEvent(url, req_type, key_level)
+            for name, seconds in six.iteritems(self._take_pending_times()):
+                setattr(event, name, seconds)
+            started = timer()
         headers = {'Content-Type': content_type,
-                   'Authorization': self._api_key}
+                   'Authorization': self._api_key,
+                   'Accept-Encoding': 'gzip, deflate'}
 
         data = json_data
+        if data is not None and not isinstance(
+                data, six.string_types + (bytes,)):
+            data = ujson.dumps(data)
         if string_data is not None and json_data is None:
             data = string_data
-        req = None
+        if (self.compress and data is not None and
+                len(data) >= self.compress_min_size):
+            data = gzip_compress(data)
+            headers['Content-Encoding'] = 'gzip'
+        if event is not None:
+            event.serialization_time = timer() - started
+            event.bytes_sent = len(data) if data is not None else 0
+
+        cache_key = cache_ttl = None
+        if cache_query is not None and self._cache is not None:
+            cache_key = self._cache.make_key(
+                url, self._api_key, key_level, cache_query)
+            cache_ttl = self._cache.ttl_for(url, cache_query)
+        # Reads never change data, which is what read level keys are for;
+        # the exception is sql, whose statements may write
+        idempotent = req_type == "get" or (
+            key_level == 0 and not invalidates_cache)
+        return _Request(
+            url, req_type, data, headers, cache_key, cache_ttl,
+            cache_bypass=wants_bypass(cache_query),
+            invalidates_cache=invalidates_cache,
+            idempotent=idempotent,
+            key_level=key_level,
+            raw=raw,
+            event=event)
 
-        if req_type == "post":
+    def _get_cached_result(self, request):
+        """Returns the cached result of a request or None
+
+        Keyword arguments:
+        request(_Request) -- A request built by _build_request
+        """
+        if request.cache_key is None or request.cache_bypass:
+            return None
+        return self._cached_result(request, self._cache.get(request.cache_key))
+
+    def _cached_result(self, request, body):
+        """Returns the result of a request from its cached body, or None
+        when it wasn't cached
+
+        Keyword arguments:
+        request(_Request) -- A request built by _build_request
+        body(bytes) -- The cached response body or None
+        """
+        if body is None:
+            return None
+        if request.event is not None:
+            request.event.cached = True
+            request.event.bytes_received = len(body)
+        self._response_info.set(ResponseInfo(
+            bytes_sent=len(request.data) if request.data else 0,
+            bytes_received=len(body),
+            cached=True))
+        if request.raw:
+            return body
+        return ujson.loads(body)
+
+    def _send_request(self, request):
+        """Send a request through the requester
+
+        Keyword arguments:
+        request(_Request) -- A request built by _build_request
+        """
+        req = None
+        if request.req_type == "post":
             req = self._requester.post(
-                url,
-                data=data,
-                headers=headers)
-        elif req_type == "get":
+                request.url,
+                data=request.data,
+                headers=request.headers)
+        elif request.req_type == "get":
             req = self._requester.get(
-                url,
-                headers=headers)
+                request.url,
+                headers=request.headers)
 
-        elif req_type == "delete":
-            req = self._requester.get(
-                url,
-                headers=headers)
+        elif request.req_type == "delete":
+            req = self._requester.delete(
+                request.url,
+                headers=request.headers)
 
-        elif req_type == "put":
+        elif request.req_type == "put":
             req = self._requester.put(
-                url,
-                data=data,
-                headers=headers)
+                request.url,
+                data=request.data,
+                headers=request.headers)
+        return req
+
+    @staticmethod
+    def _record_response(request, req, started, attempt):
+        """Add what is known of a response before decoding it to a request
+        and its event
+
+        Keyword arguments:
+        request(_Request) -- A request built by _build_request
+        req -- the request object
+        started(float) -- timer() value when the request was sent
+        attempt(int) -- Number of the attempt, starting at 1
+        """
+        request.latency = timer() - started
+        request.attempts = attempt
+        event = request.event
+        if event is not None:
+            event.latency = request.latency
+            event.attempts = attempt
+            if req is not None:
+                event.status_code = req.status_code
+                event.bytes_received = len(req.content)
 
-        return self._handler_request(req)
+    def _handle_request_result(self, request, req):
+        """Handle a response and keep the query cache up to date
+
+        Keyword arguments:
+        request(_Request) -- A request built by _build_request
+        req -- the request object
+        """
+        result = self._decode_result(request, req)
+        self._update_cache(request, req)
+        return result
+
+    def _decode_result(self, request, req):
+        """Decode a response, raising the API errors it holds"""
+        event = request.event
+        if event is not None:
+            started = timer()
+        if request.raw:
+            result = self._handler_raw_request(req)
+        else:
+            result = self._handler_request(req)
+        took = result.get('took') if isinstance(result, dict) else None
+        if event is not None:
+            event.parse_time = timer() - started
+            event.server_took = took
+        self._response_info.set(ResponseInfo(
+            status_code=int(req.status_code),
+            headers=dict(req.headers),
+            took=took,
+            bytes_sent=len(request.data) if request.data else 0,
+            bytes_received=len(req.content),
+            latency=request.latency,
+            attempts=request.attempts))
+        return result
+
+    def _update_cache(self, request, req):
+        """Store the response of a read query, or clear the cache after a
+        write"""
+        if self._cache is not None:
+            if request.cache_key is not None:
+                self._cache.set(
+                    request.cache_key, req.content, request.cache_ttl)
+            elif (request.invalidates_cache and
+                    self._cache.invalidate_on_write):
+                self._cache.clear()
 
     def _handler_request(self, req):
         """Handler request response
@@ -132,10 +487,14 @@ class SlicingDiceAPI(object):
             raise exceptions.SlicingDiceException("Bad request.")
 
         try:
-            result = ujson.loads(req.text)
+            # Parsing the bytes skips the charset detection and the unicode
+            # copy made by req.text
+            result = ujson.loads(req.content)
         except ValueError as e:
+            # Proxies and load balancers answer errors without a JSON body
+            self._check_request(req)
             raise exceptions.InternalException("Error while trying to load"
-                                               " Json: %s" % e.message)
+                                               " Json: %s" % e)
 
         sd_response = SDHandlerResponse(
             result=result,
@@ -144,9 +503,23 @@ class SlicingDiceAPI(object):
 
         if sd_response.request_successful():
             if self._check_request(req):
-                self._set_properties_values(sd_response)
                 return sd_response.result
 
+    def _handler_raw_request(self, req):
+        """Handler request response without decoding a successful body
+
+        Keyword arguments:
+        req -- the request object
+        """
+        if req is None:
+            raise exceptions.SlicingDiceException("Bad request.")
+
+        content = req.content
+        # Only bodies that may carry an API error need to be decoded
+        if req.status_code != requests.codes.ok or b'"errors"' in content:
+            self._handler_request(req)
+        return content
+
     @staticmethod
     def _check_request(request):
         """Check if the request was successful
@@ -154,16 +527,9 @@ class SlicingDiceAPI(object):
         Keyword arguments:
         request -- A object request result
         """
-        if request.status_code is not requests.codes.ok:
+        if request.status_code != requests.codes.ok:
             raise exceptions.SlicingDiceHTTPError(
-                "HTTP status code: {}".format(request.status_code))
+                "HTTP status code: {}".format(request.status_code),
+                retry_after=parse_retry_after(request.headers),
+                status_code=request.status_code)
         return True
-
-    def _set_properties_values(self, sd_response):
-        """Set current status code and header request response in objects
-
-        Keyword arguments:
-        sd_response -- A request object
-        """
-        self.__status_code = int(sd_response.status_code)
-        self.__headers = dict(sd_response.headers)
@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Asyncio interface to Slicing Dice API (Python 3.5+ only).
+
+Requires the optional aiohttp dependency:
+
+    pip install pyslicer[async]
+"""
+import asyncio
+import collections
+import socket
+
+import ujson
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from . import exceptions
+from .client import SlicingDice, _ExistsCollector
+from .core.cache import MemoryCacheBackend
+from .core.columnar import ColumnarResult
+from .core.instrumentation import timer
+from .core.requester import keep_alive_settings
+from .url_resources import URLResources
+from .utils import query_utils, validators
+from .utils.validators import MAX_EXISTS_ENTITY_IDS, MAX_INSERTION_BATCH_BYTES
+
+
+class _AsyncResponse(object):
+    """Exposes an already read aiohttp response with the attributes used by
+    SlicingDiceAPI._handler_request."""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+
+class AsyncSlicingDice(SlicingDice):
+    """An asyncio interface to Slicing Dice API
+
+    Every endpoint method of SlicingDice is available with the same
+    arguments and validation, but returns an awaitable. Requests go through
+    a non-blocking aiohttp session with its own connection pool.
+
+    Example usage:
+
+        async with AsyncSlicingDice(master_key='my-key') as sd:
+            results = await asyncio.gather(
+                sd.count_entity(query_a), sd.count_entity(query_b))
+    """
+
+    def __init__(
+            self, write_key=None, read_key=None, master_key=None,
+            custom_key=None, use_ssl=True, timeout=60, max_workers=1,
+            cache=None, retry_policy=None, rate_limiter=None,
+            compress=False, compress_min_size=1024, validation='full',
+            hooks=None, connect_timeout=None, pool_maxsize=100,
+            pool_block=True, keep_alive=None):
+        """Instantiate a new AsyncSlicingDice object.
+
+        Keyword arguments:
+        use_ssl(bool) -- Define if the request uses verification SSL for
+            HTTPS requests.(Optional)
+        timeout(int) -- Define timeout to request, defaults 60 secs(Optional)
+        max_workers(int) -- Number of requests sent concurrently by
+            bulk_insert and insert_many, defaults 1(Optional).
+        cache(QueryCache) -- Cache for read query results, defaults
+            None(Optional).
+        retry_policy(RetryPolicy) -- Define how failed requests are retried,
+            defaults None, no retries(Optional).
+        rate_limiter(RateLimiter) -- Paces outgoing requests, can be shared
+            between clients, defaults None(Optional).
+        compress(bool) -- Define if request bodies are sent gzip
+            compressed, defaults False(Optional).
+        compress_min_size(int) -- Smallest body compressed, defaults
+            1024 bytes(Optional).
+        validation(string) -- Client side validation level: 'full',
+            'structural' or 'off', defaults 'full'(Optional).
+        hooks(list) -- RequestHook objects notified around every request,
+            defaults None(Optional).
+        connect_timeout(float) -- Define timeout to establish a connection,
+            defaults to timeout(Optional).
+        pool_maxsize(int) -- Maximum number of simultaneous connections,
+            defaults 100(Optional).
+        pool_block(bool) -- Requests beyond pool_maxsize always wait for a
+            free connection, False is not supported(Optional).
+        keep_alive -- True or a dictionary with 'idle', 'interval' and
+            'count' to enable TCP keep-alive probes, defaults
+            None(Optional).
+        """
+        if aiohttp is None:
+            raise exceptions.SlicingDiceException(
+                "AsyncSlicingDice requires the 'aiohttp' package.")
+        if not pool_block:
+            raise exceptions.SlicingDiceException(
+                "AsyncSlicingDice doesn't open connections beyond "
+                "pool_maxsize, pool_block=False is not supported.")
+        super(AsyncSlicingDice, self).__init__(
+            write_key, read_key, master_key, custom_key, use_ssl, timeout,
+            max_workers=max_workers, cache=cache, retry_policy=retry_policy,
+            rate_limiter=rate_limiter, compress=compress,
+            compress_min_size=compress_min_size, validation=validation,
+            hooks=hooks, pool_maxsize=pool_maxsize, keep_alive=keep_alive,
+            connect_timeout=connect_timeout)
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_maxsize = pool_maxsize
+        self._socket_options = keep_alive_settings(keep_alive)
+        self._session = None
+
+    def _create_requester(self, *args):
+        # Requests go through the aiohttp session instead
+        return None
+
+    def pool_stats(self):
+        """Returns the utilization of the aiohttp connection pool: the
+        connections in use and idle, and the connections kept open at most.
+        Empty until the first request."""
+        if self._session is None:
+            return {}
+        connector = self._session.connector
+        return {
+            'in_use': len(connector._acquired),
+            'idle': sum(len(conns) for conns in connector._conns.values()),
+            'maxsize': connector.limit,
+        }
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Close the underlying connection pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        # aiohttp sessions must be created inside a running event loop
+        if self._session is None:
+            connector_options = {'limit': self.pool_maxsize}
+            if self._socket_options:
+                connector_options['socket_factory'] = self._create_socket
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**connector_options),
+                timeout=aiohttp.ClientTimeout(
+                    total=self.timeout, sock_connect=self.connect_timeout))
+        return self._session
+
+    def _create_socket(self, addr_info):
+        family, socket_type, proto = addr_info[:3]
+        sock = socket.socket(family, socket_type, proto)
+        for level, option, value in self._socket_options:
+            sock.setsockopt(level, option, value)
+        return sock
+
+    def _make_request(self, *args, **kwargs):
+        """Returns an awaitable with the request result
+
+        Takes the same arguments as SlicingDiceAPI._make_request. The key is
+        checked right away, so invalid keys raise before anything is awaited.
+        """
+        request = self._build_request(*args, **kwargs)
+        self._before_request(request)
+        return self._make_async_request(request)
+
+    async def _make_async_request(self, request):
+        try:
+            result = await self._run_async_request(request)
+        except BaseException as e:
+            self._after_request(request, e)
+            raise
+        self._after_request(request)
+        return result
+
+    async def _run_cache(self, func, *args):
+        """Call a cache method, on the default executor when the cache
+        backend does I/O, such as SQLite or memcached, so it doesn't block
+        the event loop"""
+        if isinstance(self._cache.backend, MemoryCacheBackend):
+            return func(*args)
+        return await asyncio.get_event_loop().run_in_executor(
+            None, func, *args)
+
+    async def _run_async_request(self, request):
+        if request.cache_key is not None and not request.cache_bypass:
+            cached = self._cached_result(request, await self._run_cache(
+                self._cache.get, request.cache_key))
+            if cached is not None:
+                return cached
+        attempt = 1
+        while True:
+            delay = self._throttle_delay(request)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                started = timer()
+                req = await self._send_async_request(request)
+                self._record_response(request, req, started, attempt)
+                result = self._decode_result(request, req)
+                if self._cache is not None:
+                    await self._run_cache(self._update_cache, request, req)
+                return result
+            except exceptions.SlicingDiceException as e:
+                delay = self._retry_delay(request, e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send_async_request(self, request):
+        data = request.data
+        if request.req_type in ("get", "delete"):
+            data = None
+        try:
+            async with self._get_session().request(
+                    request.req_type.upper(), request.url, data=data,
+                    headers=request.headers,
+                    ssl=None if self.use_ssl else False) as response:
+                content = await response.read()
+                return _AsyncResponse(
+                    response.status, response.headers, content)
+        except aiohttp.ClientConnectorError as e:
+            raise exceptions.SlicingDiceHTTPError(e, request_sent=False)
+        except aiohttp.ClientError as e:
+            raise exceptions.SlicingDiceHTTPError(e)
+        except asyncio.TimeoutError as e:
+            raise exceptions.SlicingDiceHTTPError(e)
+
+    async def _ordered_gather(self, func, iterable, max_in_flight=None):
+        """Await func(item) for every item keeping up to max_in_flight of
+        them, max_workers by default, in flight, returning the results in
+        the order of iterable."""
+        max_in_flight = max_in_flight or self.max_workers
+        results = []
+        pending = collections.deque()
+        try:
+            for item in iterable:
+                if len(pending) >= max_in_flight:
+                    results.append(await pending.popleft())
+                pending.append(asyncio.ensure_future(func(item)))
+            while pending:
+                results.append(await pending.popleft())
+        finally:
+            for task in pending:
+                task.cancel()
+        return results
+
+    async def _send_split_query(self, url, sub_queries, raw=False,
+                                max_in_flight=None, unique=False):
+        """Asynchronous version of SlicingDice._send_split_query"""
+        responses = await self._ordered_gather(
+            lambda sub_query: self._send_query(url, sub_query),
+            sub_queries, max_in_flight or self.pool_maxsize)
+        merged = query_utils.merge_results(responses, unique)
+        if raw:
+            return ujson.dumps(merged).encode('utf-8')
+        return merged
+
+    async def bulk_insert(self, entities, auto_create=None,
+                          max_batch_bytes=MAX_INSERTION_BATCH_BYTES,
+                          validation=None):
+        """Asynchronous version of SlicingDice.bulk_insert"""
+        bodies = self._iter_insert_bodies(
+            entities, auto_create, max_batch_bytes,
+            self._validation_level(validation))
+        return await self._ordered_gather(self._send_insert_body, bodies)
+
+    async def create_column(self, data, validation=None):
+        """Asynchronous version of SlicingDice.create_column"""
+        if self._validate(validators.ColumnValidator, data, validation):
+            url = SlicingDice.BASE_URL + URLResources.COLUMN
+            result = await self._make_request(
+                url=url,
+                req_type="post",
+                json_data=data,
+                key_level=1)
+            self._schema.add(data, result)
+            return result
+
+    async def insert_rows(self, rows, columns, column_types=None,
+                          auto_create=None,
+                          max_batch_bytes=MAX_INSERTION_BATCH_BYTES,
+                          validation=None):
+        """Asynchronous version of SlicingDice.insert_rows"""
+        bodies = self._iter_row_bodies(
+            rows, columns,
+            self._insert_types(await self._async_column_types(),
+                               column_types),
+            auto_create, max_batch_bytes, self._validation_level(validation))
+        return await self._ordered_gather(self._send_insert_body, bodies)
+
+    async def insert_many(self, batches, validation=None):
+        """Asynchronous version of SlicingDice.insert_many"""
+        def insert(batch):
+            return self.insert(batch, validation)
+
+        return await self._ordered_gather(insert, batches)
+
+    def insert_buffer(self, linger_ms=100, **options):
+        """InsertBuffer sends its batches from threads, which can't await the
+        requests of this client; use a SlicingDice client instead"""
+        raise exceptions.SlicingDiceException(
+            "insert_buffer() sends batches from threads and isn't available "
+            "on AsyncSlicingDice. Create it from a SlicingDice client with "
+            "the same keys.")
+
+    def insert_spool(self, directory, **options):
+        """InsertSpool sends its requests from threads, which can't await
+        the requests of this client; use a SlicingDice client instead"""
+        raise exceptions.SlicingDiceException(
+            "insert_spool() sends requests from threads and isn't available "
+            "on AsyncSlicingDice. Create it from a SlicingDice client with "
+            "the same keys.")
+
+    async def iter_exists_entities(self, ids, dimension=None,
+                                   max_in_flight=None):
+        """Asynchronous version of SlicingDice.iter_exists_entities, to be
+        used with 'async for'"""
+        max_in_flight = max_in_flight or self.pool_maxsize
+        chunks = query_utils.iter_unique_chunks(ids, MAX_EXISTS_ENTITY_IDS)
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                if len(pending) >= max_in_flight:
+                    for result in self._exists_pairs(
+                            await pending.popleft()):
+                        yield result
+                pending.append(asyncio.ensure_future(
+                    self.exists_entity(chunk, dimension)))
+            while pending:
+                for result in self._exists_pairs(await pending.popleft()):
+                    yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def exists_entities(self, ids, dimension=None, sink=None,
+                              max_in_flight=None):
+        """Asynchronous version of SlicingDice.exists_entities"""
+        collect = _ExistsCollector(sink)
+        async for entity_id, exists in self.iter_exists_entities(
+                ids, dimension, max_in_flight):
+            collect.add(entity_id, exists)
+        return collect.result()
+
+    async def _iter_async_pages(self, url, query, max_in_flight):
+        """Yield every page of a validated data extraction query, fetching
+        up to max_in_flight pages ahead of the one being consumed"""
+        pages = asyncio.Queue(maxsize=max(1, max_in_flight))
+
+        async def produce():
+            try:
+                while True:
+                    page = await self._make_request(
+                        url=url,
+                        json_data=ujson.dumps(query),
+                        req_type="post",
+                        key_level=0)
+                    await pages.put((True, page))
+                    next_page = page.get('next-page')
+                    if not next_page:
+                        break
+                    query['page'] = next_page
+            except Exception as e:
+                await pages.put((False, e))
+                return
+            await pages.put((None, None))
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                produced, page = await pages.get()
+                if produced is None:
+                    return
+                if not produced:
+                    raise page
+                yield page
+        finally:
+            producer.cancel()
+
+    async def _iter_async_data_extraction(self, url, query, page_size,
+                                          max_in_flight):
+        pages = self._iter_async_pages(
+            url, self._paged_query(query, page_size), max_in_flight)
+        async for page in pages:
+            for entity in self._page_entities(page):
+                yield entity
+
+    async def _async_data_extraction_columns(self, url, query, page_size,
+                                             max_in_flight):
+        query = self._paged_query(query, page_size)
+        column_types = await self._async_column_types()
+        columns = ColumnarResult(column_types)
+        async for page in self._iter_async_pages(url, query, max_in_flight):
+            columns.append_page(page)
+        return columns
+
+    async def load_schema(self, refresh=False):
+        """Asynchronous version of SlicingDice.load_schema"""
+        if refresh or not self._schema.loaded:
+            self._schema.load(await self.get_columns())
+        return self._schema
+
+    async def _async_column_types(self):
+        """Asynchronous version of SlicingDice._column_types"""
+        schema = self._schema
+        if (not schema.loaded or schema.stale) and self._get_key()[1] == 2:
+            await self.load_schema(refresh=True)
+        if schema.loaded or len(schema):
+            return schema.types()
+        return None
+
+    async def result(self, query, raw=False, validation=None,
+                     columnar=False):
+        """Asynchronous version of SlicingDice.result"""
+        response = await super(AsyncSlicingDice, self).result(
+            query, raw and not columnar, validation)
+        if columnar:
+            return self._decode_columnar(
+                [response], await self._async_column_types())
+        return response
+
+    async def score(self, query, raw=False, validation=None,
+                    columnar=False):
+        """Asynchronous version of SlicingDice.score"""
+        response = await super(AsyncSlicingDice, self).score(
+            query, raw and not columnar, validation)
+        if columnar:
+            return self._decode_columnar(
+                [response], await self._async_column_types())
+        return response
+
+    async def sql(self, query, raw=False, columnar=False):
+        """Asynchronous version of SlicingDice.sql"""
+        response = await super(AsyncSlicingDice, self).sql(
+            query, raw and not columnar)
+        if columnar:
+            return self._decode_columnar(
+                [response], await self._async_column_types())
+        return response
+
+    def iter_result(self, query, page_size=None, max_in_flight=1):
+        """Asynchronous version of SlicingDice.iter_result, to be used with
+        'async for'"""
+        url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_RESULT
+        return self._iter_async_data_extraction(
+            url, query, page_size, max_in_flight)
+
+    def iter_score(self, query, page_size=None, max_in_flight=1):
+        """Asynchronous version of SlicingDice.iter_score, to be used with
+        'async for'"""
+        url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_SCORE
+        return self._iter_async_data_extraction(
+            url, query, page_size, max_in_flight)
+
+    async def result_columns(self, query, page_size=None, max_in_flight=1):
+        """Asynchronous version of SlicingDice.result_columns"""
+        url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_RESULT
+        return await self._async_data_extraction_columns(
+            url, query, page_size, max_in_flight)
+
+    async def score_columns(self, query, page_size=None, max_in_flight=1):
+        """Asynchronous version of SlicingDice.score_columns"""
+        url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_SCORE
+        return await self._async_data_extraction_columns(
+            url, query, page_size, max_in_flight)
@@ -16,12 +16,44 @@
 # limitations under the License.
 
 """A library that provides a Python client to Slicing Dice API"""
+import six
 import ujson
 
 from . import exceptions
 from .api import SlicingDiceAPI
+from .core.cache import wants_bypass
+from .core.columnar import ColumnarResult
+from .core.encoder import RowEncoder
+from .core.executor import ordered_map, prefetch
+from .core.insert_buffer import InsertBuffer
+from .core.instrumentation import timer
+from .core.prepared import PreparedQuery, compile_json, compile_sql
+from .core.schema import SchemaCache
+from .core.spool import InsertSpool
 from .url_resources import URLResources
-from .utils import validators
+from .utils import batch_utils, query_utils, validators
+
+
+class _ExistsCollector(object):
+    """Gathers the results of exists_entities, in lists or in a sink."""
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        if sink is None:
+            self.found = {'exists': [], 'not-exists': []}
+        else:
+            self.found = {'exists': 0, 'not-exists': 0}
+
+    def add(self, entity_id, exists):
+        status = 'exists' if exists else 'not-exists'
+        if self.sink is None:
+            self.found[status].append(entity_id)
+        else:
+            self.found[status] += 1
+            self.sink.write(u'{0}\t{1}\n'.format(status, entity_id))
+
+    def result(self):
+        return self.found
 
 
 class SlicingDice(SlicingDiceAPI):
@@ -80,9 +112,25 @@ class SlicingDice(SlicingDiceAPI):
                 print sd.insert(inserting_json)
     """
 
+    # Endpoints accepted by prepare(), with the validator of their queries
+    _PREPARED_ENDPOINTS = {
+        'count_entity': (URLResources.QUERY_COUNT_ENTITY,
+                         validators.QueryCountValidator),
+        'count_event': (URLResources.QUERY_COUNT_EVENT,
+                        validators.QueryCountValidator),
+        'top_values': (URLResources.QUERY_TOP_VALUES,
+                       validators.QueryValidator),
+        'aggregation': (URLResources.QUERY_AGGREGATION, None),
+        'sql': (URLResources.QUERY_SQL, None),
+    }
+
     def __init__(
             self, write_key=None, read_key=None, master_key=None,
-            custom_key=None, use_ssl=True, timeout=60):
+            custom_key=None, use_ssl=True, timeout=60, max_workers=1,
+            cache=None, retry_policy=None, rate_limiter=None,
+            compress=False, compress_min_size=1024, validation='full',
+            hooks=None, pool_maxsize=None, pool_block=False, keep_alive=None,
+            connect_timeout=None):
         """Instantiate a new SlicingDice object.
 
         Keyword arguments:
@@ -91,39 +139,263 @@ class SlicingDice(SlicingDiceAPI):
             HTTPS requests. Defaults False.(Optional)
         timeout(int) -- Define timeout to request,
             defaults 60 secs(default 30).
+        max_workers(int) -- Number of requests sent concurrently by
+            bulk_insert and insert_many, defaults 1(Optional).
+        cache(QueryCache) -- Cache for count_entity, count_event,
+            top_values, aggregation, result, score and sql results,
+            defaults None(Optional).
+        retry_policy(RetryPolicy) -- Define how failed requests are retried,
+            defaults None, no retries(Optional).
+        rate_limiter(RateLimiter) -- Paces outgoing requests, can be shared
+            between clients, defaults None(Optional).
+        compress(bool) -- Define if request bodies are sent gzip
+            compressed, defaults False(Optional).
+        compress_min_size(int) -- Smallest body compressed, defaults
+            1024 bytes(Optional).
+        validation(string) -- Client side validation level: 'full',
+            'structural' (limits and required keys only) or 'off',
+            defaults 'full'(Optional).
+        hooks(list) -- RequestHook objects notified around every request,
+            such as a MetricsCollector, defaults None(Optional).
+        pool_maxsize(int) -- Connections kept open, defaults to
+            max(10, max_workers)(Optional).
+        pool_block(bool) -- Wait for a free pooled connection instead of
+            opening a short-lived one when all are in use, defaults
+            False(Optional).
+        keep_alive -- True or a dictionary with 'idle', 'interval' and
+            'count' to enable TCP keep-alive probes, defaults
+            None(Optional).
+        connect_timeout(float) -- Define timeout to establish a connection,
+            defaults to timeout(Optional).
         """
         super(SlicingDice, self).__init__(
-            master_key, write_key, read_key, custom_key, use_ssl, timeout)
+            master_key, write_key, read_key, custom_key, use_ssl, timeout,
+            max_workers=max_workers, cache=cache, retry_policy=retry_policy,
+            rate_limiter=rate_limiter, compress=compress,
+            compress_min_size=compress_min_size, hooks=hooks,
+            pool_maxsize=pool_maxsize, pool_block=pool_block,
+            keep_alive=keep_alive, connect_timeout=connect_timeout)
+        self.validation = validators.check_level(validation)
+        self._schema = SchemaCache()
+
+    @property
+    def schema(self):
+        """The SchemaCache of this client, empty until load_schema() is
+        called"""
+        return self._schema
+
+    def _validation_level(self, validation):
+        """Returns the validation level of a call
+
+        Keyword arguments:
+        validation(string) -- The level asked for the call, or None
+        """
+        if validation is None:
+            return self.validation
+        return validators.check_level(validation)
+
+    def _validate(self, validator_class, data, validation=None):
+        """Run a validator at the validation level of a call.
 
-    def _count_query_wrapper(self, url, query):
+        Keyword arguments:
+        validator_class -- A SDBaseValidator subclass
+        data -- The query, insertion or column to validate
+        validation(string) -- The level asked for the call, or None
+        """
+        level = self._validation_level(validation)
+        if level == validators.VALIDATION_OFF:
+            return True
+        if not self._hooks:
+            return validator_class(data, level).validator()
+        started = timer()
+        result = validator_class(data, level).validator()
+        self._add_pending_time('validation_time', timer() - started)
+        return result
+
+    def _count_query_wrapper(self, url, query, raw=False, validation=None,
+                             max_in_flight=None):
         """Validate count query and make request.
 
+        Lists of more than MAX_QUERY_SIZE named queries are split in
+        sub-requests, see _send_split_query.
+
         Keyword arguments:
         url(string) -- Url to make request
         query(dict) -- A count query
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        max_in_flight(int) -- Sub-requests sent at a time when the query
+            is split (default None, the connection pool size)
         """
-        sd_count_query = validators.QueryCountValidator(query)
-        if sd_count_query.validator():
-            return self._make_request(
-                url=url,
-                json_data=ujson.dumps(query),
-                req_type="post",
-                key_level=0)
+        if (isinstance(query, list) and
+                len(query) > validators.MAX_QUERY_SIZE):
+            sub_queries = query_utils.chunks(query, validators.MAX_QUERY_SIZE)
+            for sub_query in sub_queries:
+                self._validate(
+                    validators.QueryCountValidator, sub_query, validation)
+            return self._send_split_query(
+                url, sub_queries, raw, max_in_flight)
+        if self._validate(
+                validators.QueryCountValidator, query, validation):
+            return self._send_query(url, query, raw)
+
+    def _send_query(self, url, query, raw=False):
+        """Make a read query request
 
-    def _data_extraction_wrapper(self, url, query):
+        Keyword arguments:
+        url(string) -- Url to make request
+        query -- A dictionary or list query
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        """
+        return self._make_request(
+            url=url,
+            json_data=query,
+            req_type="post",
+            key_level=0,
+            cache_query=query,
+            raw=raw)
+
+    def _send_split_query(self, url, sub_queries, raw=False,
+                          max_in_flight=None, unique=False):
+        """Send the sub-queries of a query split in API sized requests
+        concurrently and merge their results in a single response.
+
+        Keyword arguments:
+        url(string) -- Url to make request
+        sub_queries(list) -- The queries to send
+        raw(bool) -- Return the merged response encoded as bytes
+            (default False)
+        max_in_flight(int) -- Sub-requests sent at a time (default None,
+            the connection pool size)
+        unique(bool) -- Raise if two sub-queries return the same result key
+            (default False)
+        """
+        def send(sub_query):
+            return self._send_query(url, sub_query)
+
+        # Sub-queries are sent from other threads, which can't pick up the
+        # validation time of this one
+        self._take_pending_times()
+        responses = ordered_map(
+            send, sub_queries,
+            max_in_flight or self._requester.pool_maxsize)
+        merged = query_utils.merge_results(responses, unique)
+        if raw:
+            return ujson.dumps(merged).encode('utf-8')
+        return merged
+
+    def _data_extraction_wrapper(self, url, query, raw=False,
+                                 validation=None):
         """Validate data extraction query and make request.
 
         Keyword arguments:
         url(string) -- Url to make request
         query(dict) -- A data extraction query
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
         """
-        sd_extraction_result = validators.QueryDataExtractionValidator(query)
-        if sd_extraction_result.validator():
+        if self._validate(
+                validators.QueryDataExtractionValidator, query, validation):
             return self._make_request(
                 url=url,
-                json_data=ujson.dumps(query),
+                json_data=query,
+                req_type="post",
+                key_level=0,
+                cache_query=query,
+                raw=raw)
+
+    def _paged_query(self, query, page_size):
+        """Validate a data extraction query and return a copy to be sent
+        page by page.
+
+        Keyword arguments:
+        query(dict) -- A data extraction query
+        page_size(int) -- Entities per page, overrides the query 'limit'
+        """
+        query = dict(query)
+        if page_size is not None:
+            query['limit'] = page_size
+        self._validate(validators.QueryDataExtractionValidator, query)
+        return query
+
+    def _iter_pages(self, url, query):
+        """Yield every page of a data extraction query, following
+        'next-page'.
+
+        Keyword arguments:
+        url(string) -- Url to make request
+        query(dict) -- A validated data extraction query, updated with the
+            page to request
+        """
+        while True:
+            page = self._make_request(
+                url=url,
+                json_data=query,
                 req_type="post",
                 key_level=0)
+            yield page
+            next_page = page.get('next-page')
+            if not next_page:
+                return
+            query['page'] = next_page
+
+    def _iter_data_extraction(self, url, query, page_size, max_in_flight):
+        """Returns an iterator over every entity of a data extraction query,
+        fetching the next pages in background.
+
+        Keyword arguments:
+        url(string) -- Url to make request
+        query(dict) -- A data extraction query
+        page_size(int) -- Entities per page
+        max_in_flight(int) -- Pages fetched ahead of the one being consumed
+        """
+        pages = self._iter_pages(url, self._paged_query(query, page_size))
+        return self._iter_page_entities(prefetch(pages, max_in_flight))
+
+    @classmethod
+    def _iter_page_entities(cls, pages):
+        for page in pages:
+            for entity in cls._page_entities(page):
+                yield entity
+
+    @staticmethod
+    def _page_entities(page):
+        """Returns the (entity_id, columns) pairs of a data extraction page,
+        whose 'data' is a list of rows holding their 'entity-id'"""
+        entities = []
+        for row in page.get('data') or ():
+            columns = dict(row)
+            entities.append((columns.pop('entity-id', None), columns))
+        return entities
+
+    def _column_types(self):
+        """Returns the type of every column, loading the schema first if it
+        wasn't or columns of unknown name were created since, when the key is
+        allowed to. Returns None if no column is known"""
+        schema = self._schema
+        if (not schema.loaded or schema.stale) and self._get_key()[1] == 2:
+            self.load_schema(refresh=True)
+        if schema.loaded or len(schema):
+            return schema.types()
+        return None
+
+    @staticmethod
+    def _decode_columnar(pages, column_types):
+        """Returns a ColumnarResult with the rows of decoded pages
+
+        Keyword arguments:
+        pages -- An iterable of decoded responses
+        column_types(dict) -- The type of known columns, or None
+        """
+        columns = ColumnarResult(column_types)
+        for page in pages:
+            columns.append_page(page)
+        return columns
 
     def _saved_query_wrapper(self, url, query, update=False):
         """Validate saved query and make request.
@@ -139,7 +411,7 @@ class SlicingDice(SlicingDiceAPI):
             req_type = "put"
         return self._make_request(
             url=url,
-            json_data=ujson.dumps(query),
+            json_data=query,
             req_type=req_type,
             key_level=2)
 
@@ -153,21 +425,24 @@ class SlicingDice(SlicingDiceAPI):
             key_level=2
         )
 
-    def create_column(self, data):
+    def create_column(self, data, validation=None):
         """Create column in Slicing Dice
 
         Keyword arguments:
         data -- A dictionary or list on the Slicing Dice column
             format.
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
         """
-        sd_data = validators.ColumnValidator(data)
-        if sd_data.validator():
+        if self._validate(validators.ColumnValidator, data, validation):
             url = SlicingDice.BASE_URL + URLResources.COLUMN
-            return self._make_request(
+            result = self._make_request(
                 url=url,
                 req_type="post",
-                json_data=ujson.dumps(data),
+                json_data=data,
                 key_level=1)
+            self._schema.add(data, result)
+            return result
 
     def get_columns(self):
         """Get a list of columns"""
@@ -177,37 +452,229 @@ class SlicingDice(SlicingDiceAPI):
             req_type="get",
             key_level=2)
 
-    def insert(self, data):
+    def load_schema(self, refresh=False):
+        """Load the columns of the database in the schema cache, with
+        get_columns, and return the cache. Only the first call makes a
+        request unless refresh is set.
+
+        Keyword arguments:
+        refresh(bool) -- Load the columns again (default False)
+        """
+        if refresh or not self._schema.loaded:
+            self._schema.load(self.get_columns())
+        return self._schema
+
+    def insert(self, data, validation=None):
         """Insert data into Slicing Dice API
 
         Keyword arguments:
         data -- A dictionary in the Slicing Dice data format
             format.
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
         """
-        sd_data = validators.InsertValidator(data)
-        if sd_data.validator():
+        if self._validate(validators.InsertValidator, data, validation):
             url = SlicingDice.BASE_URL + URLResources.INSERT
             return self._make_request(
                 url=url,
-                json_data=ujson.dumps(data),
+                json_data=data,
                 req_type="post",
-                key_level=1)
+                key_level=1,
+                invalidates_cache=True)
+
+    def bulk_insert(self, entities, auto_create=None,
+                    max_batch_bytes=validators.MAX_INSERTION_BATCH_BYTES,
+                    validation=None):
+        """Insert any number of entities, splitting them into batches the
+        API accepts.
+
+        Entities are consumed lazily, so generators of any size can be used.
+        Returns a list with the API response of each batch.
+
+        Keyword arguments:
+        entities -- An iterable of (entity_id, columns) pairs or a dictionary
+            in the Slicing Dice data format.
+        auto_create(list) -- Value of the 'auto-create' parameter sent with
+            every batch (default None)
+        max_batch_bytes(int) -- Maximum request body size of each batch
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        """
+        bodies = self._iter_insert_bodies(
+            entities, auto_create, max_batch_bytes,
+            self._validation_level(validation))
+        return list(ordered_map(
+            self._send_insert_body, bodies, self.max_workers))
+
+    @staticmethod
+    def _iter_insert_bodies(entities, auto_create, max_batch_bytes,
+                            validation):
+        """Serialize entities into insert bodies accepted by the API.
+
+        Keyword arguments:
+        entities -- An iterable of (entity_id, columns) pairs or a dictionary
+            in the Slicing Dice data format.
+        auto_create(list) -- Value of the 'auto-create' parameter
+        max_batch_bytes(int) -- Maximum request body size of each batch
+        validation(string) -- The validation level
+        """
+        if isinstance(entities, dict):
+            if auto_create is None:
+                auto_create = entities.get('auto-create')
+            entities = ((entity_id, columns)
+                        for entity_id, columns in six.iteritems(entities)
+                        if entity_id != 'auto-create')
+        return batch_utils.iter_insert_batches(
+            entities, auto_create, max_bytes=max_batch_bytes,
+            validate_values=validation == validators.VALIDATION_FULL)
+
+    def insert_rows(self, rows, columns, column_types=None,
+                    auto_create=None,
+                    max_batch_bytes=validators.MAX_INSERTION_BATCH_BYTES,
+                    validation=None):
+        """Insert any number of entities given as rows of values, in the
+        order of columns, splitting them into batches as bulk_insert does.
+
+        Values are checked against the column types and encoded straight to
+        JSON. Types come from the schema, loaded with load_schema() the first
+        time when the key is allowed to, and from column_types. Returns a
+        list with the API response of each batch.
+
+        Keyword arguments:
+        rows -- An iterable of (entity_id, values) pairs, where values is a
+            tuple, list or array with one value per column, None for no value.
+            Event values are {'value': v, 'date': d} dictionaries or
+            (value, date) tuples, several events are given in a list
+        columns(list) -- The api-names of the columns
+        column_types(dict) -- Types of columns missing from the schema, such
+            as columns created by auto_create (default None)
+        auto_create(list) -- Value of the 'auto-create' parameter sent with
+            every batch (default None)
+        max_batch_bytes(int) -- Maximum request body size of each batch
+        validation(string) -- Validation level for this call, 'off' skips
+            the type checks (default None, the client level)
+        """
+        bodies = self._iter_row_bodies(
+            rows, columns, self._insert_types(self._column_types(),
+                                              column_types),
+            auto_create, max_batch_bytes, self._validation_level(validation))
+        return list(ordered_map(
+            self._send_insert_body, bodies, self.max_workers))
+
+    @staticmethod
+    def _insert_types(schema_types, column_types):
+        """Returns the types of the columns of insert_rows
+
+        Keyword arguments:
+        schema_types(dict) -- The types in the schema, or None
+        column_types(dict) -- The types given to the call, or None
+        """
+        types = dict(schema_types or {})
+        if column_types:
+            types.update(column_types)
+        return types
+
+    @staticmethod
+    def _iter_row_bodies(rows, columns, column_types, auto_create,
+                         max_batch_bytes, validation):
+        """Encode rows into insert bodies accepted by the API.
+
+        Keyword arguments:
+        rows -- An iterable of (entity_id, values) pairs
+        columns(list) -- The api-names of the columns
+        column_types(dict) -- The type of each column
+        auto_create(list) -- Value of the 'auto-create' parameter
+        max_batch_bytes(int) -- Maximum request body size of each batch
+        validation(string) -- The validation level
+        """
+        encoder = RowEncoder(
+            columns, column_types,
+            check_types=validation != validators.VALIDATION_OFF)
+        return batch_utils.pack_insert_batches(
+            encoder.iter_fragments(rows), auto_create,
+            max_bytes=max_batch_bytes)
+
+    def _send_insert_body(self, body):
+        """Send an already serialized insert body.
+
+        Keyword arguments:
+        body(string) -- A JSON insert body
+        """
+        url = SlicingDice.BASE_URL + URLResources.INSERT
+        return self._make_request(
+            url=url,
+            json_data=body,
+            req_type="post",
+            key_level=1,
+            invalidates_cache=True)
+
+    def insert_many(self, batches, validation=None):
+        """Insert several batches, sending up to max_workers of them
+        concurrently.
+
+        Batches are consumed lazily and only a bounded number of them is
+        held in memory at once. Returns a list with the API response of each
+        batch, in the order the batches were given.
+
+        Keyword arguments:
+        batches -- An iterable of dictionaries in the Slicing Dice data format
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        """
+        def insert(batch):
+            return self.insert(batch, validation)
+
+        return list(ordered_map(insert, batches, self.max_workers))
+
+    def insert_buffer(self, linger_ms=100, **options):
+        """Returns an InsertBuffer gathering entities added one at a time
+        into full insert requests sent in the background.
 
-    def count_entity(self, query):
+        Keyword arguments:
+        linger_ms(float) -- Milliseconds an entity may wait for its batch to
+            fill up before it is sent anyway (default 100)
+        options -- Other arguments of InsertBuffer, such as max_batch_bytes,
+            max_in_flight, auto_create, callback and coalesce
+        """
+        return InsertBuffer(self, linger_ms=linger_ms, **options)
+
+    def insert_spool(self, directory, **options):
+        """Returns an InsertSpool, an on-disk write-ahead log of insert
+        requests sent in the background, resending those a previous run
+        left in directory.
+
+        Keyword arguments:
+        directory(string) -- Directory of the spool files
+        options -- Other arguments of InsertSpool, such as fsync,
+            segment_bytes, max_in_flight and on_reject
+        """
+        return InsertSpool(self, directory, **options)
+
+    def count_entity(self, query, raw=False, validation=None,
+                     max_in_flight=None):
         """Make a count entity query
 
         Keyword arguments:
         query -- A dictionary in the Slicing Dice query
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        max_in_flight(int) -- Sub-requests sent at a time when the query
+            is split (default None, the connection pool size)
         """
         url = SlicingDice.BASE_URL + URLResources.QUERY_COUNT_ENTITY
-        return self._count_query_wrapper(url, query)
+        return self._count_query_wrapper(
+            url, query, raw, validation, max_in_flight)
 
-    def count_entity_total(self, dimensions=None):
+    def count_entity_total(self, dimensions=None, raw=False):
         """Make a count entity total query
 
         Keyword arguments:
         dimensions -- A dictionary containing the dimensions in which
                   the total query will be performed
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
         """
         query = {}
         if dimensions is not None:
@@ -216,62 +683,112 @@ class SlicingDice(SlicingDiceAPI):
         return self._make_request(
             url=url,
             req_type="post",
-            json_data=ujson.dumps(query),
-            key_level=0)
+            json_data=query,
+            key_level=0,
+            raw=raw)
 
-    def count_event(self, query):
+    def count_event(self, query, raw=False, validation=None,
+                    max_in_flight=None):
         """Make a count event query
 
         Keyword arguments:
         data -- A dictionary query
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        max_in_flight(int) -- Sub-requests sent at a time when the query
+            is split (default None, the connection pool size)
         """
         url = SlicingDice.BASE_URL + URLResources.QUERY_COUNT_EVENT
-        return self._count_query_wrapper(url, query)
+        return self._count_query_wrapper(
+            url, query, raw, validation, max_in_flight)
 
-    def aggregation(self, query):
+    def aggregation(self, query, raw=False, validation=None,
+                    max_in_flight=None):
         """Make a aggregation query
 
+        The 'query' can also be a list of independent aggregations, each
+        one a list of nested columns. They are sent as concurrent requests
+        and their results merged in a single response.
+
         Keyword arguments:
         query -- An aggregation query
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        max_in_flight(int) -- Sub-requests sent at a time when the query
+            is split (default None, the connection pool size)
         """
         url = SlicingDice.BASE_URL + URLResources.QUERY_AGGREGATION
+        check = self._validation_level(validation) != validators.VALIDATION_OFF
+        sub_queries = query_utils.split_aggregation(query)
+        if sub_queries is not None:
+            if check:
+                for sub_query in sub_queries:
+                    self._check_aggregation(sub_query)
+            return self._send_split_query(
+                url, sub_queries, raw, max_in_flight, unique=True)
+        if check:
+            self._check_aggregation(query)
+        return self._send_query(url, query, raw)
+
+    @staticmethod
+    def _check_aggregation(query):
         if "query" not in query:
             raise exceptions.InvalidQueryException(
                 "The aggregation query must have up the key 'query'.")
         columns = query["query"]
-        if len(columns) > 5:
+        if any(isinstance(column, list) for column in columns):
+            raise exceptions.InvalidQueryException(
+                "A list of independent aggregations can only be sent by "
+                "aggregation().")
+        if len(columns) > validators.MAX_AGGREGATION_COLUMNS:
+            # Each column breaks down the values of the previous one, so a
+            # chain of columns can't be sent as separate requests
             raise exceptions.MaxLimitException(
-                "The aggregation query must have up to 5 columns per request.")
-        return self._make_request(
-            url=url,
-            json_data=ujson.dumps(query),
-            req_type="post",
-            key_level=0)
+                "The aggregation query must have up to 5 nested columns per "
+                "request. Nested aggregations can't be split, pass "
+                "independent aggregations as a list of lists of columns.")
+        return True
 
-    def top_values(self, query):
+    def top_values(self, query, raw=False, validation=None,
+                   max_in_flight=None):
         """Make a top values query
 
         Keyword arguments:
         query -- A dictionary query
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        max_in_flight(int) -- Sub-requests sent at a time when the query
+            is split (default None, the connection pool size)
         """
         url = SlicingDice.BASE_URL + URLResources.QUERY_TOP_VALUES
-        sd_query_top_values = validators.QueryValidator(query)
-        if sd_query_top_values.validator():
-            return self._make_request(
-                url=url,
-                json_data=ujson.dumps(query),
-                req_type="post",
-                key_level=0)
+        sub_queries = query_utils.split_named_queries(
+            query, validators.MAX_TOP_VALUES_QUERY_SIZE)
+        if sub_queries is not None:
+            for sub_query in sub_queries:
+                self._validate(
+                    validators.QueryValidator, sub_query, validation)
+            return self._send_split_query(
+                url, sub_queries, raw, max_in_flight)
+        if self._validate(validators.QueryValidator, query, validation):
+            return self._send_query(url, query, raw)
 
-    def exists_entity(self, ids, dimension=None):
+    def exists_entity(self, ids, dimension=None, raw=False):
         """Make a exists entity query
 
         Keyword arguments:
         ids -- A list with entities to check if exists
         dimension -- In which dimension entities check be checked
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
         """
         url = SlicingDice.BASE_URL + URLResources.QUERY_EXISTS_ENTITY
-        if len(ids) > 100:
+        if len(ids) > validators.MAX_EXISTS_ENTITY_IDS:
             raise exceptions.MaxLimitException(
                 "The query exists entity must have up to 100 ids.")
         query = {
@@ -281,9 +798,66 @@ class SlicingDice(SlicingDiceAPI):
             query['dimension'] = dimension
         return self._make_request(
             url=url,
-            json_data=ujson.dumps(query),
+            json_data=query,
             req_type="post",
-            key_level=0)
+            key_level=0,
+            raw=raw)
+
+    def iter_exists_entities(self, ids, dimension=None, max_in_flight=None):
+        """Check which entities exist for any number of ids, yielding an
+        (entity_id, exists) pair for every distinct id.
+
+        Ids are deduplicated and checked in requests of up to
+        MAX_EXISTS_ENTITY_IDS ids, sent concurrently. The ids iterable is
+        consumed lazily, so memory is bounded by the number of distinct ids
+        and the requests in flight.
+
+        Keyword arguments:
+        ids -- An iterable of entity ids
+        dimension -- In which dimension entities check be checked
+        max_in_flight(int) -- Requests sent at a time (default None, the
+            connection pool size)
+        """
+        def exists(chunk):
+            return self.exists_entity(chunk, dimension)
+
+        chunks = query_utils.iter_unique_chunks(
+            ids, validators.MAX_EXISTS_ENTITY_IDS)
+        for response in ordered_map(
+                exists, chunks,
+                max_in_flight or self._requester.pool_maxsize):
+            for result in self._exists_pairs(response):
+                yield result
+
+    @staticmethod
+    def _exists_pairs(response):
+        """Returns the (entity_id, exists) pairs of an exists response"""
+        return ([(entity_id, True)
+                 for entity_id in response.get('exists') or ()] +
+                [(entity_id, False)
+                 for entity_id in response.get('not-exists') or ()])
+
+    def exists_entities(self, ids, dimension=None, sink=None,
+                        max_in_flight=None):
+        """Check which entities exist for any number of ids.
+
+        Without a sink, returns a dictionary with the 'exists' and
+        'not-exists' lists of ids. With a sink, writes a
+        "<exists|not-exists>\t<entity id>" line per id to it as results
+        arrive and returns the number of ids of each kind.
+
+        Keyword arguments:
+        ids -- An iterable of entity ids
+        dimension -- In which dimension entities check be checked
+        sink -- A text file-like object (default None)
+        max_in_flight(int) -- Requests sent at a time (default None, the
+            connection pool size)
+        """
+        collect = _ExistsCollector(sink)
+        for entity_id, exists in self.iter_exists_entities(
+                ids, dimension, max_in_flight):
+            collect.add(entity_id, exists)
+        return collect.result()
 
     def get_saved_query(self, query_name):
         """Get a saved query
@@ -341,37 +915,196 @@ class SlicingDice(SlicingDiceAPI):
         url = SlicingDice.BASE_URL + URLResources.QUERY_SAVED + name
         return self._saved_query_wrapper(url, query, True)
 
-    def result(self, query):
+    def result(self, query, raw=False, validation=None, columnar=False):
         """Get a data extraction result
 
         Keyword arguments:
         query -- A dictionary query
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        columnar(bool) -- Return a ColumnarResult with an array per column
+            instead of the decoded response, raw is ignored (default False)
         """
         url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_RESULT
-        return self._data_extraction_wrapper(url, query)
+        response = self._data_extraction_wrapper(
+            url, query, raw and not columnar, validation)
+        if columnar:
+            return self._decode_columnar([response], self._column_types())
+        return response
 
-    def score(self, query):
+    def score(self, query, raw=False, validation=None, columnar=False):
         """Get a data extraction score
 
         Keyword arguments:
         query -- A dictionary query
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        columnar(bool) -- Return a ColumnarResult with an array per column
+            instead of the decoded response, raw is ignored (default False)
         """
         url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_SCORE
-        return self._data_extraction_wrapper(url, query)
+        response = self._data_extraction_wrapper(
+            url, query, raw and not columnar, validation)
+        if columnar:
+            return self._decode_columnar([response], self._column_types())
+        return response
+
+    def iter_result(self, query, page_size=None, max_in_flight=1):
+        """Iterate over every entity of a data extraction result, following
+        'next-page' automatically.
+
+        Yields (entity_id, columns) pairs. The next pages are fetched on a
+        background thread while the current one is consumed, so only a few
+        pages are kept in memory at once.
+
+        Keyword arguments:
+        query -- A dictionary query
+        page_size(int) -- Entities per page, overrides the query 'limit'
+            (default None)
+        max_in_flight(int) -- Pages fetched ahead of the one being consumed,
+            zero disables prefetching (default 1)
+        """
+        url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_RESULT
+        return self._iter_data_extraction(
+            url, query, page_size, max_in_flight)
+
+    def iter_score(self, query, page_size=None, max_in_flight=1):
+        """Iterate over every entity of a data extraction score, following
+        'next-page' automatically.
+
+        Yields (entity_id, columns) pairs, as iter_result.
 
-    def sql(self, query):
+        Keyword arguments:
+        query -- A dictionary query
+        page_size(int) -- Entities per page, overrides the query 'limit'
+            (default None)
+        max_in_flight(int) -- Pages fetched ahead of the one being consumed,
+            zero disables prefetching (default 1)
+        """
+        url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_SCORE
+        return self._iter_data_extraction(
+            url, query, page_size, max_in_flight)
+
+    def result_columns(self, query, page_size=None, max_in_flight=1):
+        """Get every page of a data extraction result, following
+        'next-page', in a single ColumnarResult.
+
+        Each page is appended to the column arrays as it arrives, so the
+        result never holds more than a page of dictionaries. Column types
+        come from the schema, loaded with load_schema() the first time when
+        the key allows it.
+
+        Keyword arguments:
+        query -- A dictionary query
+        page_size(int) -- Entities per page, overrides the query 'limit'
+            (default None)
+        max_in_flight(int) -- Pages fetched ahead of the one being decoded,
+            zero disables prefetching (default 1)
+        """
+        url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_RESULT
+        return self._data_extraction_columns(
+            url, query, page_size, max_in_flight)
+
+    def score_columns(self, query, page_size=None, max_in_flight=1):
+        """Get every page of a data extraction score, following
+        'next-page', in a single ColumnarResult, as result_columns.
+
+        Keyword arguments:
+        query -- A dictionary query
+        page_size(int) -- Entities per page, overrides the query 'limit'
+            (default None)
+        max_in_flight(int) -- Pages fetched ahead of the one being decoded,
+            zero disables prefetching (default 1)
+        """
+        url = SlicingDice.BASE_URL + URLResources.QUERY_DATA_EXTRACTION_SCORE
+        return self._data_extraction_columns(
+            url, query, page_size, max_in_flight)
+
+    def _data_extraction_columns(self, url, query, page_size, max_in_flight):
+        """Returns every page of a data extraction query in a
+        ColumnarResult, fetching the next pages in background.
+
+        Keyword arguments:
+        url(string) -- Url to make request
+        query(dict) -- A data extraction query
+        page_size(int) -- Entities per page
+        max_in_flight(int) -- Pages fetched ahead of the one being decoded
+        """
+        query = self._paged_query(query, page_size)
+        column_types = self._column_types()
+        pages = self._iter_pages(url, query)
+        return self._decode_columnar(
+            prefetch(pages, max_in_flight), column_types)
+
+    def sql(self, query, raw=False, columnar=False):
         """ Make a sql query to SlicingDice
 
         :param query: the query written in SQL format
+        :param raw: return the response body as undecoded bytes
+        :param columnar: return the rows as a ColumnarResult with an array
+            per column, raw is ignored
         :return: The response from the SlicingDice
         """
         url = SlicingDice.BASE_URL + URLResources.QUERY_SQL
-        return self._make_request(
+        # Only SELECT statements can be answered from the cache, any other
+        # statement changes data
+        is_select = query.lstrip()[:6].upper() == 'SELECT'
+        response = self._make_request(
             url=url,
             string_data=query,
             req_type="post",
             key_level=0,
-            content_type='application/sql')
+            content_type='application/sql',
+            cache_query=query if is_select else None,
+            invalidates_cache=not is_select,
+            raw=raw and not columnar)
+        if columnar:
+            return self._decode_columnar([response], self._column_types())
+        return response
+
+    def prepare(self, endpoint, query, validation=None):
+        """Compile a query used many times with different values.
+
+        The query is validated once and serialized once, with Param
+        placeholders where values change. The returned PreparedQuery sends
+        the query when called with the parameter values, encoding only
+        those values on each call.
+
+        Keyword arguments:
+        endpoint(string) -- One of 'count_entity', 'count_event',
+            'top_values', 'aggregation' or 'sql'
+        query -- A query whose values can be Param objects, or for 'sql' a
+            statement with %(name)s placeholders
+        validation(string) -- Validation level of the query and of the
+            bound values, 'full', 'structural' or 'off' (default None, the
+            client level)
+        """
+        if endpoint not in self._PREPARED_ENDPOINTS:
+            raise exceptions.InvalidQueryException(
+                "Can't prepare '{0}' queries, use one of: {1}.".format(
+                    endpoint, ", ".join(sorted(self._PREPARED_ENDPOINTS))))
+        resource, validator_class = self._PREPARED_ENDPOINTS[endpoint]
+        url = SlicingDice.BASE_URL + resource
+        level = self._validation_level(validation)
+        if endpoint == 'sql':
+            is_select = query.lstrip()[:6].upper() == 'SELECT'
+            return PreparedQuery(
+                self, url, compile_sql(query), 'application/sql',
+                cacheable=is_select, invalidates_cache=not is_select,
+                check_params=False)
+        if level != validators.VALIDATION_OFF:
+            if validator_class is None:
+                self._check_aggregation(query)
+            else:
+                self._validate(validator_class, query, level)
+        return PreparedQuery(
+            self, url, compile_json(query), 'application/json',
+            cacheable=not wants_bypass(query), invalidates_cache=False,
+            check_params=level == validators.VALIDATION_FULL)
 
     def delete(self, query):
         """Make a delete request
@@ -382,9 +1115,10 @@ class SlicingDice(SlicingDiceAPI):
         url = SlicingDice.BASE_URL + URLResources.DELETE
         return self._make_request(
             url=url,
-            json_data=ujson.dumps(query),
+            json_data=query,
             req_type="post",
-            key_level=2)
+            key_level=2,
+            invalidates_cache=True)
 
 
     def update(self, query):
@@ -396,6 +1130,7 @@ class SlicingDice(SlicingDiceAPI):
         url = SlicingDice.BASE_URL + URLResources.UPDATE
         return self._make_request(
             url=url,
-            json_data=ujson.dumps(query),
+            json_data=query,
             req_type="post",
-            key_level=2)
+            key_level=2,
+            invalidates_cache=True)
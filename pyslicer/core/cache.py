@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import abc
+import collections
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import six
+import ujson
+
+
+def wants_bypass(query):
+    """Returns true if the query asks the API to bypass its cache
+
+    Keyword arguments:
+    query -- A dictionary or list of dictionaries query
+    """
+    if isinstance(query, dict):
+        return bool(query.get('bypass-cache'))
+    if isinstance(query, list):
+        return any(isinstance(item, dict) and item.get('bypass-cache')
+                   for item in query)
+    return False
+
+
+def _cache_period(query):
+    """Returns the smallest 'cache-period' found in a query or None"""
+    if isinstance(query, dict):
+        return query.get('cache-period')
+    if isinstance(query, list):
+        periods = [item['cache-period'] for item in query
+                   if isinstance(item, dict) and 'cache-period' in item]
+        if periods:
+            return min(periods)
+    return None
+
+
+def _without_bypass(query):
+    if isinstance(query, dict) and 'bypass-cache' in query:
+        query = dict(query)
+        del query['bypass-cache']
+    elif isinstance(query, list):
+        query = [_without_bypass(item) for item in query]
+    return query
+
+
+class CacheBackend(object):
+    """Storage used by QueryCache for serialized response bodies."""
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def get(self, key):
+        """Returns the stored body or None if missing or expired"""
+
+    @abc.abstractmethod
+    def set(self, key, body, ttl):
+        """Store a body for ttl seconds"""
+
+    @abc.abstractmethod
+    def clear(self):
+        """Drop every entry"""
+
+    def stats(self):
+        """Returns a dictionary with backend specific counters"""
+        return {}
+
+
+class MemoryCacheBackend(CacheBackend):
+    """LRU storage bounded by the total size of the stored bodies, local to
+    the process."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        Parameters:
+            max_bytes(int) -- Maximum size of all stored bodies
+        """
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires_at, body = entry
+            if expires_at <= time.time():
+                self.size -= len(body)
+                return None
+            # Re-inserting moves the entry to the most recently used end
+            self._entries[key] = entry
+            return body
+
+    def set(self, key, body, ttl):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self._entries[key] = (time.time() + ttl, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.size,
+            }
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Storage in a local SQLite file, shared by every process that opens
+    the same path. Bodies are stored zlib compressed.
+
+    The database runs in WAL mode so readers in other processes are not
+    blocked by a writer. Triggers keep the total size of the bodies in a
+    meta row, updated in the transaction of every write, so checking the
+    size limit doesn't scan the table. Each thread uses its own connection,
+    and so does each process forked after the backend was created, such as
+    preloaded gunicorn or uWSGI workers.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, timeout=5):
+        """
+        Parameters:
+            path(string) -- Path of the SQLite database file
+            max_bytes(int) -- Maximum size of all stored bodies, checked
+                approximately after writes
+            timeout(float) -- Seconds to wait for a lock held by another
+                process
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+        # Connections opened by the parent of a forked process, never used
+        # nor closed by the child
+        self._inherited = []
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, expires_at REAL, body BLOB)')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS entries_expires_at '
+            'ON entries (expires_at)')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS meta ('
+            'name TEXT PRIMARY KEY, value INTEGER)')
+        # Files written before the meta row existed start from their size
+        connection.execute(
+            "INSERT OR IGNORE INTO meta SELECT 'bytes', "
+            "COALESCE(SUM(LENGTH(body)), 0) FROM entries")
+        connection.execute(
+            'CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT '
+            'ON entries BEGIN UPDATE meta SET value = value + '
+            "LENGTH(new.body) WHERE name = 'bytes'; END")
+        connection.execute(
+            'CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE '
+            'ON entries BEGIN UPDATE meta SET value = value - '
+            "LENGTH(old.body) WHERE name = 'bytes'; END")
+        connection.commit()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, nor used
+        # across a fork
+        connection = getattr(self._local, 'connection', None)
+        pid = os.getpid()
+        if connection is not None and self._local.pid != pid:
+            # The child doesn't hold the locks of the parent, closing the
+            # connection could checkpoint and remove the WAL it still uses
+            self._inherited.append(connection)
+            connection = None
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            self._local.connection = connection
+            self._local.pid = pid
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT body FROM entries WHERE key = ? AND expires_at > ?',
+            (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(bytes(row[0]))
+
+    def set(self, key, body, ttl):
+        connection = self._connection()
+        with connection:
+            # A replace wouldn't fire the delete trigger
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            connection.execute(
+                'INSERT INTO entries VALUES (?, ?, ?)',
+                (key, time.time() + ttl,
+                 sqlite3.Binary(zlib.compress(body))))
+            self._evict(connection)
+
+    @staticmethod
+    def _size(connection):
+        return connection.execute(
+            "SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+
+    def _evict(self, connection):
+        connection.execute(
+            'DELETE FROM entries WHERE expires_at <= ?', (time.time(),))
+        if self._size(connection) > self.max_bytes:
+            # Entries closest to expiring go first
+            connection.execute(
+                'DELETE FROM entries WHERE key IN ('
+                'SELECT key FROM entries ORDER BY expires_at LIMIT '
+                '(SELECT COUNT(*) / 4 + 1 FROM entries))')
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM entries')
+
+    def stats(self):
+        connection = self._connection()
+        entries = connection.execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {'entries': entries, 'bytes': self._size(connection)}
+
+
+class MemcachedCacheBackend(CacheBackend):
+    """Storage in a memcached compatible server, shared by every process
+    using it. Bodies are stored zlib compressed.
+
+    Works with any client exposing get(key), set(key, value, expire),
+    add(key, value) and incr(key, delta), such as pymemcache or
+    python-memcached clients. clear() switches to a new key namespace
+    instead of flushing the server. The namespace is read from the server
+    at most once per generation_ttl, so a clear() made by another process
+    is seen within generation_ttl seconds.
+    """
+
+    # Larger expiration times are read by memcached as Unix timestamps
+    MAX_RELATIVE_EXPIRATION = 30 * 24 * 60 * 60
+
+    def __init__(self, client, prefix='pyslicer:', generation_ttl=1.0):
+        """
+        Parameters:
+            client -- A memcached client object
+            prefix(string) -- Prefix of every key written by this backend
+            generation_ttl(float) -- Seconds the key namespace is reused
+                before being read again from the server
+        """
+        self.client = client
+        self.prefix = prefix
+        self.generation_ttl = generation_ttl
+        self._generation_key = prefix + 'generation'
+        # (generation, expires_at) of the namespace last read
+        self._cached_generation = None
+
+    def _generation(self):
+        cached = self._cached_generation
+        now = time.time()
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        generation = self.client.get(self._generation_key)
+        if generation is None:
+            self.client.add(self._generation_key, '0')
+            generation = self.client.get(self._generation_key) or 0
+        return self._remember_generation(generation)
+
+    def _remember_generation(self, generation):
+        if isinstance(generation, bytes):
+            generation = generation.decode('ascii')
+        generation = str(generation)
+        self._cached_generation = (generation,
+                                   time.time() + self.generation_ttl)
+        return generation
+
+    def _key(self, key):
+        return '{0}{1}:{2}'.format(self.prefix, self._generation(), key)
+
+    def get(self, key):
+        body = self.client.get(self._key(key))
+        if body is None:
+            return None
+        return zlib.decompress(body)
+
+    def set(self, key, body, ttl):
+        expire = int(math.ceil(ttl))
+        if expire > self.MAX_RELATIVE_EXPIRATION:
+            expire = int(math.ceil(time.time() + ttl))
+        self.client.set(self._key(key), zlib.compress(body), expire)
+
+    def clear(self):
+        generation = self.client.incr(self._generation_key, 1)
+        if generation is None:
+            self.client.add(self._generation_key, '1')
+            # Another process may have added it first
+            self._cached_generation = None
+        else:
+            self._remember_generation(generation)
+
+
+class QueryCache(object):
+    """Cache for read query results.
+
+    Entries are keyed on the endpoint, API key, key level and the query
+    serialized with sorted keys, so equivalent queries share an entry. The
+    raw response body is stored, which bounds the cache by its real size
+    and gives every caller a fresh copy of the result. Storage is delegated
+    to a CacheBackend, an in-process LRU by default; SQLiteCacheBackend and
+    MemcachedCacheBackend share entries between processes.
+
+    Example usage:
+
+        from pyslicer import SlicingDice
+        from pyslicer.core.cache import QueryCache, SQLiteCacheBackend
+        from pyslicer.url_resources import URLResources
+
+        cache = QueryCache(
+            backend=SQLiteCacheBackend('/tmp/pyslicer-cache.db'),
+            ttls={URLResources.QUERY_TOP_VALUES: 300})
+        sd = SlicingDice(master_key='my-key', cache=cache)
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, default_ttl=60,
+                 ttls=None, invalidate_on_write=True, backend=None):
+        """
+        Parameters:
+            max_bytes(int) -- Maximum size of all cached response bodies
+                when no backend is given
+            default_ttl(float) -- Seconds an entry stays valid
+            ttls(dict) -- Seconds an entry stays valid per endpoint, keyed
+                by URLResources paths. A zero TTL disables caching for that
+                endpoint. A 'cache-period' in the query takes precedence.
+            invalidate_on_write(bool) -- Drop every entry after a successful
+                insert, update or delete
+            backend(CacheBackend) -- Where entries are stored, defaults to a
+                MemoryCacheBackend of max_bytes
+        """
+        if backend is None:
+            backend = MemoryCacheBackend(max_bytes)
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.invalidate_on_write = invalidate_on_write
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def ttl_for(self, url, query=None):
+        """Returns the TTL of a query
+
+        Keyword arguments:
+        url(string) -- The request url
+        query -- The query, whose 'cache-period' takes precedence over the
+            endpoint TTL (default None)
+        """
+        cache_period = _cache_period(query)
+        if cache_period is not None:
+            return cache_period
+        for path, ttl in six.iteritems(self.ttls):
+            if url.endswith(path):
+                return ttl
+        return self.default_ttl
+
+    @staticmethod
+    def make_key(url, api_key, key_level, query):
+        """Returns the cache key of a query
+
+        Keyword arguments:
+        url(string) -- The request url
+        api_key(string) -- The API key used in the request
+        key_level(int) -- The key level needed by the request
+        query -- A dictionary, list or string query
+        """
+        if not isinstance(query, six.string_types):
+            # bypass-cache is left out so a bypassing query refreshes the
+            # entry used by the same query without it
+            query = ujson.dumps(_without_bypass(query), sort_keys=True)
+        digest = hashlib.sha1()
+        for part in (url, api_key, str(key_level), query):
+            if isinstance(part, six.text_type):
+                part = part.encode('utf-8')
+            digest.update(part)
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached response body or None
+
+        Keyword arguments:
+        key(string) -- A key built by make_key
+        """
+        body = self.backend.get(key)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return body
+
+    def set(self, key, body, ttl):
+        """Store a response body
+
+        Keyword arguments:
+        key(string) -- A key built by make_key
+        body(bytes) -- The raw response body
+        ttl(float) -- Seconds the entry stays valid
+        """
+        if ttl > 0:
+            self.backend.set(key, body, ttl)
+
+    def clear(self):
+        """Drop every entry"""
+        self.backend.clear()
+
+    def stats(self):
+        """Returns a dictionary with the cache counters"""
+        stats = self.backend.stats()
+        with self._lock:
+            stats['hits'] = self.hits
+            stats['misses'] = self.misses
+        return stats
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import array
+import collections
+
+import six
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .. import exceptions
+
+try:
+    array.array('q')
+    _INTEGER_TYPECODE = 'q'
+except ValueError:
+    # Python 2 has no long long arrays
+    _INTEGER_TYPECODE = 'l'
+
+# Array typecodes of the column types stored in fixed size arrays, the
+# values of any other type are kept in lists
+COLUMN_TYPECODES = {
+    'integer': _INTEGER_TYPECODE,
+    'decimal': 'd',
+    'boolean': 'b',
+}
+
+_FILL_VALUES = {_INTEGER_TYPECODE: 0, 'd': float('nan'), 'b': 0}
+
+
+def _parse_boolean(text):
+    return {'true': True, 'false': False}[text.lower()]
+
+
+# Parsers of the values data extraction responses return as text
+_PARSERS = {_INTEGER_TYPECODE: int, 'd': float, 'b': _parse_boolean}
+
+
+def _infer_typecode(value):
+    """Returns the typecode of a column of unknown type from its first
+    value"""
+    if isinstance(value, bool):
+        return 'b'
+    if isinstance(value, six.integer_types):
+        return _INTEGER_TYPECODE
+    if isinstance(value, float):
+        return 'd'
+    return None
+
+
+class _Column(object):
+    """Values of a column, in an array with a mask of missing values, or
+    in a list with None for missing values."""
+    __slots__ = ('typecode', 'values', 'mask')
+
+    def __init__(self, typecode, missing_rows):
+        self.typecode = typecode
+        self.mask = None
+        if typecode is None:
+            self.values = [None] * missing_rows
+        else:
+            self.values = array.array(
+                typecode, [_FILL_VALUES[typecode]]) * missing_rows
+            if missing_rows:
+                self.mask = array.array('b', [1]) * missing_rows
+
+    def append(self, value):
+        if self.typecode is not None and isinstance(value, six.string_types):
+            try:
+                value = _PARSERS[self.typecode](value)
+            except (KeyError, ValueError):
+                pass
+        try:
+            self.values.append(value)
+        except (TypeError, OverflowError):
+            # A value the array can't hold, such as a string in a decimal
+            # column, the column falls back to a list
+            self._to_list()
+            self.values.append(value)
+            return
+        if self.mask is not None:
+            self.mask.append(0)
+
+    def append_missing(self):
+        if self.typecode is None:
+            self.values.append(None)
+            return
+        if self.mask is None:
+            self.mask = array.array('b', [0]) * len(self.values)
+        self.values.append(_FILL_VALUES[self.typecode])
+        self.mask.append(1)
+
+    def _to_list(self):
+        values = self.values.tolist()
+        if self.typecode == 'b':
+            values = [bool(value) for value in values]
+        if self.mask is not None:
+            values = [None if missing else value
+                      for value, missing in zip(values, self.mask)]
+        self.typecode = None
+        self.values = values
+        self.mask = None
+
+
+class ColumnarResult(object):
+    """Rows of a data extraction or SQL response decoded into one array
+    per column.
+
+    Integer, decimal and boolean columns are kept in array.array buffers,
+    with a mask marking the rows that have no value, parsing the text
+    values of data extraction responses. Other columns, and
+    columns holding values of another type than expected, are lists with
+    None for missing values. Column types come from the schema when it is
+    known, from the first value of each column otherwise.
+
+    Pages are appended to the same buffers, so a result of many pages costs
+    one array per column instead of one dictionary per entity.
+
+    Example usage:
+
+        columns = sd.result_columns(query)
+        ages = columns.column('age')
+        ages[columns.index['user1@slicingdice.com']]
+        frame = pandas.DataFrame(columns.to_numpy(), index=columns.entity_ids)
+    """
+
+    def __init__(self, column_types=None):
+        """
+        Parameters:
+            column_types(dict) -- The type of known columns, keyed by
+                api-name, as returned by SchemaCache.types() (default None)
+        """
+        self.column_types = column_types or {}
+        self.entity_ids = []
+        self.took = None
+        self.pages = 0
+        self._columns = collections.OrderedDict()
+        self._rows = 0
+        self._index = None
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def names(self):
+        """Names of the columns, in the order they were first seen"""
+        return list(self._columns)
+
+    @property
+    def index(self):
+        """Dictionary with the row of every entity id. Empty for SQL
+        results, which have no entity ids."""
+        if self._index is None:
+            self._index = dict(
+                (entity_id, row)
+                for row, entity_id in enumerate(self.entity_ids))
+        return self._index
+
+    def _get(self, name):
+        try:
+            return self._columns[name]
+        except KeyError:
+            raise exceptions.SlicingDiceException(
+                "The result has no column '{0}'.".format(name))
+
+    def column(self, name):
+        """Returns the values of a column, an array.array or a list
+
+        Keyword arguments:
+        name(string) -- The column name
+        """
+        return self._get(name).values
+
+    def mask(self, name):
+        """Returns an array.array with 1 for the rows of a column without a
+        value, or None when every row has one or the column is a list
+
+        Keyword arguments:
+        name(string) -- The column name
+        """
+        return self._get(name).mask
+
+    def row(self, entity_id):
+        """Returns the columns of an entity as a dictionary
+
+        Keyword arguments:
+        entity_id -- The entity id
+        """
+        position = self.index[entity_id]
+        row = {}
+        for name, column in six.iteritems(self._columns):
+            if column.mask is None or not column.mask[position]:
+                value = column.values[position]
+                if column.typecode == 'b':
+                    row[name] = bool(value)
+                elif value is not None:
+                    row[name] = value
+        return row
+
+    def _add_column(self, name, value):
+        kind = self.column_types.get(name)
+        if kind is None:
+            typecode = _infer_typecode(value)
+        else:
+            typecode = COLUMN_TYPECODES.get(kind)
+        column = _Column(typecode, self._rows)
+        self._columns[name] = column
+        return column
+
+    def append_rows(self, rows, entity_ids=None):
+        """Append rows to the columns
+
+        Keyword arguments:
+        rows -- An iterable of dictionaries keyed by column name
+        entity_ids -- The entity ids of the rows, in the same order
+            (default None)
+        """
+        columns = self._columns
+        for row in rows:
+            found = 0
+            for name, column in six.iteritems(columns):
+                value = row.get(name)
+                if value is None:
+                    column.append_missing()
+                else:
+                    found += 1
+                    column.append(value)
+            if found < len(row):
+                for name, value in six.iteritems(row):
+                    if value is not None and name not in columns:
+                        self._add_column(name, value).append(value)
+            self._rows += 1
+        if entity_ids is not None:
+            self.entity_ids.extend(entity_ids)
+            self._index = None
+
+    def append_page(self, response):
+        """Append the rows of a decoded response: the 'data' of a data
+        extraction response or the 'result' list of a SQL response
+
+        Keyword arguments:
+        response(dict) -- A decoded response
+        """
+        data = response.get('data')
+        if isinstance(data, list):
+            # Rows hold their entity id among the columns
+            rows = [dict(row) for row in data]
+            entity_ids = [row.pop('entity-id', None) for row in rows]
+            self.append_rows(rows, entity_ids)
+        else:
+            result = response.get('result')
+            if isinstance(result, list):
+                self.append_rows(result)
+        took = response.get('took')
+        if took is not None:
+            self.took = took if self.took is None else self.took + took
+        self.pages += 1
+
+    def to_numpy(self, copy=False):
+        """Returns a dictionary with a NumPy array per column. Columns with
+        missing values are masked arrays, list columns are object arrays.
+
+        Requires NumPy.
+
+        Keyword arguments:
+        copy(bool) -- Copy the array buffers. Without a copy the arrays
+            share memory with this result, which can't have more rows
+            appended while they are alive (default False)
+        """
+        if numpy is None:
+            raise exceptions.SlicingDiceException(
+                "to_numpy() requires NumPy: pip install numpy")
+        arrays = collections.OrderedDict()
+        for name, column in six.iteritems(self._columns):
+            if column.typecode is None:
+                values = numpy.empty(len(column.values), dtype=object)
+                values[:] = column.values
+            else:
+                values = numpy.frombuffer(
+                    column.values, dtype=column.typecode)
+                if column.typecode == 'b':
+                    values = values.astype(bool)
+                elif copy:
+                    values = values.copy()
+                if column.mask is not None:
+                    values = numpy.ma.masked_array(
+                        values, mask=numpy.frombuffer(
+                            column.mask, dtype='b').astype(bool))
+            arrays[name] = values
+        return arrays
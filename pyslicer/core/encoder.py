@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import math
+import numbers
+
+import six
+import ujson
+
+from .. import exceptions
+from ..utils import validators
+
+
+def _wrong_type(name, expected, value):
+    return exceptions.WrongTypeException(
+        "The value of column '{0}' should be {1}, got {2!r}.".format(
+            name, expected, value))
+
+
+def _encode_integer(name, value):
+    if isinstance(value, bool) or not isinstance(value, numbers.Integral):
+        raise _wrong_type(name, 'an integer', value)
+    return str(int(value))
+
+
+def _encode_decimal(name, value):
+    if isinstance(value, bool) or not isinstance(value, numbers.Real):
+        raise _wrong_type(name, 'a number', value)
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value) or math.isinf(value):
+        raise _wrong_type(name, 'a finite number', value)
+    return repr(value)
+
+
+def _encode_boolean(name, value):
+    # NumPy booleans are not bool instances
+    if not isinstance(value, bool) and getattr(
+            getattr(value, 'dtype', None), 'kind', None) != 'b':
+        raise _wrong_type(name, 'a boolean', value)
+    return 'true' if value else 'false'
+
+
+def _encode_string(name, value):
+    if not isinstance(value, six.string_types) or not value:
+        raise _wrong_type(name, 'a non empty string', value)
+    return ujson.dumps(value)
+
+
+def _encode_date(name, value):
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return '"' + value.isoformat() + '"'
+    return _encode_string(name, value)
+
+
+def _encode_datetime(name, value):
+    if isinstance(value, datetime.date):
+        return '"' + value.isoformat() + '"'
+    return _encode_string(name, value)
+
+
+def _event_encoder(encode_value):
+    """Returns the encoder of an event column whose values are encoded by
+    encode_value"""
+    def encode_event(name, event):
+        if isinstance(event, dict):
+            if 'value' not in event or 'date' not in event:
+                raise _wrong_type(
+                    name, "an event with 'value' and 'date'", event)
+            value, date = event['value'], event['date']
+        elif isinstance(event, tuple) and len(event) == 2:
+            value, date = event
+        else:
+            raise _wrong_type(name, 'an event', event)
+        return ('{"value":' + encode_value(name, value) +
+                ',"date":' + _encode_datetime(name, date) + '}')
+
+    def encode(name, value):
+        if isinstance(value, list):
+            if not value:
+                raise _wrong_type(name, 'a non empty list of events', value)
+            return '[' + ','.join(
+                encode_event(name, event) for event in value) + ']'
+        return encode_event(name, value)
+    return encode
+
+
+def _encode_unchecked(name, value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return '"' + value.isoformat() + '"'
+    return ujson.dumps(value)
+
+
+# Encoder of the values of each type of column that isn't an event column
+_VALUE_ENCODERS = {
+    'unique-id': _encode_string,
+    'boolean': _encode_boolean,
+    'string': _encode_string,
+    'integer': _encode_integer,
+    'decimal': _encode_decimal,
+    'enumerated': _encode_string,
+    'date': _encode_date,
+    'datetime': _encode_datetime,
+}
+
+_EVENT_SUFFIX = '-event'
+
+
+def _encoder_of(column_type):
+    """Returns the encoder of a column type, the encoder of the events of
+    its base type for '<type>-event' columns"""
+    if column_type.endswith(_EVENT_SUFFIX):
+        return _event_encoder(
+            _encoder_of(column_type[:-len(_EVENT_SUFFIX)]))
+    try:
+        return _VALUE_ENCODERS[column_type]
+    except KeyError:
+        raise exceptions.InvalidColumnTypeException(
+            "The column type '{0}' has no encoder.".format(column_type))
+
+
+# Encoder of every column type the validators accept, so a type added to
+# validators.COLUMN_TYPES without an encoder fails on import
+_ENCODERS = dict((column_type, _encoder_of(column_type))
+                 for column_type in validators.COLUMN_TYPES)
+
+
+class RowEncoder(object):
+    """Serializes rows of values, in a declared column order, as the
+    '"id":{...}' fragments packed by batch_utils.pack_insert_batches.
+
+    Values are checked against the column types and written straight to
+    JSON, without building a dictionary per entity. None values are left
+    out of the entity.
+
+    Example usage:
+
+        encoder = RowEncoder(['age', 'name'],
+                             {'age': 'integer', 'name': 'string'})
+        encoder.encode('user1@slicingdice.com', (22, 'Joe'))
+        # '"user1@slicingdice.com":{"age":22,"name":"Joe"}'
+    """
+
+    def __init__(self, columns, column_types, check_types=True):
+        """
+        Parameters:
+            columns(list) -- The api-names of the columns, in the order of
+                the values of each row
+            column_types(dict) -- The type of each column, such as the
+                SchemaCache.types() of the database
+            check_types(bool) -- Check the values against the column types,
+                otherwise they are serialized as they are (default True)
+        """
+        columns = tuple(columns)
+        if not columns:
+            raise exceptions.InvalidInsertException(
+                "At least one column is needed to encode rows.")
+        if len(set(columns)) != len(columns):
+            raise exceptions.InvalidInsertException(
+                "Columns can't be repeated.")
+        fields = []
+        for name in columns:
+            column_type = column_types.get(name)
+            if column_type is None:
+                raise exceptions.InvalidColumnException(
+                    "The type of column '{0}' is unknown, create it or "
+                    "pass its type.".format(name))
+            if column_type not in _ENCODERS:
+                raise exceptions.InvalidColumnTypeException(
+                    "The column '{0}' has an invalid type '{1}'.".format(
+                        name, column_type))
+            encode = _ENCODERS[column_type] if check_types else \
+                _encode_unchecked
+            fields.append((name, ujson.dumps(name) + ':', encode))
+        self.columns = columns
+        self._fields = tuple(fields)
+
+    def encode(self, entity_id, values):
+        """Returns the JSON fragment of an entity
+
+        Keyword arguments:
+        entity_id -- The entity id
+        values -- A tuple, list, array or any sequence with one value per
+            column
+        """
+        fields = self._fields
+        if len(values) != len(fields):
+            raise exceptions.InvalidInsertException(
+                "The entity '{0}' has {1} values for {2} columns.".format(
+                    entity_id, len(values), len(fields)))
+        parts = [prefix + encode(name, value)
+                 for (name, prefix, encode), value in zip(fields, values)
+                 if value is not None]
+        if not parts:
+            raise exceptions.InvalidInsertException(
+                "The entity '{0}' has no values.".format(entity_id))
+        if not isinstance(entity_id, six.string_types):
+            entity_id = str(entity_id)
+        return ujson.dumps(entity_id) + ':{' + ','.join(parts) + '}'
+
+    def iter_fragments(self, rows):
+        """Yield an (entity_id, fragment) pair for each row
+
+        Keyword arguments:
+        rows -- An iterable of (entity_id, values) pairs
+        """
+        encode = self.encode
+        for entity_id, values in rows:
+            yield entity_id, encode(entity_id, values)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import sys
+import threading
+
+import six
+from concurrent.futures import ThreadPoolExecutor
+from six.moves import queue
+
+
+def ordered_map(func, iterable, max_workers, max_pending=None):
+    """Apply func to every item on a thread pool, yielding the results in
+    submission order.
+
+    Items are pulled from iterable only when there is room for them, so at
+    most max_pending calls are queued or running at any time and memory
+    stays flat for iterables of any size. Exceptions raised by func are
+    re-raised when the corresponding result is reached.
+
+    Keyword arguments:
+    func -- A callable receiving one item
+    iterable -- The items to process
+    max_workers(int) -- Number of worker threads
+    max_pending(int) -- Maximum number of submitted calls whose results were
+        not consumed yet (default 2 * max_workers)
+    """
+    if max_workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    if max_pending is None:
+        max_pending = 2 * max_workers
+    max_pending = max(max_pending, max_workers)
+
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers) as executor:
+        try:
+            for item in iterable:
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(func, item))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _put_until_stopped(items, item, stop):
+    """Put item in the queue unless stop is set while waiting for room.
+    Returns true if the item was queued."""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def prefetch(iterable, max_ahead=1):
+    """Consume iterable on a background thread, keeping up to max_ahead
+    items ready while the caller processes the current one.
+
+    Exceptions raised by iterable are re-raised to the caller in order. If
+    the caller stops early, the background thread stops too.
+
+    Keyword arguments:
+    iterable -- The items to produce, such as a generator of pages
+    max_ahead(int) -- Number of items produced in advance. Zero consumes
+        iterable on the calling thread.
+    """
+    if max_ahead < 1:
+        for item in iterable:
+            yield item
+        return
+
+    items = queue.Queue(maxsize=max_ahead)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put_until_stopped(items, (True, item), stop):
+                    return
+        except Exception:
+            _put_until_stopped(items, (False, sys.exc_info()), stop)
+            return
+        _put_until_stopped(items, (None, None), stop)
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            produced, item = items.get()
+            if produced is None:
+                return
+            if not produced:
+                six.reraise(*item)
+            yield item
+    finally:
+        stop.set()
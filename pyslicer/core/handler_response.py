@@ -1,9 +1,30 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import email.utils
+import time
+
 from pyslicer.core.helper_handler_exceptions import slicer_exceptions
 
 
+def parse_retry_after(headers):
+    """Returns the seconds to wait given by a Retry-After header or None
+
+    Keyword arguments:
+    headers -- The response headers
+    """
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
 class SDHandlerResponse(object):
     def __init__(self, result, status_code, headers):
         self.status_code = status_code
@@ -14,7 +35,8 @@ class SDHandlerResponse(object):
         """Find API error."""
         code_error = int(self.result['errors'][0]['code'])
         exception = slicer_exceptions[code_error]
-        raise exception(**self.result['errors'][0])
+        raise exception(retry_after=parse_retry_after(self.headers),
+                        **self.result['errors'][0])
 
     def request_successful(self):
         """Returns true if request was successful
@@ -0,0 +1,586 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+
+import six
+import ujson
+from concurrent.futures import ThreadPoolExecutor
+
+from .. import exceptions
+from ..utils import batch_utils, validators
+from .instrumentation import timer
+
+# Columns telling which dimension an entity belongs to
+_DIMENSION_KEYS = ('dimension', 'table')
+
+
+class InsertResult(object):
+    """The outcome of one insert request sent by an InsertBuffer.
+
+    Attributes:
+        entity_ids(list) -- Ids of the entities sent in the request
+        response(dict) -- The API response, {'status': 'spooled'} when the
+            batch was appended to an InsertSpool, None if it failed
+        error(Exception) -- The exception raised by the request, if any
+        size(int) -- Size of the request body in bytes
+        writes(int) -- Number of add() calls whose columns were sent,
+            larger than the number of entities when writes were coalesced
+    """
+
+    def __init__(self, entity_ids, size, writes, response=None, error=None):
+        self.entity_ids = entity_ids
+        self.size = size
+        self.writes = writes
+        self.response = response
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+def merge_columns(target, columns, list_columns=(), owned=None):
+    """Merge the columns of a write into those of an earlier write to the
+    same entity, as the API would apply both.
+
+    Values of latest-value columns replace the earlier ones. Events, lists
+    and values of the columns in list_columns are appended.
+
+    Keyword arguments:
+    target(dict) -- The columns of the earlier write, updated in place
+    columns(dict) -- The columns of the new write
+    list_columns -- Names of the columns keeping every value inserted, such
+        as columns with 'list-of-values' storage
+    owned(set) -- Names of the lists of target created by previous merges,
+        extended in place instead of copied. Updated with the new ones
+    """
+    for name, value in six.iteritems(columns):
+        if name not in target or name in _DIMENSION_KEYS:
+            target[name] = value
+            if owned is not None:
+                owned.discard(name)
+            continue
+        if not (isinstance(value, (dict, list)) or name in list_columns):
+            target[name] = value
+            if owned is not None:
+                owned.discard(name)
+            continue
+        current = target[name]
+        if owned is None or name not in owned:
+            current = list(current) if isinstance(current, list) \
+                else [current]
+            target[name] = current
+            if owned is not None:
+                owned.add(name)
+        if isinstance(value, list):
+            current.extend(value)
+        else:
+            current.append(value)
+
+
+class _Entry(object):
+    """An entity waiting to be sent, with the writes coalesced into it"""
+    __slots__ = ('seq', 'key', 'added_at', 'entity_id', 'columns',
+                 'fragment', 'size', 'writes', 'owned')
+
+    def __init__(self, seq, key, added_at, entity_id, columns, fragment):
+        self.seq = seq
+        self.key = key
+        self.added_at = added_at
+        self.entity_id = entity_id
+        self.columns = columns
+        # None once a merge made the encoded columns outdated
+        self.fragment = fragment
+        # Bytes counted in the buffer, the sum of the writes
+        self.size = len(fragment) + 1
+        self.writes = 1
+        self.owned = None
+
+
+class _Batch(object):
+    __slots__ = ('first', 'entity_ids', 'body', 'writes')
+
+    def __init__(self, first, entity_ids, body, writes):
+        # Sequence number of the oldest entity, to know what flush() waits
+        self.first = first
+        self.entity_ids = entity_ids
+        self.body = body
+        self.writes = writes
+
+
+class InsertBuffer(object):
+    """Gathers entities added one at a time into full insert requests, sent
+    on background threads, as a Kafka producer does.
+
+    add() encodes the entity and returns at once. A batch is sent when it
+    reaches max_batch_size entities or max_batch_bytes, or when its oldest
+    entity waited linger_ms. Up to max_in_flight batches are sent at once;
+    while they are, new entities keep filling the next batch. An entity is
+    never in two batches sent at the same time, so writes to an entity
+    reach the API in the order they were added.
+
+    With coalesce=True, writes to an entity still waiting to be sent are
+    merged into one, see merge_columns. The columns with 'list-of-values'
+    storage in the client schema keep every value.
+
+    Every batch is sent through the client, so its retry policy, rate
+    limiter and hooks apply. Once a batch succeeds or fails for good, the
+    callback receives an InsertResult. Without a callback, failures are
+    raised by the next flush() or close(), in an
+    InsertBatchesFailedException when several batches failed.
+
+    Given an InsertSpool, batches are appended to it instead, to be sent by
+    the spool: add() never waits for the API, and a batch is delivered once
+    it is on disk.
+
+    Example usage:
+
+        with sd.insert_buffer(linger_ms=50, coalesce=True) as buffer:
+            for event in events:
+                buffer.add(event['user'], {'clicks': event['click']})
+    """
+
+    def __init__(self, client, linger_ms=100,
+                 max_batch_size=validators.MAX_INSERTION_BATCH_SIZE,
+                 max_batch_bytes=validators.MAX_INSERTION_BATCH_BYTES,
+                 max_in_flight=None, max_buffered_bytes=None,
+                 max_block=None, auto_create=None, callback=None,
+                 validation=None, coalesce=False, spool=None):
+        """
+        Parameters:
+            client(SlicingDice) -- The client sending the batches
+            linger_ms(float) -- Milliseconds an entity may wait for its
+                batch to fill up before it is sent anyway
+            max_batch_size(int) -- Maximum entities per request
+            max_batch_bytes(int) -- Maximum size of a request body
+            max_in_flight(int) -- Batches sent concurrently, defaults to
+                the client max_workers
+            max_buffered_bytes(int) -- Size of the entities waiting to be
+                sent above which add() blocks, defaults to 4 *
+                max_batch_bytes
+            max_block(float) -- Seconds add() blocks before raising
+                InsertBufferFullException, defaults to None, no limit
+            auto_create(list) -- Value of the 'auto-create' parameter sent
+                with every batch
+            callback -- Called with the InsertResult of every batch, one
+                at a time on a background thread. It may add() entities but
+                not flush(). Exceptions it raises are ignored
+            validation(string) -- Validation level of the entities, 'full',
+                'structural' or 'off', defaults to the client level
+            coalesce(bool) -- Merge the writes to an entity waiting to be
+                sent, defaults to False
+            spool(InsertSpool) -- Spool the batches are appended to instead
+                of being sent, defaults to None
+        """
+        self._client = client
+        self.linger = linger_ms / 1000.0
+        self.max_batch_size = min(max_batch_size,
+                                  validators.MAX_INSERTION_BATCH_SIZE)
+        self.max_batch_bytes = max_batch_bytes
+        self.max_in_flight = max(1, max_in_flight or client.max_workers)
+        self.max_buffered_bytes = max_buffered_bytes or 4 * max_batch_bytes
+        self.max_block = max_block
+        self.callback = callback
+        self.coalesce = coalesce
+        self.spool = spool
+        self._validate_values = client._validation_level(
+            validation) == validators.VALIDATION_FULL
+        self.auto_create = []
+        self._set_auto_create(auto_create or ())
+
+        self._condition = threading.Condition()
+        # Entities not sent yet by sequence number, in the order added
+        self._pending = collections.OrderedDict()
+        self._pending_bytes = 0
+        # Sequence number of the pending entry of every (id, dimension),
+        # which later writes are merged into
+        self._open = {}
+        self._next_seq = 0
+        self._flush_until = 0
+        self._in_flight = {}
+        self._in_flight_ids = collections.Counter()
+        # Batches answered whose callback is running, by sequence number
+        self._completing = {}
+        self._errors = []
+        self._closed = False
+        self._stats = {'entities': 0, 'batches': 0, 'bytes': 0,
+                       'failed_batches': 0, 'failed_entities': 0,
+                       'writes': 0, 'coalesced': 0, 'write_bytes': 0}
+
+        self._executor = ThreadPoolExecutor(self.max_in_flight)
+        self._callback_executor = ThreadPoolExecutor(1)
+        self._thread = threading.Thread(target=self._run,
+                                        name='slicingdice-insert-buffer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _set_auto_create(self, auto_create):
+        """Add values to the 'auto-create' parameter of the next batches"""
+        for value in auto_create:
+            if value not in self.auto_create:
+                self.auto_create.append(value)
+        self._tail = '}'
+        if self.auto_create:
+            self._tail = (',"auto-create":' + ujson.dumps(self.auto_create) +
+                          '}')
+        # Bytes of a body without entities, as in pack_insert_batches
+        self._overhead = 1 + len(self._tail)
+
+    def add(self, entity_id, columns, auto_create=None):
+        """Queue an entity to be inserted, returning once it is encoded
+
+        Blocks while more than max_buffered_bytes are waiting to be sent.
+        When coalescing, columns must not be changed once added.
+
+        Keyword arguments:
+        entity_id -- The entity id
+        columns(dict) -- The columns to insert for this entity
+        auto_create(list) -- Values added to the 'auto-create' parameter of
+            the batches sent from now on, such as ['column'] (default None)
+        """
+        if entity_id == 'auto-create':
+            raise exceptions.InvalidInsertException(
+                "'auto-create' must be passed as a parameter, not as an "
+                "entity.")
+        fragment = batch_utils.encode_entity(entity_id, columns,
+                                             self._validate_values)
+        with self._condition:
+            if auto_create:
+                self._set_auto_create(auto_create)
+            if self._overhead + len(fragment) > self.max_batch_bytes:
+                raise exceptions.InvalidInsertException(
+                    "The entity '{0}' alone exceeds the limit of {1} bytes "
+                    "per request.".format(entity_id, self.max_batch_bytes))
+            key = None
+            # A merged write grows the buffer as much as a new entry
+            self._wait_for_room(len(fragment) + 1)
+            if self.coalesce:
+                key = (entity_id, _dimension_of(columns))
+                if self._merge(key, columns, fragment):
+                    self._count_write(fragment)
+                    return
+            self._count_write(fragment)
+            entry = _Entry(self._next_seq, key, timer(), entity_id,
+                           columns if self.coalesce else None, fragment)
+            self._next_seq += 1
+            self._pending[entry.seq] = entry
+            self._pending_bytes += entry.size
+            if key is not None:
+                self._open[key] = entry.seq
+            self._notify_if_due()
+
+    def _count_write(self, fragment):
+        self._stats['writes'] += 1
+        self._stats['write_bytes'] += len(fragment)
+
+    def _merge(self, key, columns, fragment):
+        """Merge a write into the pending entry of its entity, returning
+        False if there is none it fits in. Called with the condition
+        held."""
+        seq = self._open.get(key)
+        if seq is None:
+            return False
+        entry = self._pending[seq]
+        if entry.size + len(fragment) + 1 > self._batch_room():
+            # Too large for a single request, the next writes start a new
+            # entry sent after this one
+            return False
+        if entry.owned is None:
+            entry.columns = dict(entry.columns)
+            entry.owned = set()
+        schema = self._client.schema
+        merge_columns(entry.columns, columns, _ListColumns(schema),
+                      entry.owned)
+        entry.fragment = None
+        entry.size += len(fragment) + 1
+        entry.writes += 1
+        self._pending_bytes += len(fragment) + 1
+        self._stats['coalesced'] += 1
+        self._notify_if_due()
+        return True
+
+    def _notify_if_due(self):
+        if (len(self._pending) == 1 or
+                len(self._pending) >= self.max_batch_size or
+                self._pending_bytes >= self._batch_room()):
+            self._condition.notify_all()
+
+    def _wait_for_room(self, size):
+        """Wait until size bytes fit in the buffer. Called with the
+        condition held."""
+        deadline = None
+        if self.max_block is not None:
+            deadline = timer() + self.max_block
+        while True:
+            if self._closed:
+                raise exceptions.InsertBufferClosedException(
+                    "The insert buffer is closed.")
+            if (not self._pending or
+                    self._pending_bytes + size <= self.max_buffered_bytes):
+                return
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - timer()
+                if remaining <= 0:
+                    raise exceptions.InsertBufferFullException(
+                        "The insert buffer stayed full for {0} seconds."
+                        .format(self.max_block))
+            self._condition.wait(remaining)
+
+    def _batch_room(self):
+        return self.max_batch_bytes - self._overhead
+
+    def _oldest(self):
+        """Returns the pending entry added first. Called with the condition
+        held and entities pending."""
+        return next(iter(self._pending.values()))
+
+    def flush(self, timeout=None):
+        """Send every entity added so far and wait for their requests to
+        complete. Returns False if timeout expired first.
+
+        Without a callback, raises the error of the batch that failed since
+        the last flush, or an InsertBatchesFailedException listing them all
+        in errors when several did.
+
+        Keyword arguments:
+        timeout(float) -- Maximum seconds to wait, defaults to None, no
+            limit
+        """
+        deadline = None if timeout is None else timer() + timeout
+        with self._condition:
+            target = self._next_seq
+            self._flush_until = max(self._flush_until, target)
+            self._condition.notify_all()
+            while not self._delivered(target):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - timer()
+                    if remaining <= 0:
+                        return False
+                self._condition.wait(remaining)
+            self._raise_errors()
+        return True
+
+    def _delivered(self, target):
+        """Returns true once the entities numbered below target were sent
+        and answered. Called with the condition held."""
+        if self._pending and self._oldest().seq < target:
+            return False
+        return (all(first >= target for first in self._in_flight) and
+                all(first >= target for first in self._completing))
+
+    def _raise_errors(self):
+        errors = self._errors
+        if not errors:
+            return
+        self._errors = []
+        if len(errors) == 1:
+            raise errors[0]
+        raise exceptions.InsertBatchesFailedException(
+            "{0} insert requests failed, the first with: {1}".format(
+                len(errors), errors[0]), errors=errors)
+
+    def close(self, timeout=None):
+        """Flush the buffer and stop its threads. add() can't be called
+        afterwards.
+
+        Keyword arguments:
+        timeout(float) -- Maximum seconds to wait for the flush, defaults to
+            None, no limit. Entities not sent by then are dropped
+        """
+        try:
+            self.flush(timeout)
+        finally:
+            with self._condition:
+                self._closed = True
+                self._pending.clear()
+                self._open.clear()
+                self._pending_bytes = 0
+                self._condition.notify_all()
+            self._thread.join()
+            self._executor.shutdown(wait=timeout is None)
+            self._callback_executor.shutdown(wait=timeout is None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # The error of the with block is the one to raise, failed batches
+        # are still counted in stats()
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    @property
+    def pending(self):
+        """Number of entities added but not sent yet"""
+        with self._condition:
+            return len(self._pending)
+
+    def stats(self):
+        """Returns the entities, batches and bytes sent, the failed batches
+        and entities, and the entities pending and in flight.
+
+        'writes' counts the calls to add() and 'write_bytes' the size of
+        their columns, 'coalesced' the writes merged into another. The
+        'coalescing_ratio' is writes per entity sent or pending.
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+            stats['in_flight'] = sum(
+                len(batch.entity_ids)
+                for batch in six.itervalues(self._in_flight))
+            entities = stats['writes'] - stats['coalesced']
+            stats['coalescing_ratio'] = (
+                float(stats['writes']) / entities if entities else 1.0)
+            return stats
+
+    def _ready(self, now):
+        """Returns the seconds until the next batch is due, 0 when it is.
+        Called with the condition held and entities pending."""
+        oldest = self._oldest()
+        if (self._closed or oldest.seq < self._flush_until or
+                len(self._pending) >= self.max_batch_size or
+                self._pending_bytes >= self._batch_room()):
+            return 0
+        return max(0, oldest.added_at + self.linger - now)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._pending:
+                        if self._closed:
+                            return
+                        self._condition.wait()
+                        continue
+                    if len(self._in_flight) >= self.max_in_flight:
+                        self._condition.wait()
+                        continue
+                    wait = self._ready(timer())
+                    if wait > 0:
+                        self._condition.wait(wait)
+                        continue
+                    batch = self._drain()
+                    if batch is not None:
+                        break
+                    # Every pending entity is in a batch being sent
+                    self._condition.wait()
+            self._executor.submit(self._send, batch)
+
+    def _drain(self):
+        """Take the entities of the next batch, or None if all of them are
+        in flight. Called with the condition held."""
+        room = self._batch_room()
+        taken = []
+        ids = set()
+        size = 0
+        for entry in six.itervalues(self._pending):
+            if len(taken) >= self.max_batch_size:
+                break
+            entity_id = entry.entity_id
+            if entity_id in ids or entity_id in self._in_flight_ids:
+                continue
+            if entry.fragment is None:
+                entry.fragment = batch_utils.encode_entity(entity_id,
+                                                           entry.columns)
+            if taken and size + len(entry.fragment) + 1 > room:
+                break
+            taken.append(entry)
+            ids.add(entity_id)
+            size += len(entry.fragment) + 1
+        if not taken:
+            return None
+
+        for entry in taken:
+            del self._pending[entry.seq]
+            self._pending_bytes -= entry.size
+            if entry.key is not None and self._open.get(
+                    entry.key) == entry.seq:
+                del self._open[entry.key]
+        self._in_flight_ids.update(ids)
+        body = '{' + ','.join(entry.fragment for entry in taken) + self._tail
+        batch = _Batch(taken[0].seq, [entry.entity_id for entry in taken],
+                       body, sum(entry.writes for entry in taken))
+        self._in_flight[batch.first] = batch
+        # Producers blocked on a full buffer have room again
+        self._condition.notify_all()
+        return batch
+
+    def _send(self, batch):
+        result = InsertResult(batch.entity_ids, len(batch.body),
+                              batch.writes)
+        try:
+            if self.spool is not None:
+                self.spool.append(batch.body)
+                result.response = {'status': 'spooled'}
+            else:
+                result.response = self._client._send_insert_body(batch.body)
+        except Exception as e:
+            result.error = e
+        callback = self.callback
+        with self._condition:
+            # The slot is free before the callback runs, so a callback
+            # adding entities doesn't wait for its own batch. flush() still
+            # waits for the callbacks of the batches it flushes
+            if callback is not None:
+                self._completing[batch.first] = batch
+            del self._in_flight[batch.first]
+            self._in_flight_ids.subtract(batch.entity_ids)
+            for entity_id in batch.entity_ids:
+                if self._in_flight_ids[entity_id] <= 0:
+                    del self._in_flight_ids[entity_id]
+            stats = self._stats
+            stats['batches'] += 1
+            stats['entities'] += len(batch.entity_ids)
+            stats['bytes'] += result.size
+            if result.error is not None:
+                stats['failed_batches'] += 1
+                stats['failed_entities'] += len(batch.entity_ids)
+                if self.callback is None:
+                    self._errors.append(result.error)
+            self._condition.notify_all()
+        if callback is not None:
+            # Callbacks run on their own thread, so one blocked in add()
+            # never holds a thread the next batches are sent from
+            self._callback_executor.submit(self._complete, batch, result,
+                                           callback)
+
+    def _complete(self, batch, result, callback):
+        try:
+            callback(result)
+        except Exception:
+            pass
+        finally:
+            with self._condition:
+                del self._completing[batch.first]
+                self._condition.notify_all()
+
+
+def _dimension_of(columns):
+    for name in _DIMENSION_KEYS:
+        if name in columns:
+            return columns[name]
+    return None
+
+
+class _ListColumns(object):
+    """The columns of a SchemaCache with 'list-of-values' storage, looked up
+    as merge_columns needs them"""
+    __slots__ = ('schema',)
+
+    def __init__(self, schema):
+        self.schema = schema
+
+    def __contains__(self, name):
+        column = self.schema.get(name)
+        return (column is not None and
+                column.get('storage') == 'list-of-values')
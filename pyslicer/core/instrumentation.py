@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import timeit
+
+from ..url_resources import URLResources
+
+# Monotonic on Python 3, the best available wall clock on Python 2
+timer = timeit.default_timer
+
+_ENDPOINTS = sorted(
+    (value for key, value in vars(URLResources).items()
+     if not key.startswith('_')),
+    key=len, reverse=True)
+
+
+def endpoint_of(url):
+    """Returns the URLResources path of a request url, so requests to
+    saved queries of any name share one endpoint.
+
+    Keyword arguments:
+    url(string) -- The request url
+    """
+    for endpoint in _ENDPOINTS:
+        if endpoint in url:
+            return endpoint
+    return url
+
+
+class RequestEvent(object):
+    """What happened during a single call to the API.
+
+    Times are in seconds. Every attribute not known yet is None: before
+    hooks only see the request attributes, after hooks see the outcome.
+
+    Attributes:
+        endpoint(string) -- URLResources path of the request
+        method(string) -- The request type (post, get, put or delete)
+        key_level(int) -- The key level needed by the request
+        bytes_sent(int) -- Size of the request body, after compression
+        bytes_received(int) -- Size of the response body
+        status_code(int) -- HTTP status of the last attempt
+        attempts(int) -- Number of requests sent, 0 if served by the cache
+        cached(bool) -- Whether the result came from the query cache
+        validation_time -- Time spent by the client side validation
+        serialization_time -- Time spent encoding and compressing the body
+        latency -- Time between sending the last attempt and receiving its
+            response
+        parse_time -- Time spent decoding the response
+        total_time -- Time of the whole call, including retries and
+            rate limiting
+        server_took -- The 'took' of the response, time spent by the API
+        error(string) -- Class name of the exception raised, if any
+    """
+
+    def __init__(self, url, method, key_level):
+        self.url = url
+        self.endpoint = endpoint_of(url)
+        self.method = method
+        self.key_level = key_level
+        self.bytes_sent = 0
+        self.bytes_received = None
+        self.status_code = None
+        self.attempts = 0
+        self.cached = False
+        self.validation_time = None
+        self.serialization_time = None
+        self.latency = None
+        self.parse_time = None
+        self.total_time = None
+        self.server_took = None
+        self.error = None
+        self.started_at = timer()
+
+    def finish(self, error=None):
+        self.total_time = timer() - self.started_at
+        if error is not None:
+            self.error = type(error).__name__
+
+
+class RequestHook(object):
+    """Base class of objects notified around every request.
+
+    Hooks are called on the thread making the request, so they must be
+    quick and thread-safe when the client is shared between threads.
+    Exceptions raised by a hook propagate to the caller.
+    """
+
+    def before_request(self, event):
+        """Called once a request is built, before the cache is checked
+
+        Keyword arguments:
+        event(RequestEvent) -- The request about to be made
+        """
+
+    def after_request(self, event):
+        """Called once a request is answered, by the cache or the API, or
+        failed
+
+        Keyword arguments:
+        event(RequestEvent) -- The request and its outcome
+        """
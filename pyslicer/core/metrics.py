@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import abc
+import collections
+import math
+import socket
+import threading
+
+import six
+
+from .instrumentation import RequestHook
+
+# Timings recorded by MetricsCollector, as RequestEvent attributes
+TIMINGS = ('latency', 'server_took', 'validation_time', 'serialization_time',
+           'parse_time', 'total_time')
+
+# Sizes recorded by MetricsCollector, as RequestEvent attributes
+SIZES = ('bytes_sent', 'bytes_received')
+
+
+class Histogram(object):
+    """Histogram with a bounded relative error, in the manner of
+    HdrHistogram.
+
+    Values are stored as integers of unit, in buckets that double in width
+    at every power of two, each split in enough linear sub-buckets to keep
+    significant_figures digits. Memory depends on the range of the values,
+    not on how many were recorded. Not thread-safe.
+    """
+
+    def __init__(self, significant_figures=2, unit=1e-6):
+        """
+        Parameters:
+            significant_figures(int) -- Decimal digits kept for every value
+            unit(float) -- Smallest value told apart, the default keeps
+                microseconds of values in seconds
+        """
+        self.unit = unit
+        self._sub_bits = int(math.ceil(math.log(
+            2 * 10 ** significant_figures, 2)))
+        self._sub_count = 1 << self._sub_bits
+        self._half = self._sub_count >> 1
+        self._counts = collections.defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < self._sub_count:
+            return value
+        shift = value.bit_length() - self._sub_bits
+        return (self._sub_count + (shift - 1) * self._half +
+                (value >> shift) - self._half)
+
+    def _bounds(self, index):
+        """Returns the lowest and highest integer value of a bucket"""
+        if index < self._sub_count:
+            return index, index
+        shift, sub_index = divmod(index - self._sub_count, self._half)
+        shift += 1
+        low = (sub_index + self._half) << shift
+        return low, low + (1 << shift) - 1
+
+    def record(self, value):
+        """Add a value
+
+        Keyword arguments:
+        value(float) -- A value, negative values count as zero
+        """
+        value = max(value, 0)
+        self._counts[self._index(int(value / self.unit))] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Returns the value below which percent of the values fall, or None
+        if no value was recorded
+
+        Keyword arguments:
+        percent(float) -- A percentage between 0 and 100
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(percent / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                low, high = self._bounds(index)
+                value = (low + high) / 2.0 * self.unit
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, percents=(50, 90, 99)):
+        """Returns a dictionary with the count, sum, min, max and the given
+        percentiles, keyed 'p50' and so on"""
+        summary = {'count': self.count, 'sum': self.total,
+                   'min': self.min, 'max': self.max}
+        for percent in percents:
+            summary['p{0:g}'.format(percent)] = self.percentile(percent)
+        return summary
+
+
+class _EndpointMetrics(object):
+
+    def __init__(self, significant_figures):
+        self.requests = 0
+        self.cached = 0
+        self.errors = collections.defaultdict(int)
+        self.bytes = dict((name, 0) for name in SIZES)
+        self.timings = dict(
+            (name, Histogram(significant_figures)) for name in TIMINGS)
+        self.sizes = dict(
+            (name, Histogram(significant_figures, unit=1))
+            for name in SIZES)
+
+
+class MetricsCollector(RequestHook):
+    """Request hook gathering metrics per endpoint: request, cache hit and
+    error counts, bytes sent and received, and histograms of the TIMINGS
+    and SIZES of every request.
+
+    Example usage:
+
+        from pyslicer import SlicingDice
+        from pyslicer.core.metrics import MetricsCollector
+
+        metrics = MetricsCollector()
+        sd = SlicingDice(master_key='my-key', hooks=[metrics])
+        ...
+        print(metrics.snapshot())
+    """
+
+    def __init__(self, significant_figures=2):
+        """
+        Parameters:
+            significant_figures(int) -- Decimal digits kept by histograms
+        """
+        self.significant_figures = significant_figures
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def after_request(self, event):
+        with self._lock:
+            metrics = self._endpoints.get(event.endpoint)
+            if metrics is None:
+                metrics = _EndpointMetrics(self.significant_figures)
+                self._endpoints[event.endpoint] = metrics
+            metrics.requests += 1
+            if event.cached:
+                metrics.cached += 1
+            if event.error is not None:
+                metrics.errors[event.error] += 1
+            for name in SIZES:
+                value = getattr(event, name)
+                if value is not None:
+                    metrics.bytes[name] += value
+                    metrics.sizes[name].record(value)
+            for name in TIMINGS:
+                value = getattr(event, name)
+                if value is not None:
+                    metrics.timings[name].record(value)
+
+    def snapshot(self, percents=(50, 90, 99)):
+        """Returns the metrics of every endpoint in a dictionary
+
+        Keyword arguments:
+        percents -- Percentiles of every histogram to include
+        """
+        snapshot = {}
+        with self._lock:
+            for endpoint, metrics in six.iteritems(self._endpoints):
+                values = {
+                    'requests': metrics.requests,
+                    'cached': metrics.cached,
+                    'errors': dict(metrics.errors),
+                }
+                values.update(metrics.bytes)
+                for name, histogram in six.iteritems(metrics.timings):
+                    values[name] = histogram.summary(percents)
+                for name, histogram in six.iteritems(metrics.sizes):
+                    values[name + '_size'] = histogram.summary(percents)
+                snapshot[endpoint] = values
+        return snapshot
+
+    def reset(self):
+        """Drop every metric gathered so far"""
+        with self._lock:
+            self._endpoints = {}
+
+
+class Exporter(object):
+    """Turns the metrics of a MetricsCollector into a monitoring system
+    format."""
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, prefix='pyslicer', percents=(50, 90, 99)):
+        """
+        Parameters:
+            prefix(string) -- Prefix of every metric name
+            percents -- Percentiles exported for every histogram
+        """
+        self.prefix = prefix
+        self.percents = percents
+
+    @abc.abstractmethod
+    def export(self, collector):
+        """Export the current metrics of collector
+
+        Keyword arguments:
+        collector(MetricsCollector) -- Where metrics are read from
+        """
+
+
+def _label(value):
+    return '"{0}"'.format(
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+
+class PrometheusExporter(Exporter):
+    """Renders metrics in the Prometheus text exposition format, with
+    histograms as summaries. Serve the result of export() on the metrics
+    endpoint of the application."""
+
+    def export(self, collector):
+        """Returns the metrics of collector as Prometheus text"""
+        snapshot = collector.snapshot(self.percents)
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append('# HELP {0}_{1} {2}'.format(
+                self.prefix, name, help_text))
+            lines.append('# TYPE {0}_{1} {2}'.format(
+                self.prefix, name, kind))
+
+        def sample(name, labels, value):
+            lines.append('{0}_{1}{{{2}}} {3!r}'.format(
+                self.prefix, name,
+                ','.join('{0}={1}'.format(key, _label(label))
+                         for key, label in labels),
+                float(value)))
+
+        endpoints = sorted(snapshot)
+        family('requests_total', 'counter', 'Requests made.')
+        for endpoint in endpoints:
+            sample('requests_total', [('endpoint', endpoint)],
+                   snapshot[endpoint]['requests'])
+        family('cache_hits_total', 'counter',
+               'Requests answered by the query cache.')
+        for endpoint in endpoints:
+            sample('cache_hits_total', [('endpoint', endpoint)],
+                   snapshot[endpoint]['cached'])
+        family('errors_total', 'counter', 'Requests failed, by error class.')
+        for endpoint in endpoints:
+            for error, count in sorted(snapshot[endpoint]['errors'].items()):
+                sample('errors_total',
+                       [('endpoint', endpoint), ('error', error)], count)
+        for name, help_text in zip(SIZES, ('Request body bytes sent.',
+                                           'Response body bytes received.')):
+            family(name + '_total', 'counter', help_text)
+            for endpoint in endpoints:
+                sample(name + '_total', [('endpoint', endpoint)],
+                       snapshot[endpoint][name])
+        for name in TIMINGS:
+            metric = name.replace('_time', '') + '_seconds'
+            family(metric, 'summary', 'Request {0}.'.format(
+                name.replace('_', ' ')))
+            for endpoint in endpoints:
+                summary = snapshot[endpoint][name]
+                if not summary['count']:
+                    continue
+                for percent in self.percents:
+                    sample(metric, [('endpoint', endpoint),
+                                    ('quantile', '{0:g}'.format(
+                                        percent / 100.0))],
+                           summary['p{0:g}'.format(percent)])
+                sample(metric + '_sum', [('endpoint', endpoint)],
+                       summary['sum'])
+                sample(metric + '_count', [('endpoint', endpoint)],
+                       summary['count'])
+        return '\n'.join(lines) + '\n'
+
+
+class StatsDExporter(Exporter):
+    """Sends metrics to a StatsD server over UDP: counts as counters of
+    what changed since the previous export, and histogram percentiles as
+    gauges in milliseconds. Call export() periodically, for instance from
+    a timer thread."""
+
+    def __init__(self, host='localhost', port=8125, prefix='pyslicer',
+                 percents=(50, 90, 99), max_packet_size=512):
+        """
+        Parameters:
+            host(string) -- StatsD server host
+            port(int) -- StatsD server port
+            prefix(string) -- Prefix of every metric name
+            percents -- Percentiles exported for every histogram
+            max_packet_size(int) -- Maximum size of each UDP packet
+        """
+        super(StatsDExporter, self).__init__(prefix, percents)
+        self.address = (host, port)
+        self.max_packet_size = max_packet_size
+        self._sent_counts = {}
+        self._socket = None
+
+    def _name(self, endpoint, metric):
+        path = '.'.join(part for part in endpoint.split('/') if part)
+        return '{0}.{1}.{2}'.format(self.prefix, path or 'root', metric)
+
+    def _counter(self, lines, name, total):
+        delta = total - self._sent_counts.get(name, 0)
+        self._sent_counts[name] = total
+        if delta:
+            lines.append('{0}:{1}|c'.format(name, delta))
+
+    def lines(self, collector):
+        """Returns the StatsD lines for the current metrics of collector"""
+        lines = []
+        snapshot = collector.snapshot(self.percents)
+        for endpoint, values in sorted(snapshot.items()):
+            self._counter(lines, self._name(endpoint, 'requests'),
+                          values['requests'])
+            self._counter(lines, self._name(endpoint, 'cache_hits'),
+                          values['cached'])
+            for error, count in sorted(values['errors'].items()):
+                self._counter(
+                    lines, self._name(endpoint, 'errors.' + error), count)
+            for name in SIZES:
+                self._counter(lines, self._name(endpoint, name),
+                              values[name])
+            for name in TIMINGS:
+                summary = values[name]
+                if not summary['count']:
+                    continue
+                for percent in self.percents:
+                    lines.append('{0}:{1:.3f}|g'.format(
+                        self._name(endpoint, '{0}.p{1:g}'.format(
+                            name, percent)),
+                        summary['p{0:g}'.format(percent)] * 1000))
+        return lines
+
+    def export(self, collector):
+        """Send the current metrics of collector"""
+        packet = []
+        size = 0
+        for line in self.lines(collector):
+            if packet and size + len(line) + 1 > self.max_packet_size:
+                self._send('\n'.join(packet))
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self._send('\n'.join(packet))
+
+    def _send(self, payload):
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._socket.sendto(payload.encode('utf-8'), self.address)
+        except socket.error:
+            # Metrics must never break the application
+            pass
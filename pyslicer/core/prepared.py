@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import math
+import re
+import uuid
+
+import six
+import ujson
+
+from .. import exceptions
+from ..utils import validators
+
+
+class Param(object):
+    """Placeholder for a value bound when a prepared query is called.
+
+    Example usage:
+
+        from pyslicer.core.prepared import Param
+
+        count = sd.prepare('count_entity', [{
+            'query-name': 'buyers',
+            'query': [{'purchases': {
+                'equals': Param('product'),
+                'between': [Param('start'), Param('end')]}}]}])
+        count(product='book', start='7 days ago', end='now')
+    """
+
+    def __init__(self, name):
+        """
+        Parameters:
+            name(string) -- Name used to bind a value to this placeholder
+        """
+        self.name = name
+
+    def __repr__(self):
+        return 'Param({0!r})'.format(self.name)
+
+
+def sql_literal(value):
+    """Returns value encoded as a SQL literal
+
+    Keyword arguments:
+    value -- A string, number, boolean, None, date or a list of them, which
+        is encoded as a comma separated list for IN clauses
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, six.integer_types):
+        # repr() of a Python 2 long ends with 'L'
+        return str(value)
+    if isinstance(value, float):
+        if math.isinf(value) or math.isnan(value):
+            raise exceptions.WrongTypeException(
+                "Can't bind {0} in a SQL query.".format(value))
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return ', '.join(sql_literal(item) for item in value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    if not isinstance(value, six.string_types):
+        raise exceptions.WrongTypeException(
+            "Can't bind a {0} value in a SQL query.".format(
+                type(value).__name__))
+    return "'" + value.replace("'", "''") + "'"
+
+
+class _Template(object):
+    """A query split into invariant fragments and parameter slots.
+
+    Rendering joins fragments[0], slot 0, fragments[1], slot 1 and so on,
+    so only the bound values are encoded on each call.
+    """
+
+    def __init__(self, fragments, names, encode):
+        self.fragments = fragments
+        self.names = names
+        self.param_names = frozenset(names)
+        self.encode = encode
+        self._slots = list(zip(names, fragments[1:]))
+
+    def render(self, params):
+        """Returns the query with the values of params in its slots
+
+        Keyword arguments:
+        params(dict) -- A value for every parameter name
+        """
+        if len(params) != len(self.param_names) or not all(
+                name in params for name in self.param_names):
+            missing = self.param_names.difference(params)
+            unknown = set(params).difference(self.param_names)
+            raise exceptions.InvalidQueryException(
+                "Wrong parameters, missing: {0}, unknown: {1}.".format(
+                    sorted(missing), sorted(unknown)))
+        encode = self.encode
+        parts = [self.fragments[0]]
+        for name, fragment in self._slots:
+            parts.append(encode(params[name]))
+            parts.append(fragment)
+        return ''.join(parts)
+
+
+def compile_json(query):
+    """Returns a _Template of a dictionary or list query with Param values
+
+    The query is serialized once with a unique marker in place of each
+    Param and the JSON is split around the markers, in the order the
+    serializer wrote them, which for dictionaries may not be the order
+    they were numbered in.
+
+    Keyword arguments:
+    query -- A query, where any value can be a Param
+    """
+    marker = 'pyslicer-param-{0}-'.format(uuid.uuid4().hex)
+    names = []
+
+    def replace(value):
+        if isinstance(value, Param):
+            names.append(value.name)
+            return '{0}{1}'.format(marker, len(names) - 1)
+        if isinstance(value, dict):
+            return dict((key, replace(item))
+                        for key, item in six.iteritems(value))
+        if isinstance(value, list):
+            return [replace(item) for item in value]
+        return value
+
+    serialized = ujson.dumps(replace(query))
+    fragments = []
+    slot_names = []
+    start = 0
+    for match in re.finditer('"{0}(\\d+)"'.format(marker), serialized):
+        fragments.append(serialized[start:match.start()])
+        slot_names.append(names[int(match.group(1))])
+        start = match.end()
+    fragments.append(serialized[start:])
+    return _Template(fragments, slot_names, ujson.dumps)
+
+
+_SQL_PARAMETER = re.compile(r'%\((\w+)\)s|%%')
+
+
+def compile_sql(query):
+    """Returns a _Template of a SQL query with %(name)s placeholders
+
+    Bound values are encoded with sql_literal, and '%%' stands for '%'.
+
+    Keyword arguments:
+    query(string) -- A SQL statement
+    """
+    names = []
+    fragments = []
+    current = []
+    start = 0
+    for match in _SQL_PARAMETER.finditer(query):
+        current.append(query[start:match.start()])
+        start = match.end()
+        if match.group(1) is None:
+            current.append('%')
+        else:
+            fragments.append(''.join(current))
+            current = []
+            names.append(match.group(1))
+    current.append(query[start:])
+    fragments.append(''.join(current))
+    return _Template(fragments, names, sql_literal)
+
+
+def _check_param(name, value):
+    if isinstance(value, Param):
+        raise exceptions.WrongTypeException(
+            "The value of '{0}' is a Param.".format(name))
+    validators.check_values({name: value})
+
+
+class PreparedQuery(object):
+    """A query compiled by SlicingDice.prepare(), sent by calling it with
+    the values of its parameters.
+
+    Values can be given as keyword arguments or as a dictionary, which is
+    needed for parameter names that aren't Python identifiers.
+    """
+
+    def __init__(self, client, url, template, content_type, cacheable,
+                 invalidates_cache, check_params):
+        """
+        Parameters:
+            client(SlicingDice) -- Client used to send the query
+            url(string) -- Url of the endpoint
+            template(_Template) -- The compiled query
+            content_type(string) -- Content type of the request body
+            cacheable(bool) -- Whether results can come from the cache
+            invalidates_cache(bool) -- Whether the query changes data
+            check_params(bool) -- Reject None, empty strings and empty
+                containers in bound values
+        """
+        self.client = client
+        self.url = url
+        self.template = template
+        self.content_type = content_type
+        self.cacheable = cacheable
+        self.invalidates_cache = invalidates_cache
+        self.check_params = check_params
+
+    @property
+    def param_names(self):
+        """Names of the parameters to bind"""
+        return self.template.param_names
+
+    def render(self, params=None, **kwargs):
+        """Returns the request body with the given parameter values"""
+        if params:
+            kwargs.update(params)
+        if self.check_params:
+            for name, value in six.iteritems(kwargs):
+                _check_param(name, value)
+        return self.template.render(kwargs)
+
+    def __call__(self, params=None, raw=False, **kwargs):
+        """Bind parameter values and send the query.
+
+        Keyword arguments:
+        params(dict) -- Parameter values, merged with kwargs (default None)
+        raw(bool) -- Return the response body as undecoded bytes
+            (default False)
+        """
+        body = self.render(params, **kwargs)
+        return self.client._make_request(
+            url=self.url,
+            string_data=body,
+            req_type="post",
+            key_level=0,
+            content_type=self.content_type,
+            cache_query=self._cache_query(body),
+            invalidates_cache=self.invalidates_cache,
+            raw=raw)
+
+    def _cache_query(self, body):
+        """Returns the query the cache key and TTL of a call are computed
+        from, the same as for the query sent without preparing it"""
+        if not self.cacheable or self.client.cache is None:
+            return None
+        if self.content_type == 'application/json':
+            # Keys are built from the decoded query with sorted keys, and
+            # its 'cache-period' sets the TTL
+            return ujson.loads(body)
+        return body
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import six
+
+KEY_LEVEL_NAMES = {0: 'read', 1: 'write', 2: 'master'}
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket.
+
+    Callers reserve tokens up front and are told how long to wait for them,
+    so concurrent callers queue up in arrival order without polling.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Parameters:
+            rate(float) -- Tokens added per second
+            capacity(float) -- Maximum tokens stored for bursts, defaults to
+                one second worth of tokens
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """Take tokens, returning the seconds to wait until they are
+        available
+
+        Keyword arguments:
+        amount(float) -- Number of tokens to take
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def try_take(self, amount=1):
+        """Take tokens only if they are available now, returning 0, or
+        leave them and return the seconds until they are
+
+        Keyword arguments:
+        amount(float) -- Number of tokens to take
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+
+class RateLimiter(object):
+    """Paces requests per key level (read, write and master) in requests per
+    second and bytes per second.
+
+    One limiter can be shared by several clients and threads so that all of
+    them stay under the same quota.
+
+    Example usage:
+
+        from pyslicer import SlicingDice
+        from pyslicer.core.rate_limiter import RateLimiter
+
+        limiter = RateLimiter(
+            requests_per_second={'read': 20, 'write': 10},
+            bytes_per_second={'write': 8 * 1024 * 1024})
+        sd = SlicingDice(master_key='my-key', rate_limiter=limiter)
+    """
+
+    def __init__(self, requests_per_second=None, bytes_per_second=None,
+                 burst=1.0):
+        """
+        Parameters:
+            requests_per_second(dict) -- Requests per second keyed by key
+                level name ('read', 'write' or 'master')
+            bytes_per_second(dict) -- Request body bytes per second keyed by
+                key level name
+            burst(float) -- Seconds worth of tokens that can be spent at once
+        """
+        self._request_buckets = self._make_buckets(
+            requests_per_second, burst)
+        self._byte_buckets = self._make_buckets(bytes_per_second, burst)
+        self._lock = threading.Lock()
+        self._stats = dict(
+            (name, {'requests': 0, 'delayed': 0, 'delay': 0.0,
+                    'max_delay': 0.0})
+            for name in six.itervalues(KEY_LEVEL_NAMES))
+
+    @staticmethod
+    def _make_buckets(rates, burst):
+        buckets = {}
+        for name, rate in six.iteritems(rates or {}):
+            if name not in KEY_LEVEL_NAMES.values():
+                raise ValueError(
+                    "Unknown key level '{0}', use 'read', 'write' or "
+                    "'master'.".format(name))
+            buckets[name] = TokenBucket(rate, rate * burst)
+        return buckets
+
+    def reserve(self, key_level, size=0):
+        """Account for a request, returning the seconds it must wait before
+        being sent
+
+        Keyword arguments:
+        key_level(int) -- The key level needed by the request
+        size(int) -- The request body size in bytes
+        """
+        name = KEY_LEVEL_NAMES[key_level]
+        delay = 0.0
+        if name in self._request_buckets:
+            delay = self._request_buckets[name].reserve(1)
+        if size and name in self._byte_buckets:
+            delay = max(delay, self._byte_buckets[name].reserve(size))
+
+        with self._lock:
+            stats = self._stats[name]
+            stats['requests'] += 1
+            if delay > 0:
+                stats['delayed'] += 1
+                stats['delay'] += delay
+                stats['max_delay'] = max(stats['max_delay'], delay)
+        return delay
+
+    def acquire(self, key_level, size=0):
+        """Block until a request may be sent, returning the seconds waited
+
+        Keyword arguments:
+        key_level(int) -- The key level needed by the request
+        size(int) -- The request body size in bytes
+        """
+        delay = self.reserve(key_level, size)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def stats(self):
+        """Returns the number of requests, how many were delayed and the
+        total and maximum queueing delay in seconds, per key level"""
+        with self._lock:
+            return dict((name, dict(stats))
+                        for name, stats in six.iteritems(self._stats))
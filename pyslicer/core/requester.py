@@ -1,16 +1,139 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import socket
+
 import requests
+from requests.packages.urllib3.connection import HTTPConnection
 
 from .. import exceptions
 
+# Defaults of the keep_alive option of Requester, in seconds and probes
+KEEP_ALIVE_DEFAULTS = {'idle': 60, 'interval': 10, 'count': 5}
+
+
+def keep_alive_socket_options(idle=60, interval=10, count=5):
+    """Returns socket options enabling TCP keep-alive probes, so idle
+    pooled connections are kept open by NATs and load balancers and dead
+    ones are detected. Options the platform lacks are left out.
+
+    Keyword arguments:
+    idle(int) -- Seconds of inactivity before the first probe
+    interval(int) -- Seconds between probes
+    count(int) -- Unanswered probes before the connection is dropped
+    """
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # TCP_KEEPALIVE is the macOS name of TCP_KEEPIDLE
+    idle_option = getattr(socket, 'TCP_KEEPIDLE',
+                          getattr(socket, 'TCP_KEEPALIVE', None))
+    for option, value in ((idle_option, idle),
+                          (getattr(socket, 'TCP_KEEPINTVL', None), interval),
+                          (getattr(socket, 'TCP_KEEPCNT', None), count)):
+        if option is not None:
+            options.append((socket.IPPROTO_TCP, option, value))
+    return options
+
+
+def keep_alive_settings(keep_alive):
+    """Returns the socket options of a keep_alive option, None when it
+    is not enabled
+
+    Keyword arguments:
+    keep_alive -- True or a dictionary with 'idle', 'interval' and 'count'
+        values overriding KEEP_ALIVE_DEFAULTS
+    """
+    if not keep_alive:
+        return None
+    settings = dict(KEEP_ALIVE_DEFAULTS)
+    if isinstance(keep_alive, dict):
+        settings.update(keep_alive)
+    return keep_alive_socket_options(**settings)
+
+
+class _SocketOptionsAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter opening its connections with extra socket options"""
+
+    def __init__(self, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super(_SocketOptionsAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options:
+            kwargs['socket_options'] = (
+                HTTPConnection.default_socket_options + self.socket_options)
+        super(_SocketOptionsAdapter, self).init_poolmanager(*args, **kwargs)
+
 
 class Requester(object):
-    def __init__(self, use_ssl, timeout):
+    def __init__(self, use_ssl, timeout, pool_maxsize=10,
+                 pool_connections=10, pool_block=False, keep_alive=None,
+                 connect_timeout=None):
+        """
+        Parameters:
+            use_ssl(bool) -- Verify SSL certificates of HTTPS requests
+            timeout(float) -- Seconds to wait for a response
+            pool_maxsize(int) -- Connections kept open per host
+            pool_connections(int) -- Hosts whose connection pools are kept
+            pool_block(bool) -- Wait for a pooled connection to be free
+                when pool_maxsize connections are in use, instead of opening
+                one that is closed after the request
+            keep_alive -- True or a dictionary with 'idle', 'interval' and
+                'count' values to enable TCP keep-alive probes on pooled
+                connections, see keep_alive_socket_options
+            connect_timeout(float) -- Seconds to wait for a connection to be
+                established, defaults to timeout
+        """
         self.use_ssl = use_ssl
         self.timeout = timeout
+        if connect_timeout is not None:
+            self.timeout = (connect_timeout, timeout)
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        socket_options = keep_alive_settings(keep_alive)
         self.session = requests.Session()
+        # One connection per concurrent request, otherwise urllib3 discards
+        # the extra connections and pays a new handshake on every request
+        adapter = _SocketOptionsAdapter(
+            socket_options=socket_options,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def pool_stats(self):
+        """Returns the utilization of the connection pool of every host
+        contacted, keyed by 'scheme://host:port':
+
+            connections_opened -- Connections opened since the pool exists
+            requests -- Requests sent through the pool
+            in_use -- Connections currently taken by requests
+            idle -- Open connections waiting in the pool
+            maxsize -- Connections kept open at most
+        """
+        stats = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = getattr(adapter, 'poolmanager', None)
+            if pools is None:
+                continue
+            for key in list(pools.pools.keys()):
+                pool = pools.pools.get(key)
+                # pool.pool is None once the pool is closed
+                if pool is None or pool.pool is None:
+                    continue
+                # The queue holds an open connection or a None placeholder
+                # for every connection that is not in use
+                waiting = list(pool.pool.queue)
+                name = '{0}://{1}:{2}'.format(
+                    pool.scheme, pool.host, pool.port)
+                stats[name] = {
+                    'connections_opened': pool.num_connections,
+                    'requests': pool.num_requests,
+                    'in_use': max(0, pool.pool.maxsize - len(waiting)),
+                    'idle': sum(1 for conn in waiting if conn is not None),
+                    'maxsize': pool.pool.maxsize,
+                }
+        return stats
 
     def post(self, url, data, headers):
         """Executes a post request result object"""
@@ -21,6 +144,8 @@ class Requester(object):
                 verify=self.use_ssl,
                 headers=headers,
                 timeout=self.timeout)
+        except requests.ConnectTimeout as e:
+            raise exceptions.SlicingDiceHTTPError(e, request_sent=False)
         except requests.ConnectionError as e:
             raise exceptions.SlicingDiceHTTPError(e)
         except requests.Timeout as e:
@@ -35,6 +160,8 @@ class Requester(object):
                 verify=self.use_ssl,
                 headers=headers,
                 timeout=self.timeout)
+        except requests.ConnectTimeout as e:
+            raise exceptions.SlicingDiceHTTPError(e, request_sent=False)
         except requests.ConnectionError as e:
             raise exceptions.SlicingDiceHTTPError(e)
         except requests.Timeout as e:
@@ -48,6 +175,8 @@ class Requester(object):
                 verify=self.use_ssl,
                 headers=headers,
                 timeout=self.timeout)
+        except requests.ConnectTimeout as e:
+            raise exceptions.SlicingDiceHTTPError(e, request_sent=False)
         except requests.ConnectionError as e:
             raise exceptions.SlicingDiceHTTPError(e)
         except requests.Timeout as e:
@@ -61,6 +190,8 @@ class Requester(object):
                 verify=self.use_ssl,
                 headers=headers,
                 timeout=self.timeout)
+        except requests.ConnectTimeout as e:
+            raise exceptions.SlicingDiceHTTPError(e, request_sent=False)
         except requests.ConnectionError as e:
             raise exceptions.SlicingDiceHTTPError(e)
         except requests.Timeout as e:
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+try:
+    import contextvars
+except ImportError:
+    # Python < 3.7
+    contextvars = None
+
+
+class ResponseInfo(object):
+    """Metadata of the response to a single call.
+
+    Attributes:
+        status_code(int) -- HTTP status, None when served by the cache
+        headers(dict) -- Response headers, None when served by the cache
+        took(float) -- Seconds the API spent on the request, when the
+            response was decoded
+        bytes_sent(int) -- Size of the request body, after compression
+        bytes_received(int) -- Size of the response body
+        latency(float) -- Seconds between sending the last attempt and
+            receiving its response
+        attempts(int) -- Number of requests sent, 0 if served by the cache
+        cached(bool) -- Whether the result came from the query cache
+    """
+
+    def __init__(self, status_code=None, headers=None, took=None,
+                 bytes_sent=0, bytes_received=None, latency=None,
+                 attempts=0, cached=False):
+        self.status_code = status_code
+        self.headers = headers
+        self.took = took
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.latency = latency
+        self.attempts = attempts
+        self.cached = cached
+
+    def __repr__(self):
+        return ('ResponseInfo(status_code={0!r}, took={1!r}, '
+                'latency={2!r}, attempts={3!r}, cached={4!r})').format(
+                    self.status_code, self.took, self.latency,
+                    self.attempts, self.cached)
+
+
+class ContextLocal(object):
+    """A value kept per thread, and per asyncio task where contextvars is
+    available, so calls made concurrently through one client don't
+    overwrite each other's. Used for the last ResponseInfo and the client
+    side times of the next request."""
+
+    def __init__(self, name):
+        """
+        Parameters:
+            name(string) -- Name of the context variable
+        """
+        if contextvars is not None:
+            # Context variables are per thread too, each thread starts in
+            # its own context
+            self._var = contextvars.ContextVar(name)
+            self._local = None
+        else:
+            self._var = None
+            self._local = threading.local()
+
+    def get(self, default=None):
+        """Returns the value of the current thread or task, or default"""
+        if self._var is not None:
+            return self._var.get(default)
+        return getattr(self._local, 'value', default)
+
+    def set(self, value):
+        """Store the value of the current thread or task"""
+        if self._var is not None:
+            self._var.set(value)
+        else:
+            self._local.value = value
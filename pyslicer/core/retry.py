@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+
+from .. import exceptions
+
+
+# Request timeout, rate limit and server errors
+RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+
+class RetryPolicy(object):
+    """Decide if and when a failed request is sent again.
+
+    Delays grow exponentially with full jitter: attempt n waits a random
+    time between 0 and min(backoff_cap, backoff_base * 2 ** (n - 1))
+    seconds, unless the API asked for a specific wait with Retry-After,
+    which is capped at max_retry_after.
+
+    Requests that are not idempotent, such as inserts, are only retried
+    when the error proves the API did not process them: the error is one of
+    safe_retry_on, or the connection could not be established.
+
+    Errors carrying an HTTP status are only retried when the status is one
+    of retry_statuses, so permanent errors such as 400 or 404 fail at once.
+    Connection errors and timeouts have no status and are retried.
+
+    Example usage:
+
+        from pyslicer import SlicingDice
+        from pyslicer.core.retry import RetryPolicy
+
+        sd = SlicingDice(
+            master_key='my-key',
+            retry_policy=RetryPolicy(max_attempts=5, backoff_cap=10))
+    """
+
+    def __init__(self, max_attempts=3, backoff_base=0.5, backoff_cap=30.0,
+                 retry_on=(exceptions.RequestRateLimitException,
+                           exceptions.SlicingDiceHTTPError),
+                 safe_retry_on=(exceptions.RequestRateLimitException,),
+                 respect_retry_after=True, max_retry_after=None,
+                 retry_statuses=RETRY_STATUSES):
+        """
+        Parameters:
+            max_attempts(int) -- Maximum number of times a request is sent
+            backoff_base(float) -- Seconds of the first backoff window
+            backoff_cap(float) -- Maximum seconds of a backoff window
+            retry_on(tuple) -- Exception classes that can be retried
+            safe_retry_on(tuple) -- Exception classes raised only for
+                requests the API did not process, so they can be retried
+                even when not idempotent
+            respect_retry_after(bool) -- Wait the time given by a
+                Retry-After header instead of the backoff
+            max_retry_after(float) -- Maximum seconds waited for a
+                Retry-After header, defaults to backoff_cap
+            retry_statuses(iterable) -- HTTP status codes that can be
+                retried, errors without a status are not filtered
+        """
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retry_on = tuple(retry_on)
+        self.safe_retry_on = tuple(safe_retry_on)
+        self.respect_retry_after = respect_retry_after
+        self.max_retry_after = (backoff_cap if max_retry_after is None
+                                else max_retry_after)
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def should_retry(self, error, attempt, idempotent):
+        """Returns true if a request that failed should be sent again
+
+        Keyword arguments:
+        error(SlicingDiceException) -- The error raised by the attempt
+        attempt(int) -- Number of the failed attempt, starting at 1
+        idempotent(bool) -- Define if the request can safely be repeated
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if not isinstance(error, self.retry_on):
+            return False
+        status_code = getattr(error, 'status_code', None)
+        if status_code is not None and status_code not in self.retry_statuses:
+            return False
+        if idempotent:
+            return True
+        return (isinstance(error, self.safe_retry_on) or
+                getattr(error, 'request_sent', None) is False)
+
+    def delay(self, error, attempt):
+        """Returns the seconds to wait before the next attempt
+
+        Keyword arguments:
+        error(SlicingDiceException) -- The error raised by the attempt
+        attempt(int) -- Number of the failed attempt, starting at 1
+        """
+        retry_after = getattr(error, 'retry_after', None)
+        if self.respect_retry_after and retry_after is not None:
+            # A wrong or hostile header must not stall the client for hours
+            return max(0.0, min(retry_after, self.max_retry_after))
+        window = min(self.backoff_cap,
+                     self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, window)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+import six
+
+
+class SchemaCache(object):
+    """Column metadata of a database, as returned by get_columns, keyed by
+    the column api-name.
+
+    Filled by SlicingDice.load_schema() and kept up to date with the
+    columns created through the same client. Thread-safe.
+    """
+
+    def __init__(self):
+        self._columns = {}
+        self._loaded = False
+        self._stale = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """Whether the columns were loaded from the API"""
+        return self._loaded
+
+    @property
+    def stale(self):
+        """Whether columns were created whose api-name isn't known, so the
+        columns must be loaded again to know them"""
+        return self._stale
+
+    def load(self, response):
+        """Replace the cached columns with those of a get_columns response
+
+        Keyword arguments:
+        response(dict) -- A get_columns response, with 'active' and
+            'inactive' lists of columns
+        """
+        columns = {}
+        for status in ('inactive', 'active'):
+            for column in response.get(status) or ():
+                if 'api-name' in column:
+                    columns[column['api-name']] = column
+        with self._lock:
+            self._columns = columns
+            self._loaded = True
+            self._stale = False
+
+    def add(self, columns, response=None):
+        """Add created columns to the cache
+
+        Keyword arguments:
+        columns -- A column dictionary or a list of them, as sent to
+            create_column
+        response(dict) -- The create_column response, whose 'api-name' or
+            'api-names' name the columns sent without an 'api-name'. Columns
+            whose name is still unknown make the cache stale.
+        """
+        if not isinstance(columns, list):
+            columns = [columns]
+        api_names = _api_names(response)
+        if len(api_names) != len(columns):
+            api_names = [None] * len(columns)
+        with self._lock:
+            for column, api_name in zip(columns, api_names):
+                api_name = column.get('api-name') or api_name
+                if api_name is None:
+                    self._stale = True
+                    continue
+                column = dict(column)
+                column['api-name'] = api_name
+                self._columns[api_name] = column
+
+    def clear(self):
+        """Drop every cached column"""
+        with self._lock:
+            self._columns = {}
+            self._loaded = False
+            self._stale = False
+
+    def get(self, name):
+        """Returns the metadata of a column, or None if it isn't known
+
+        Keyword arguments:
+        name(string) -- The api-name of the column
+        """
+        return self._columns.get(name)
+
+    def column_type(self, name):
+        """Returns the type of a column, such as 'integer' or
+        'string-event', or None if it isn't known
+
+        Keyword arguments:
+        name(string) -- The api-name of the column
+        """
+        column = self._columns.get(name)
+        if column is None:
+            return None
+        return column.get('type')
+
+    def types(self):
+        """Returns a dictionary with the type of every known column"""
+        with self._lock:
+            return dict((name, column.get('type'))
+                        for name, column in six.iteritems(self._columns))
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __len__(self):
+        return len(self._columns)
+
+
+def _api_names(response):
+    """Returns the api-names of the columns a create_column response
+    reports, in the order they were sent"""
+    if not isinstance(response, dict):
+        return []
+    if response.get('api-names'):
+        return list(response['api-names'])
+    if response.get('api-name'):
+        return [response['api-name']]
+    return []
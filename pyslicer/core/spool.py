@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import errno
+import mmap
+import os
+import random
+import struct
+import threading
+import zlib
+
+import six
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where spool directories are not locked
+    fcntl = None
+
+from .. import exceptions
+from ..utils import validators
+from .instrumentation import timer
+
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+# Length and CRC32 of the body of a record. A zero length ends a segment.
+_HEADER = struct.Struct('>II')
+# Position of an acknowledged record, appended to the .ack file of its
+# segment
+_ACK = struct.Struct('>Q')
+
+# Client side validation errors of an insert request, which would fail
+# again the same way
+REJECT_ON = (exceptions.InvalidInsertException,
+             exceptions.InvalidColumnException,
+             exceptions.InvalidColumnNameException,
+             exceptions.InvalidColumnTypeException,
+             exceptions.WrongTypeException,
+             exceptions.MaxLimitException)
+# API errors about the request itself: 1507 (body size exceeded) and the
+# 20xx errors about its payload, such as too many entities or columns.
+# Every other error, such as an invalid key, a rate limit or an unmapped
+# server error, may go away, so the request is retried.
+REJECT_CODES = frozenset([1507]) | frozenset(range(2000, 2100))
+
+_SEGMENT_SUFFIX = '.spool'
+_ACK_SUFFIX = '.ack'
+_LOCK_NAME = 'lock'
+
+
+def _lock_directory(directory):
+    """Returns the lock file of a spool directory, holding an exclusive
+    lock released when the file is closed or the process exits"""
+    lock = open(os.path.join(directory, _LOCK_NAME), 'a')
+    if fcntl is None:
+        return lock
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+        lock.close()
+        if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+            raise exceptions.InsertSpoolLockedException(
+                "The spool directory {0} is used by another "
+                "spool.".format(directory))
+        raise
+    return lock
+
+
+class _Segment(object):
+    """A spool file holding records one after another, preallocated and
+    memory-mapped, with the positions of the acknowledged records in a
+    .ack file next to it."""
+
+    def __init__(self, directory, number, size=None):
+        """
+        Parameters:
+            directory(string) -- The spool directory
+            number(int) -- Number of the segment, its order in the spool
+            size(int) -- Size of a new segment, None to open an existing one
+        """
+        self.number = number
+        self.path = os.path.join(
+            directory, '{0:020d}{1}'.format(number, _SEGMENT_SUFFIX))
+        self.ack_path = os.path.join(
+            directory, '{0:020d}{1}'.format(number, _ACK_SUFFIX))
+        self.writable = size is not None
+        if self.writable:
+            self._file = open(self.path, 'w+b')
+            self._file.truncate(size)
+        else:
+            self._file = open(self.path, 'r+b')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.map = mmap.mmap(self._file.fileno(), self.size)
+        self.end = 0
+        self.records = 0
+        self.acked = set()
+        self._ack_file = None
+
+    def scan(self):
+        """Returns the (position, length) of the records written, stopping
+        at the end of the segment or at a record torn by a crash"""
+        records = []
+        position = 0
+        while position + _HEADER.size <= self.size:
+            length, crc = _HEADER.unpack_from(self.map, position)
+            start = position + _HEADER.size
+            if length == 0 or start + length > self.size:
+                break
+            if zlib.crc32(self.map[start:start + length]) & 0xffffffff != crc:
+                break
+            records.append((position, length))
+            position = start + length
+        self.end = position
+        self.records = len(records)
+        if os.path.exists(self.ack_path):
+            with open(self.ack_path, 'rb') as ack_file:
+                data = ack_file.read()
+            # A torn last position is ignored, its record is sent again
+            for offset in range(0, len(data) - _ACK.size + 1, _ACK.size):
+                self.acked.add(_ACK.unpack_from(data, offset)[0])
+        return records
+
+    def fits(self, length):
+        return self.end + _HEADER.size + length <= self.size
+
+    def append(self, body):
+        """Write a record, returning its position"""
+        position = self.end
+        start = position + _HEADER.size
+        self.map[start:start + len(body)] = body
+        # The header goes last, so a record is only valid once complete
+        _HEADER.pack_into(self.map, position, len(body),
+                          zlib.crc32(body) & 0xffffffff)
+        self.end = start + len(body)
+        self.records += 1
+        return position
+
+    def read(self, position, length):
+        start = position + _HEADER.size
+        return self.map[start:start + length]
+
+    def sync(self):
+        self.map.flush()
+
+    def ack(self, position, sync):
+        if self._ack_file is None:
+            self._ack_file = open(self.ack_path, 'ab')
+        self._ack_file.write(_ACK.pack(position))
+        self._ack_file.flush()
+        if sync:
+            os.fsync(self._ack_file.fileno())
+        self.acked.add(position)
+
+    def sync_acks(self):
+        if self._ack_file is not None:
+            os.fsync(self._ack_file.fileno())
+
+    @property
+    def done(self):
+        """Whether the segment is full and every record was acknowledged"""
+        return not self.writable and len(self.acked) >= self.records
+
+    def close(self):
+        self.map.close()
+        self._file.close()
+        if self._ack_file is not None:
+            self._ack_file.close()
+            self._ack_file = None
+
+    def remove(self):
+        self.close()
+        for path in (self.path, self.ack_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class _Record(object):
+    __slots__ = ('segment', 'position', 'length')
+
+    def __init__(self, segment, position, length):
+        self.segment = segment
+        self.position = position
+        self.length = length
+
+
+class InsertSpool(object):
+    """An on-disk write-ahead log of insert requests, sent to the API in
+    the background.
+
+    Insert bodies are appended to segment files in a directory before
+    being sent, so none is lost if the process dies: opening a spool on
+    the same directory sends again every request not acknowledged by the
+    API, up to max_in_flight at a time. Delivery is at least once, a
+    request answered just before a crash may be sent twice.
+
+    When the API is unreachable or rate limits the client, requests stay
+    in the spool and are retried with a growing delay, while inserts keep
+    being appended. Only requests that fail validation or that the API
+    rejects for good, with error 1507 or a 20xx error such as too many
+    entities, are dropped from the spool and passed to on_reject. Any other
+    failure keeps the request in the spool.
+
+    Example usage:
+
+        with sd.insert_spool('/var/spool/slicingdice') as spool:
+            spool.insert(entities, auto_create=['column'])
+            spool.flush()
+    """
+
+    def __init__(self, client, directory,
+                 segment_bytes=64 * 1024 * 1024, fsync=FSYNC_INTERVAL,
+                 fsync_interval=1.0, max_in_flight=None,
+                 reject_on=REJECT_ON, reject_codes=REJECT_CODES,
+                 backoff_base=0.5, backoff_cap=30.0, on_reject=None):
+        """
+        Parameters:
+            client(SlicingDice) -- The client sending the requests
+            directory(string) -- Directory of the segment files, created if
+                needed. Only one spool may use it at a time, opening a
+                second one raises InsertSpoolLockedException
+            segment_bytes(int) -- Size of each segment file
+            fsync(string) -- When appended requests and acknowledgements
+                are forced to disk: 'always', 'interval' (at most every
+                fsync_interval seconds) or 'never' (left to the OS)
+            fsync_interval(float) -- Seconds between syncs of 'interval'
+            max_in_flight(int) -- Requests sent concurrently, defaults to
+                the client max_workers
+            reject_on(tuple) -- Exception classes of the client side
+                validation errors that drop a request from the spool
+            reject_codes -- API error codes that drop a request from the
+                spool. Requests failing with any other error stay in it and
+                are retried
+            backoff_base(float) -- Seconds before the first retry
+            backoff_cap(float) -- Maximum seconds between retries
+            on_reject -- Called with the body and the exception of every
+                request dropped because the API rejected it. Without it,
+                the errors are raised by the next flush()
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise exceptions.SlicingDiceException(
+                "fsync must be one of: {0}.".format(
+                    ", ".join(FSYNC_POLICIES)))
+        if segment_bytes < validators.MAX_INSERTION_BATCH_BYTES + \
+                _HEADER.size:
+            raise exceptions.SlicingDiceException(
+                "segment_bytes must hold a request of {0} bytes.".format(
+                    validators.MAX_INSERTION_BATCH_BYTES))
+        self._client = client
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_in_flight = max(1, max_in_flight or client.max_workers)
+        self.reject_on = tuple(reject_on)
+        self.reject_codes = frozenset(reject_codes)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.on_reject = on_reject
+
+        self._condition = threading.Condition()
+        self._ready = collections.deque()
+        self._segments = {}
+        self._in_flight = 0
+        self._failures = 0
+        self._paused_until = 0
+        self._last_sync = timer()
+        self._errors = []
+        self._closed = False
+        self._stats = {'appended': 0, 'appended_bytes': 0, 'sent': 0,
+                       'sent_bytes': 0, 'replayed': 0, 'retries': 0,
+                       'rejected': 0}
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = _lock_directory(directory)
+        try:
+            self._active = self._recover()
+        except Exception:
+            self._lock.close()
+            raise
+
+        self._executor = ThreadPoolExecutor(self.max_in_flight)
+        self._thread = threading.Thread(target=self._run,
+                                        name='slicingdice-insert-spool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _recover(self):
+        """Queue the records not acknowledged by a previous run and start a
+        new segment after them"""
+        numbers = sorted(
+            int(name[:-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(_SEGMENT_SUFFIX) and
+            name[:-len(_SEGMENT_SUFFIX)].isdigit())
+        for number in numbers:
+            segment = _Segment(self.directory, number)
+            records = [record for record in segment.scan()
+                       if record[0] not in segment.acked]
+            if not records:
+                segment.remove()
+                continue
+            # Only acknowledged records count once the segment is recovered
+            segment.records = len(segment.acked) + len(records)
+            self._segments[number] = segment
+            for position, length in records:
+                self._ready.append(_Record(segment, position, length))
+            self._stats['replayed'] += len(records)
+        return _Segment(self.directory, (numbers[-1] + 1) if numbers else 0,
+                        self.segment_bytes)
+
+    def append(self, body):
+        """Write an insert request body to the spool, returning once it is
+        written, and forced to disk with fsync='always'
+
+        Keyword arguments:
+        body -- A JSON insert body, as a string or bytes
+        """
+        if isinstance(body, six.text_type):
+            body = body.encode('utf-8')
+        with self._condition:
+            if self._closed:
+                raise exceptions.InsertBufferClosedException(
+                    "The insert spool is closed.")
+            if not self._active.fits(len(body)):
+                self._roll()
+            segment = self._active
+            position = segment.append(body)
+            self._segments[segment.number] = segment
+            if self.fsync == FSYNC_ALWAYS:
+                segment.sync()
+            else:
+                self._maybe_sync()
+            self._ready.append(_Record(segment, position, len(body)))
+            self._stats['appended'] += 1
+            self._stats['appended_bytes'] += len(body)
+            self._condition.notify_all()
+
+    def insert(self, entities, auto_create=None,
+               max_batch_bytes=validators.MAX_INSERTION_BATCH_BYTES,
+               validation=None):
+        """Split entities into insert requests as bulk_insert does and
+        append them to the spool. Returns the number of requests.
+
+        Keyword arguments:
+        entities -- An iterable of (entity_id, columns) pairs or a dictionary
+            in the Slicing Dice data format
+        auto_create(list) -- Value of the 'auto-create' parameter sent with
+            every request (default None)
+        max_batch_bytes(int) -- Maximum request body size
+        validation(string) -- Validation level for this call, 'full',
+            'structural' or 'off' (default None, the client level)
+        """
+        client = self._client
+        count = 0
+        for body in client._iter_insert_bodies(
+                entities, auto_create, max_batch_bytes,
+                client._validation_level(validation)):
+            self.append(body)
+            count += 1
+        return count
+
+    def _roll(self):
+        """Seal the active segment and start the next one. Called with the
+        condition held."""
+        segment = self._active
+        segment.sync()
+        segment.sync_acks()
+        segment.writable = False
+        self._active = _Segment(self.directory, segment.number + 1,
+                                self.segment_bytes)
+        self._remove_if_done(segment)
+
+    def _maybe_sync(self):
+        """Sync the active segment and acknowledgements once
+        fsync_interval passed. Called with the condition held."""
+        if self.fsync != FSYNC_INTERVAL:
+            return
+        now = timer()
+        if now - self._last_sync < self.fsync_interval:
+            return
+        self._last_sync = now
+        self._active.sync()
+        for segment in six.itervalues(self._segments):
+            segment.sync_acks()
+
+    def _remove_if_done(self, segment):
+        if segment.done:
+            self._segments.pop(segment.number, None)
+            segment.remove()
+
+    def flush(self, timeout=None):
+        """Wait until every request in the spool was acknowledged by the
+        API. Returns False if timeout expired first.
+
+        Without on_reject, raises the error of the request rejected since
+        the last flush, or an InsertBatchesFailedException listing them all
+        in errors when several were.
+
+        Keyword arguments:
+        timeout(float) -- Maximum seconds to wait, defaults to None, no
+            limit
+        """
+        deadline = None if timeout is None else timer() + timeout
+        with self._condition:
+            while self._ready or self._in_flight:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - timer()
+                    if remaining <= 0:
+                        return False
+                self._condition.wait(remaining)
+            errors = self._errors
+            self._errors = []
+        if len(errors) == 1:
+            raise errors[0]
+        if errors:
+            raise exceptions.InsertBatchesFailedException(
+                "{0} insert requests were rejected, the first with: {1}"
+                .format(len(errors), errors[0]), errors=errors)
+        return True
+
+    def close(self, timeout=0):
+        """Stop sending and close the segment files. Requests not
+        acknowledged yet stay in the spool, to be sent when it is opened
+        again.
+
+        Keyword arguments:
+        timeout(float) -- Seconds to wait for the requests to be sent
+            first, defaults to 0. None waits until all of them are
+        """
+        try:
+            if timeout is None or timeout > 0:
+                self.flush(timeout)
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            self._thread.join()
+            self._executor.shutdown(wait=True)
+            with self._condition:
+                segments = list(six.itervalues(self._segments))
+                if self._active.number not in self._segments:
+                    segments.append(self._active)
+                for segment in segments:
+                    segment.sync()
+                    segment.sync_acks()
+                    segment.close()
+                if not self._active.records:
+                    self._active.remove()
+            self._lock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def stats(self):
+        """Returns the requests and bytes appended and sent, the requests
+        replayed from a previous run, retried and rejected, and the
+        requests and segments in the spool"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._ready) + self._in_flight
+            stats['segments'] = len(self._segments)
+            stats['paused'] = max(0.0, self._paused_until - timer())
+            return stats
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+                    wait = self._paused_until - timer()
+                    if wait > 0:
+                        self._condition.wait(wait)
+                    elif (not self._ready or
+                          self._in_flight >= self.max_in_flight):
+                        self._condition.wait(self.fsync_interval)
+                        self._maybe_sync()
+                    else:
+                        break
+                record = self._ready.popleft()
+                body = record.segment.read(record.position, record.length)
+                self._in_flight += 1
+            self._executor.submit(self._send, record, body)
+
+    def _is_rejected(self, error):
+        """Returns true if error proves the request can never be accepted
+        as it is, false if it may be accepted when sent again"""
+        if isinstance(error, self.reject_on):
+            return True
+        if not isinstance(error, exceptions.SlicingDiceException):
+            return False
+        try:
+            return int(error.code) in self.reject_codes
+        except (TypeError, ValueError):
+            return False
+
+    def _send(self, record, body):
+        error = None
+        try:
+            self._client._send_insert_body(body)
+        except Exception as e:
+            error = e
+        rejected = error is not None and self._is_rejected(error)
+        if rejected and self.on_reject is not None:
+            try:
+                self.on_reject(body, error)
+            except Exception:
+                pass
+        with self._condition:
+            self._in_flight -= 1
+            if error is not None and not rejected:
+                # Keep it first in line and wait before sending again
+                self._ready.appendleft(record)
+                self._failures += 1
+                self._stats['retries'] += 1
+                window = min(self.backoff_cap, self.backoff_base * (
+                    2 ** min(self._failures - 1, 30)))
+                delay = getattr(error, 'retry_after', None)
+                if delay is None:
+                    delay = random.uniform(window / 2, window)
+                # Retry-After waits at most backoff_cap, as in RetryPolicy
+                delay = min(delay, self.backoff_cap)
+                self._paused_until = max(self._paused_until, timer() + delay)
+            else:
+                self._failures = 0
+                segment = record.segment
+                segment.ack(record.position, self.fsync == FSYNC_ALWAYS)
+                if rejected:
+                    self._stats['rejected'] += 1
+                    if self.on_reject is None:
+                        self._errors.append(error)
+                else:
+                    self._stats['sent'] += 1
+                    self._stats['sent_bytes'] += record.length
+                self._remove_if_done(segment)
+            self._condition.notify_all()
@@ -0,0 +1,1212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import threading
+import time
+
+import six
+
+from ..utils.validators import (
+    COLUMN_TYPES, MAX_AGGREGATION_COLUMNS, MAX_EXISTS_ENTITY_IDS,
+    MAX_INSERTION_BATCH_SIZE, MAX_QUERY_SIZE, MAX_TOP_VALUES_QUERY_SIZE,
+    QUERY_OPTIONS)
+from .timeutils import (INTERVAL_SECONDS, format_date, format_datetime,
+                        parse_time, resolve_between)
+
+# Error codes of the emulator. The codes the client maps to specific
+# exceptions (1502, 1507, 2012 and 2013) are the ones of the API, the
+# others only exist in the emulator.
+ERROR_INVALID_KEY = 1001
+ERROR_INVALID_BODY = 1003
+ERROR_NOT_FOUND = 1004
+ERROR_RATE_LIMIT = 1502
+ERROR_BODY_SIZE = 1507
+ERROR_ENTITIES_LIMIT = 2012
+ERROR_COLUMNS_LIMIT = 2013
+ERROR_INVALID_QUERY = 3001
+ERROR_UNKNOWN_COLUMN = 3002
+ERROR_UNKNOWN_DIMENSION = 3003
+ERROR_SAVED_QUERY = 3004
+ERROR_INVALID_COLUMN = 3005
+ERROR_UNSUPPORTED_SQL = 3006
+
+DEFAULT_DIMENSION = 'default'
+
+# Entities per data extraction page when the query has no 'limit'
+DEFAULT_PAGE_LIMIT = 100
+
+_METRICS = ('min', 'max', 'avg', 'sum', 'count-events')
+
+# Keys of a top values or aggregation level that are options, not columns
+_LEVEL_OPTIONS = ('contains', 'not-contains', 'equals', 'not-equals',
+                  'starts-with', 'ends-with', 'between', 'interval',
+                  'dimension') + QUERY_OPTIONS
+
+_DATE_ONLY = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+class EmulatedAPIError(Exception):
+    """An error answered by the emulator in the format of the API"""
+
+    def __init__(self, code, message, status=400):
+        super(EmulatedAPIError, self).__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+    def body(self):
+        """Returns the error as the API response body"""
+        return {'errors': [{'code': self.code, 'message': self.message}]}
+
+
+def _invalid(message):
+    return EmulatedAPIError(ERROR_INVALID_QUERY, message)
+
+
+def _base_type(column_type):
+    """Returns the type of the values of a column, 'integer' for an
+    'integer-event' column"""
+    if column_type.endswith('-event'):
+        return column_type[:-len('-event')]
+    return column_type
+
+
+def _infer_type(value):
+    """Returns the type of an auto-created column from its first value"""
+    if isinstance(value, list):
+        if not value:
+            return 'string'
+        value = value[0]
+    if isinstance(value, dict):
+        base = _infer_type(value.get('value'))
+        if base not in ('integer', 'decimal'):
+            base = 'string'
+        return base + '-event'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, six.integer_types):
+        return 'integer'
+    if isinstance(value, float):
+        return 'decimal'
+    if isinstance(value, six.string_types) and parse_time(value) is not None:
+        return 'date' if _DATE_ONLY.match(value) else 'datetime'
+    return 'string'
+
+
+def coerce_value(column_type, value):
+    """Returns a value converted to the type of a column, as it is stored
+    and compared. Raises ValueError if it can't be converted.
+
+    Dates and datetimes are kept as normalized UTC strings, which sort in
+    time order. Strings are lowercased, as the API matches and returns them.
+
+    Keyword arguments:
+    column_type(string) -- The type of the column, or of its events
+    value -- The value of an insertion or a query
+    """
+    base = _base_type(column_type)
+    if base == 'integer':
+        if isinstance(value, bool):
+            raise ValueError(value)
+        if isinstance(value, six.string_types):
+            return int(float(value)) if '.' in value else int(value)
+        return int(value)
+    if base == 'decimal':
+        if isinstance(value, bool):
+            raise ValueError(value)
+        return float(value)
+    if base == 'boolean':
+        if isinstance(value, bool):
+            return value
+        text = six.text_type(value).lower()
+        if text not in ('true', 'false'):
+            raise ValueError(value)
+        return text == 'true'
+    if base in ('date', 'datetime'):
+        timestamp = parse_time(value)
+        if timestamp is None:
+            raise ValueError(value)
+        if base == 'date':
+            return format_date(timestamp)
+        return format_datetime(timestamp)
+    if not isinstance(value, six.string_types):
+        raise ValueError(value)
+    return value.lower() if base == 'string' else value
+
+
+def format_value(value):
+    """Returns a value as the string used by top values and aggregations"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, six.string_types):
+        return value
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_text(value):
+    """Returns a value as the string returned by data extraction queries,
+    which answer every value as lowercase text"""
+    if isinstance(value, list):
+        return [format_text(item) for item in value]
+    if isinstance(value, dict):
+        # An event, already formatted by _Event.to_json
+        return value
+    return format_value(value).lower()
+
+
+class _Event(object):
+    __slots__ = ('value', 'timestamp')
+
+    def __init__(self, value, timestamp):
+        self.value = value
+        self.timestamp = timestamp
+
+    def to_json(self):
+        return {'value': format_text(self.value),
+                'date': format_datetime(self.timestamp)}
+
+
+class _Dimension(object):
+    """The entities of a dimension, keyed by entity id, each one a
+    dictionary of column values. Event columns hold a list of _Event."""
+
+    def __init__(self, name):
+        self.name = name
+        self.entities = {}
+        self._sorted_ids = None
+
+    def changed(self):
+        self._sorted_ids = None
+
+    def sorted_ids(self):
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.entities)
+        return self._sorted_ids
+
+
+def _string_test(operator, operands):
+    """Returns a test of string values against a list of operands"""
+    operands = [six.text_type(operand).lower() for operand in operands]
+    if operator == 'contains':
+        return lambda value: any(operand in value for operand in operands)
+    if operator == 'not-contains':
+        return lambda value: not any(
+            operand in value for operand in operands)
+    if operator == 'starts-with':
+        return lambda value: any(
+            value.startswith(operand) for operand in operands)
+    return lambda value: any(value.endswith(operand) for operand in operands)
+
+
+class EmulatedDatabase(object):
+    """An in-memory SlicingDice database: columns, dimensions, saved
+    queries, and the query engine answering every endpoint.
+
+    Every method takes and returns the JSON bodies of the API as decoded
+    dictionaries, and raises EmulatedAPIError for the requests the API would
+    reject. Thread-safe.
+
+    Example usage:
+
+        database = EmulatedDatabase()
+        database.insert({'user1': {'age': 22}, 'auto-create': ['column']})
+        database.count_entity([{'query-name': 'adults',
+                                'query': [{'age': {'gte': 18}}]}])
+    """
+
+    def __init__(self, name='Emulated database', now=None, dimensions=()):
+        """
+        Parameters:
+            name(string) -- Name returned by the database endpoint
+            now -- Function returning the current timestamp, used by
+                relative dates such as 'now' or '-1d' (default time.time)
+            dimensions -- Names of the dimensions created with the database,
+                besides 'default', as they are on an existing account
+        """
+        self.name = name
+        self._now = now or time.time
+        self._columns = {}
+        self._dimensions = dict(
+            (dimension, _Dimension(dimension))
+            for dimension in (DEFAULT_DIMENSION,) + tuple(dimensions))
+        self._saved_queries = {}
+        self._lock = threading.RLock()
+        self.created_at = format_datetime(self._now())
+        self.updated_at = self.created_at
+
+    # Columns and dimensions
+
+    def get_database(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'description': 'In-memory SlicingDice emulator',
+                'dimensions': sorted(self._dimensions),
+                'created-at': self.created_at,
+                'updated-at': self.updated_at,
+            }
+
+    def get_columns(self):
+        with self._lock:
+            return {'active': [dict(column) for column in
+                               six.itervalues(self._columns)],
+                    'inactive': []}
+
+    def create_column(self, data):
+        """Create a column, or a list of columns"""
+        columns = data if isinstance(data, list) else [data]
+        if not columns or not all(isinstance(c, dict) for c in columns):
+            raise EmulatedAPIError(
+                ERROR_INVALID_COLUMN, "Columns must be dictionaries.")
+        with self._lock:
+            created = []
+            for column in columns:
+                column = dict(column)
+                name = column.get('api-name')
+                if not name:
+                    name = re.sub(r'[^a-z0-9]+', '-',
+                                  six.text_type(column.get('name', '')).lower()
+                                  ).strip('-')
+                    column['api-name'] = name
+                if not name:
+                    raise EmulatedAPIError(
+                        ERROR_INVALID_COLUMN, "The column needs a name.")
+                if name in self._columns or name in created:
+                    raise EmulatedAPIError(
+                        ERROR_INVALID_COLUMN,
+                        "The column '{0}' already exists.".format(name))
+                if column.get('type') not in COLUMN_TYPES:
+                    raise EmulatedAPIError(
+                        ERROR_INVALID_COLUMN,
+                        "The column '{0}' has an invalid type.".format(name))
+                column.setdefault('name', name)
+                column.setdefault('storage', 'latest-value')
+                created.append(name)
+                self._columns[name] = column
+            self.updated_at = format_datetime(self._now())
+        if len(created) == 1:
+            return {'status': 'success', 'api-name': created[0]}
+        return {'status': 'success', 'api-names': created}
+
+    def _column_type(self, name):
+        column = self._columns.get(name)
+        if column is None:
+            raise EmulatedAPIError(
+                ERROR_UNKNOWN_COLUMN,
+                "The column '{0}' does not exist.".format(name))
+        return column['type']
+
+    def _dimension(self, name, create=False):
+        if name is None:
+            name = DEFAULT_DIMENSION
+        dimension = self._dimensions.get(name)
+        if dimension is None:
+            if not create:
+                raise EmulatedAPIError(
+                    ERROR_UNKNOWN_DIMENSION,
+                    "The dimension '{0}' does not exist.".format(name))
+            dimension = self._dimensions[name] = _Dimension(name)
+        return dimension
+
+    # Insertion, update and deletion
+
+    def insert(self, data):
+        """Insert entities, in the format of the insert endpoint"""
+        if not isinstance(data, dict):
+            raise EmulatedAPIError(
+                ERROR_INVALID_BODY, "The insertion must be a dictionary.")
+        auto_create = data.get('auto-create') or ()
+        entities = [(entity_id, columns)
+                    for entity_id, columns in six.iteritems(data)
+                    if entity_id != 'auto-create']
+        if len(entities) > MAX_INSERTION_BATCH_SIZE:
+            raise EmulatedAPIError(
+                ERROR_ENTITIES_LIMIT,
+                "An insertion has a limit of {0} entities.".format(
+                    MAX_INSERTION_BATCH_SIZE))
+        create_columns = 'column' in auto_create
+        create_dimensions = ('dimension' in auto_create or
+                             'table' in auto_create)
+        inserted_columns = 0
+        with self._lock:
+            # Check everything first, so a rejected insertion changes nothing
+            types = dict((name, column['type']) for name, column in
+                         six.iteritems(self._columns))
+            new_columns = {}
+            rows = []
+            for entity_id, columns in entities:
+                if not isinstance(columns, dict) or not columns:
+                    raise _invalid("The value for an id should be a "
+                                   "dictionary.")
+                columns = dict(columns)
+                dimension = columns.pop('dimension', None)
+                dimension = columns.pop('table', dimension)
+                if (dimension is not None and
+                        dimension not in self._dimensions and
+                        not create_dimensions):
+                    raise EmulatedAPIError(
+                        ERROR_UNKNOWN_DIMENSION,
+                        "The dimension '{0}' does not exist.".format(
+                            dimension))
+                for name, value in six.iteritems(columns):
+                    if name not in types:
+                        if not create_columns:
+                            self._column_type(name)
+                        types[name] = _infer_type(value)
+                        new_columns[name] = {
+                            'name': name, 'api-name': name,
+                            'type': types[name], 'storage': 'latest-value'}
+                    inserted_columns += 1
+                # Entity ids are matched and returned in lowercase, as
+                # string values are
+                rows.append((six.text_type(entity_id).lower(), dimension,
+                             self._coerce_columns(columns, types,
+                                                  self._now())))
+            self._columns.update(new_columns)
+            for entity_id, dimension, columns in rows:
+                self._store(self._dimension(dimension, create=True),
+                            entity_id, columns)
+            self.updated_at = format_datetime(self._now())
+        return {'status': 'success', 'inserted-entities': len(entities),
+                'inserted-columns': inserted_columns}
+
+    def _coerce_columns(self, columns, types=None, now=None):
+        """Returns the column values of an entity converted to the types of
+        their columns
+
+        Keyword arguments:
+        columns(dict) -- The values of the entity
+        types(dict) -- The type of each column, defaults to the type of the
+            existing columns
+        now(float) -- Timestamp of the events without a date, defaults to
+            the current time
+        """
+        coerced = {}
+        for name, value in six.iteritems(columns):
+            if types is None:
+                column_type = self._column_type(name)
+            else:
+                column_type = types[name]
+            try:
+                if column_type.endswith('-event'):
+                    coerced[name] = self._coerce_events(
+                        column_type, value,
+                        self._now() if now is None else now)
+                elif isinstance(value, list):
+                    coerced[name] = [coerce_value(column_type, item)
+                                     for item in value]
+                else:
+                    coerced[name] = coerce_value(column_type, value)
+            except (TypeError, ValueError):
+                raise _invalid(
+                    "The value of column '{0}' is not a valid {1}.".format(
+                        name, column_type))
+        return coerced
+
+    @staticmethod
+    def _coerce_events(column_type, value, now):
+        """Returns the _Event of the events of a column. Events without a
+        date happen at now, the time of the insertion."""
+        events = value if isinstance(value, list) else [value]
+        coerced = []
+        for event in events:
+            if not isinstance(event, dict) or 'value' not in event:
+                raise ValueError(event)
+            timestamp = now
+            if event.get('date') is not None:
+                timestamp = parse_time(event['date'])
+                if timestamp is None:
+                    raise ValueError(event)
+            coerced.append(_Event(coerce_value(column_type, event['value']),
+                                  timestamp))
+        return coerced
+
+    @staticmethod
+    def _store(dimension, entity_id, columns):
+        row = dimension.entities.get(entity_id)
+        if row is None:
+            row = dimension.entities[entity_id] = {}
+            dimension.changed()
+        for name, value in six.iteritems(columns):
+            if isinstance(value, list) and value and isinstance(
+                    value[0], _Event):
+                row.setdefault(name, []).extend(value)
+            else:
+                row[name] = value
+
+    def update(self, data):
+        """Set columns of the entities matching a query"""
+        if not isinstance(data, dict) or not isinstance(
+                data.get('set'), dict) or not data['set']:
+            raise _invalid("An update needs a 'query' and a 'set'.")
+        with self._lock:
+            columns = self._coerce_columns(data['set'])
+            dimension = self._dimension(data.get('dimension'))
+            matches = self._matching(dimension, data.get('query'))
+            for entity_id, _ in matches:
+                self._store(dimension, entity_id, columns)
+            self.updated_at = format_datetime(self._now())
+        return {'status': 'success', 'result': {'updated': len(matches)}}
+
+    def delete(self, data):
+        """Delete the entities matching a query"""
+        if not isinstance(data, dict):
+            raise _invalid("A delete needs a 'query'.")
+        with self._lock:
+            dimension = self._dimension(data.get('dimension'))
+            matches = self._matching(dimension, data.get('query'))
+            for entity_id, _ in matches:
+                del dimension.entities[entity_id]
+            if matches:
+                dimension.changed()
+            self.updated_at = format_datetime(self._now())
+        return {'status': 'success', 'result': {'deleted': len(matches)}}
+
+    # Query compilation
+
+    def _compile(self, expression, event_counters=None):
+        """Compile a boolean query into a function of (entity_id, row)
+        returning its score, 0 when the entity doesn't match.
+
+        Items are conditions, nested lists, 'and', 'or' and 'not'. 'and'
+        binds tighter than 'or'. As in the API, a condition or a group of
+        conditions joined by 'and' scores 1, and 'or' adds up the scores of
+        its terms.
+
+        Keyword arguments:
+        expression -- A query, as the 'query' of a count or 'filter' of an
+            aggregation
+        event_counters(list) -- Receives a function of the row counting the
+            matched events of each event condition
+        """
+        if isinstance(expression, dict):
+            return self._compile_conditions(expression, event_counters)
+        if not isinstance(expression, list) or not expression:
+            raise _invalid("Queries must be non empty lists.")
+        terms = [[]]
+        negate = False
+        for item in expression:
+            if isinstance(item, six.string_types):
+                operator = item.lower()
+                if operator == 'not':
+                    negate = not negate
+                elif operator == 'or':
+                    terms.append([])
+                elif operator != 'and':
+                    raise _invalid(
+                        "Unknown operator '{0}'.".format(item))
+                continue
+            node = self._compile(item, event_counters)
+            if negate:
+                node = _negation(node)
+                negate = False
+            terms[-1].append(node)
+        if negate or not all(terms):
+            raise _invalid("Operators must be placed between conditions.")
+        nodes = [_conjunction(term) for term in terms]
+        return nodes[0] if len(nodes) == 1 else _disjunction(nodes)
+
+    def _compile_conditions(self, conditions, event_counters):
+        if 'freqgroup' in conditions:
+            return self._compile_freqgroup(conditions, event_counters)
+        nodes = []
+        for name, operators in six.iteritems(conditions):
+            if name in QUERY_OPTIONS:
+                continue
+            if not isinstance(operators, dict) or not operators:
+                raise _invalid(
+                    "The condition on '{0}' must be a dictionary.".format(
+                        name))
+            if name == 'entity-id':
+                test = self._value_test('string', operators)
+                nodes.append(
+                    lambda entity_id, row, test=test: int(test(entity_id)))
+                continue
+            column_type = self._column_type(name)
+            if column_type.endswith('-event'):
+                count = self._event_counter(name, column_type, operators)
+                minfreq = operators.get('minfreq', 1)
+                if event_counters is not None:
+                    event_counters.append(count)
+                nodes.append(
+                    lambda entity_id, row, count=count, minfreq=minfreq:
+                    int(count(row) >= minfreq))
+            else:
+                nodes.append(self._column_test(name, column_type, operators))
+        if not nodes:
+            raise _invalid("Conditions can't be empty.")
+        return nodes[0] if len(nodes) == 1 else _conjunction(nodes)
+
+    def _compile_freqgroup(self, conditions, event_counters):
+        group = conditions['freqgroup']
+        if not isinstance(group, list) or not group:
+            raise _invalid("'freqgroup' must be a non empty list.")
+        counters = []
+        for condition in group:
+            if not isinstance(condition, dict) or len(condition) != 1:
+                raise _invalid("Each 'freqgroup' condition must have one "
+                               "event column.")
+            name, operators = next(six.iteritems(condition))
+            column_type = self._column_type(name)
+            if not column_type.endswith('-event'):
+                raise _invalid(
+                    "'freqgroup' only accepts event columns.")
+            counters.append(
+                self._event_counter(name, column_type, operators))
+        if event_counters is not None:
+            event_counters.extend(counters)
+        minfreq = conditions.get('minfreq', 1)
+
+        def match(entity_id, row):
+            return int(sum(count(row) for count in counters) >= minfreq)
+        return match
+
+    def _event_counter(self, name, column_type, operators):
+        """Returns a function counting the events of a row matching the
+        operators of an event column"""
+        value_operators = dict(
+            (key, value) for key, value in six.iteritems(operators)
+            if key not in ('between', 'minfreq'))
+        test = None
+        if value_operators:
+            test = self._value_test(column_type, value_operators)
+        between = None
+        if 'between' in operators:
+            between = self._between(operators['between'])
+
+        def count(row):
+            events = row.get(name)
+            if not events:
+                return 0
+            matched = 0
+            for event in events:
+                if between is not None and not (
+                        between[0] <= event.timestamp <= between[1]):
+                    continue
+                if test is not None and not test(event.value):
+                    continue
+                matched += 1
+            return matched
+        return count
+
+    def _column_test(self, name, column_type, operators):
+        test = self._value_test(column_type, operators)
+
+        def match(entity_id, row):
+            value = row.get(name)
+            if value is None:
+                return 0
+            if isinstance(value, list):
+                return int(any(test(item) for item in value))
+            return int(test(value))
+        return match
+
+    def _value_test(self, column_type, operators):
+        """Returns a function testing a stored value against every operator
+        of a condition"""
+        tests = []
+        for operator, operand in six.iteritems(operators):
+            tests.append(self._operator_test(column_type, operator, operand))
+        if len(tests) == 1:
+            return tests[0]
+        return lambda value: all(test(value) for test in tests)
+
+    def _operator_test(self, column_type, operator, operand):
+        def coerce(value):
+            try:
+                return coerce_value(column_type, value)
+            except (TypeError, ValueError):
+                raise _invalid(
+                    "The value '{0}' of '{1}' is not a valid {2}.".format(
+                        value, operator, column_type))
+
+        if operator == 'equals':
+            operand = coerce(operand)
+            return lambda value: value == operand
+        if operator == 'not-equals':
+            operand = coerce(operand)
+            return lambda value: value != operand
+        if operator in ('in', 'not-in'):
+            if not isinstance(operand, list):
+                raise _invalid("'{0}' must be a list.".format(operator))
+            operands = frozenset(coerce(item) for item in operand)
+            if operator == 'in':
+                return lambda value: value in operands
+            return lambda value: value not in operands
+        if operator in ('gt', 'gte', 'greater-than', 'greater-than-or-equal',
+                        'lt', 'lte', 'less-than', 'less-than-or-equal'):
+            operand = coerce(operand)
+            if operator in ('gt', 'greater-than'):
+                return lambda value: value > operand
+            if operator in ('gte', 'greater-than-or-equal'):
+                return lambda value: value >= operand
+            if operator in ('lt', 'less-than'):
+                return lambda value: value < operand
+            return lambda value: value <= operand
+        if operator in ('range', 'between') and _base_type(
+                column_type) not in ('date', 'datetime'):
+            if not isinstance(operand, list) or len(operand) != 2:
+                raise _invalid("'{0}' needs two values.".format(operator))
+            low, high = coerce(operand[0]), coerce(operand[1])
+            return lambda value: low <= value <= high
+        if operator in ('range', 'between'):
+            start, end = self._between(operand)
+            return lambda value: start <= parse_time(value) <= end
+        if operator in ('contains', 'not-contains', 'starts-with',
+                        'ends-with'):
+            operands = operand if isinstance(operand, list) else [operand]
+            return _string_test(operator, [six.text_type(item)
+                                           for item in operands])
+        raise _invalid("Unknown operator '{0}'.".format(operator))
+
+    def resolve_between(self, between):
+        """Returns the (start, end) timestamps of a 'between' value, such
+        as ['2017-01-01', 'now'] or ['-1d', 'now']"""
+        return self._between(between)
+
+    def _between(self, between):
+        try:
+            return resolve_between(between, self._now())
+        except ValueError:
+            raise _invalid("Invalid 'between' value {0!r}.".format(between))
+
+    def _matching(self, dimension, query):
+        """Returns the (entity_id, score) pairs of the entities of a
+        dimension matching a query, all of them if query is None"""
+        if query is None:
+            return [(entity_id, 1) for entity_id in dimension.sorted_ids()]
+        match = self._compile(query)
+        entities = dimension.entities
+        matches = []
+        for entity_id in dimension.sorted_ids():
+            score = match(entity_id, entities[entity_id])
+            if score:
+                matches.append((entity_id, score))
+        return matches
+
+    # Count queries
+
+    @staticmethod
+    def _named_queries(data):
+        queries = data if isinstance(data, list) else [data]
+        queries = [query for query in queries
+                   if isinstance(query, dict) and 'query' in query]
+        if not queries:
+            raise _invalid("A count needs at least one query.")
+        if len(queries) > MAX_QUERY_SIZE:
+            raise _invalid("A count has a limit of {0} queries.".format(
+                MAX_QUERY_SIZE))
+        return queries
+
+    def count_entity(self, data):
+        """Count the entities matching each named query"""
+        result = {}
+        with self._lock:
+            for index, query in enumerate(self._named_queries(data)):
+                name = query.get('query-name', 'query-{0}'.format(index))
+                dimension = self._dimension(query.get('dimension'))
+                result[name] = len(self._matching(dimension, query['query']))
+        return {'status': 'success', 'result': result}
+
+    def count_event(self, data):
+        """Count the events matching each named query"""
+        result = {}
+        with self._lock:
+            for index, query in enumerate(self._named_queries(data)):
+                name = query.get('query-name', 'query-{0}'.format(index))
+                dimension = self._dimension(query.get('dimension'))
+                counters = []
+                match = self._compile(query['query'], counters)
+                total = 0
+                for entity_id, row in six.iteritems(dimension.entities):
+                    if match(entity_id, row):
+                        total += sum(count(row) for count in counters)
+                result[name] = total
+        return {'status': 'success', 'result': result}
+
+    def count_entity_total(self, data=None):
+        """Count the entities of some or all dimensions"""
+        names = (data or {}).get('dimensions')
+        with self._lock:
+            if names is None:
+                names = list(self._dimensions)
+            total = sum(len(self._dimension(name).entities)
+                        for name in names)
+        return {'status': 'success', 'result': {'total': total}}
+
+    def exists_entity(self, data):
+        """Split ids into the ones that exist in a dimension and the ones
+        that don't"""
+        ids = data.get('ids') if isinstance(data, dict) else None
+        if not isinstance(ids, list):
+            raise _invalid("'ids' must be a list.")
+        if len(ids) > MAX_EXISTS_ENTITY_IDS:
+            raise _invalid("An exists query has a limit of {0} ids.".format(
+                MAX_EXISTS_ENTITY_IDS))
+        with self._lock:
+            entities = self._dimension(data.get('dimension')).entities
+            exists = [entity_id for entity_id in ids
+                      if six.text_type(entity_id).lower() in entities]
+        not_exists = [entity_id for entity_id in ids
+                      if entity_id not in exists]
+        return {'status': 'success', 'exists': exists,
+                'not-exists': not_exists}
+
+    # Top values and aggregations
+
+    def _level_values(self, row, name, column_type, options):
+        """Returns the values of a column of a row kept by the options of a
+        top values query or an aggregation level"""
+        value = row.get(name)
+        if value is None:
+            return []
+        if column_type.endswith('-event'):
+            between = options.get('_between')
+            values = [event.value for event in value
+                      if between is None or
+                      between[0] <= event.timestamp <= between[1]]
+        elif isinstance(value, list):
+            values = value
+        else:
+            values = [value]
+        test = options.get('_test')
+        if test is not None:
+            values = [item for item in values if test(format_value(item))]
+        return values
+
+    def _level_options(self, level):
+        """Compile the options of a top values query or aggregation level"""
+        options = {}
+        tests = []
+        for operator in ('contains', 'not-contains', 'starts-with',
+                         'ends-with'):
+            if operator in level:
+                operands = level[operator]
+                if not isinstance(operands, list):
+                    operands = [operands]
+                tests.append(_string_test(
+                    operator, [six.text_type(item) for item in operands]))
+        for operator in ('equals', 'not-equals'):
+            if operator in level:
+                operands = level[operator]
+                if not isinstance(operands, list):
+                    operands = [operands]
+                operands = frozenset(format_value(item).lower()
+                                     for item in operands)
+                if operator == 'equals':
+                    tests.append(lambda value, o=operands: value in o)
+                else:
+                    tests.append(lambda value, o=operands: value not in o)
+        if tests:
+            options['_test'] = lambda value: all(
+                test(value.lower()) for test in tests)
+        between = level.get('between')
+        if between is not None:
+            if isinstance(between, list) and between and isinstance(
+                    between[0], list):
+                options['_ranges'] = [self._between(item)
+                                      for item in between]
+                options['_between'] = (
+                    min(start for start, _ in options['_ranges']),
+                    max(end for _, end in options['_ranges']))
+            else:
+                options['_between'] = self._between(between)
+        return options
+
+    @staticmethod
+    def _level_columns(level):
+        return [(name, spec) for name, spec in six.iteritems(level)
+                if name not in _LEVEL_OPTIONS]
+
+    def _top_values(self, rows, name, column_type, limit, options):
+        """Returns the most frequent values of a column among rows, as
+        (value, quantity, rows having it) tuples. Quantities count
+        entities."""
+        holders = {}
+        for row in rows:
+            for value in set(self._level_values(
+                    row, name, column_type, options)):
+                holders.setdefault(value, []).append(row)
+        ranked = sorted(six.iteritems(holders),
+                        key=lambda item: (-len(item[1]),
+                                          format_value(item[0])))
+        return [(value, len(holding), holding)
+                for value, holding in ranked[:limit]]
+
+    def top_values(self, data):
+        """Answer a top values request"""
+        if not isinstance(data, dict):
+            raise _invalid("Top values must be a dictionary of queries.")
+        queries = [(name, query) for name, query in six.iteritems(data)
+                   if name not in QUERY_OPTIONS]
+        if len(queries) > MAX_TOP_VALUES_QUERY_SIZE:
+            raise _invalid("Top values has a limit of {0} queries.".format(
+                MAX_TOP_VALUES_QUERY_SIZE))
+        result = {}
+        with self._lock:
+            for query_name, query in queries:
+                if not isinstance(query, dict):
+                    raise _invalid("Each top values query must be a "
+                                   "dictionary.")
+                rows = list(six.itervalues(self._dimension(
+                    query.get('dimension')).entities))
+                options = self._level_options(query)
+                columns = {}
+                for name, limit in self._level_columns(query):
+                    column_type = self._column_type(name)
+                    columns[name] = [
+                        {'value': format_value(value), 'quantity': quantity}
+                        for value, quantity, _ in self._top_values(
+                            rows, name, column_type, limit, options)]
+                result[query_name] = columns
+        return {'status': 'success', 'result': result}
+
+    def aggregation(self, data):
+        """Answer an aggregation request: nested top values, or a metric on
+        the last level"""
+        if not isinstance(data, dict) or not isinstance(
+                data.get('query'), list) or not data['query']:
+            raise _invalid("An aggregation needs a 'query' list.")
+        levels = data['query']
+        if len(levels) > MAX_AGGREGATION_COLUMNS:
+            raise _invalid("An aggregation has a limit of {0} "
+                           "columns.".format(MAX_AGGREGATION_COLUMNS))
+        if not all(isinstance(level, dict) for level in levels):
+            raise _invalid("Each aggregation level must be a dictionary.")
+        with self._lock:
+            dimension = self._dimension(data.get('dimension'))
+            if 'filter' in data:
+                entities = dimension.entities
+                rows = [entities[entity_id] for entity_id, _ in
+                        self._matching(dimension, data['filter'])]
+            else:
+                rows = list(six.itervalues(dimension.entities))
+            result = self._aggregate(rows, levels)
+        return {'status': 'success', 'result': result}
+
+    def _aggregate(self, rows, levels):
+        level = levels[0]
+        columns = self._level_columns(level)
+        if len(columns) != 1:
+            raise _invalid("Each aggregation level must have one column.")
+        name, spec = columns[0]
+        column_type = self._column_type(name)
+        options = self._level_options(level)
+        if spec in _METRICS:
+            if len(levels) > 1:
+                raise _invalid("A metric must be the last aggregation "
+                               "level.")
+            return {name: self._metric(rows, name, column_type, spec,
+                                       options, level.get('interval'))}
+        if not isinstance(spec, int) or isinstance(spec, bool) or spec < 1:
+            raise _invalid("The value of '{0}' must be a number of values "
+                           "or a metric.".format(name))
+        buckets = []
+        for value, quantity, holding in self._top_values(
+                rows, name, column_type, spec, options):
+            bucket = {'value': format_value(value), 'quantity': quantity}
+            if len(levels) > 1:
+                bucket.update(self._aggregate(holding, levels[1:]))
+            buckets.append(bucket)
+        return {name: buckets}
+
+    def _metric(self, rows, name, column_type, metric, options, interval):
+        if not column_type.endswith('-event'):
+            values = [value for row in rows for value in
+                      self._level_values(row, name, column_type, options)]
+            return {metric: _compute_metric(metric, values)}
+        ranges = options.get('_ranges')
+        if ranges is None and interval is not None:
+            if interval not in INTERVAL_SECONDS or '_between' not in options:
+                raise _invalid("'interval' needs a 'between' and one of: "
+                               "{0}.".format(", ".join(
+                                   sorted(INTERVAL_SECONDS))))
+            step = INTERVAL_SECONDS[interval]
+            start, end = options['_between']
+            ranges = []
+            while start < end:
+                ranges.append((start, min(start + step, end)))
+                start += step
+        if ranges is None:
+            values = [value for row in rows for value in
+                      self._level_values(row, name, column_type, options)]
+            return {metric: _compute_metric(metric, values)}
+        test = options.get('_test')
+        buckets = []
+        for start, end in ranges:
+            values = [event.value for row in rows
+                      for event in row.get(name) or ()
+                      if start <= event.timestamp < end and (
+                          test is None or test(format_value(event.value)))]
+            if values:
+                buckets.append({
+                    metric: _compute_metric(metric, values),
+                    'between': [format_datetime(start),
+                                format_datetime(end)]})
+        return buckets
+
+    # Data extraction
+
+    def result(self, data):
+        """Answer a data extraction result request, one page at a time"""
+        return self._data_extraction(data, False)
+
+    def score(self, data):
+        """Answer a data extraction score request, one page at a time"""
+        return self._data_extraction(data, True)
+
+    def _data_extraction(self, data, with_score):
+        if not isinstance(data, dict):
+            raise _invalid("A data extraction query must be a dictionary.")
+        limit = data.get('limit', DEFAULT_PAGE_LIMIT)
+        page = data.get('page', 1)
+        if (not isinstance(limit, int) or limit < 1 or
+                not isinstance(page, int) or page < 1):
+            raise _invalid("'limit' and 'page' must be positive integers.")
+        with self._lock:
+            dimension = self._dimension(data.get('dimension'))
+            matches = self._matching(dimension, data.get('query'))
+            entities = dimension.entities
+            order = data.get('order')
+            if order:
+                matches = self._ordered(matches, entities, order)
+            elif with_score:
+                # Sorting is stable, entities of equal score stay sorted
+                matches.sort(key=lambda match: -match[1])
+            start = (page - 1) * limit
+            page_matches = matches[start:start + limit]
+            selected = self._selected_columns(data.get('columns'))
+            page_data = []
+            for entity_id, score in page_matches:
+                row = dict(
+                    (name, format_text(value)) for name, value in
+                    six.iteritems(self._extract(entities[entity_id],
+                                                selected)))
+                row['entity-id'] = entity_id
+                if with_score:
+                    row['score'] = score
+                page_data.append(row)
+        return {'status': 'success', 'data': page_data, 'page': page,
+                'next-page': page + 1 if start + limit < len(matches)
+                else None}
+
+    def scan(self, dimension=None, query=None):
+        """Returns the (entity_id, score, columns) of the entities matching
+        a query, sorted by entity id. Columns are copies of the stored
+        values, event columns are lists of (value, timestamp) pairs.
+
+        Keyword arguments:
+        dimension(string) -- The dimension (default 'default')
+        query -- A boolean query, None for every entity
+        """
+        with self._lock:
+            selected_dimension = self._dimension(dimension)
+            entities = selected_dimension.entities
+            rows = []
+            for entity_id, score in self._matching(selected_dimension,
+                                                   query):
+                columns = {}
+                for name, value in six.iteritems(entities[entity_id]):
+                    if value and isinstance(value, list) and isinstance(
+                            value[0], _Event):
+                        value = [(event.value, event.timestamp)
+                                 for event in value]
+                    elif isinstance(value, list):
+                        value = list(value)
+                    columns[name] = value
+                rows.append((entity_id, score, columns))
+            return rows
+
+    def _ordered(self, matches, entities, order):
+        """Sort matches by a list of {column: 'asc' or 'desc'}"""
+        if not isinstance(order, list):
+            raise _invalid("'order' must be a list.")
+        # Sort by the last key first, stable sorts keep the previous order
+        for item in reversed(order):
+            if not isinstance(item, dict) or len(item) != 1:
+                raise _invalid("Each 'order' item has one column.")
+            name, direction = next(six.iteritems(item))
+            reverse = six.text_type(direction).lower() == 'desc'
+            if name == 'entity-id':
+                matches.sort(key=lambda match: match[0], reverse=reverse)
+                continue
+            self._column_type(name)
+            present = [match for match in matches
+                       if entities[match[0]].get(name) is not None]
+            missing = [match for match in matches
+                       if entities[match[0]].get(name) is None]
+            present.sort(key=lambda match: _sort_key(
+                entities[match[0]][name]), reverse=reverse)
+            matches = present + missing
+        return matches
+
+    def _selected_columns(self, columns):
+        """Returns the (name, between) pairs of the columns to extract, with
+        the range of events of event columns, or None for all columns"""
+        if columns is None or columns == 'all':
+            return None
+        if not isinstance(columns, list):
+            raise _invalid("'columns' must be a list or 'all'.")
+        selected = []
+        for column in columns:
+            if isinstance(column, dict):
+                for name, between in six.iteritems(column):
+                    self._column_type(name)
+                    selected.append((name, self._between(between)))
+            elif column != 'entity-id':
+                self._column_type(column)
+                selected.append((column, None))
+        return selected
+
+    @staticmethod
+    def _extract(row, selected):
+        if selected is None:
+            selected = [(name, None) for name in row]
+        extracted = {}
+        for name, between in selected:
+            value = row.get(name)
+            if value is None:
+                continue
+            if value and isinstance(value, list) and isinstance(
+                    value[0], _Event):
+                # The API answers the latest event in the range
+                events = [event for event in value
+                          if between is None or
+                          between[0] <= event.timestamp <= between[1]]
+                if not events:
+                    continue
+                value = max(events, key=lambda event: event.timestamp)
+                value = value.to_json()
+            extracted[name] = value
+        return extracted
+
+    # Saved queries
+
+    # Type of a saved query and the method answering it
+    _SAVED_QUERY_TYPES = {
+        'count/entity': 'count_entity',
+        'count/event': 'count_event',
+        'aggregation': 'aggregation',
+        'top_values': 'top_values',
+        'result': 'result',
+        'score': 'score',
+    }
+
+    def get_saved_queries(self):
+        with self._lock:
+            return {'status': 'success', 'saved-queries': [
+                dict(query) for query in six.itervalues(self._saved_queries)]}
+
+    def create_saved_query(self, data):
+        if not isinstance(data, dict) or not data.get('name'):
+            raise EmulatedAPIError(ERROR_SAVED_QUERY,
+                                   "A saved query needs a 'name'.")
+        with self._lock:
+            if data['name'] in self._saved_queries:
+                raise EmulatedAPIError(
+                    ERROR_SAVED_QUERY,
+                    "The saved query '{0}' already exists.".format(
+                        data['name']))
+            self._check_saved_query(data)
+            self._saved_queries[data['name']] = dict(data)
+        response = dict(data)
+        response['status'] = 'success'
+        return response
+
+    def update_saved_query(self, name, data):
+        if not isinstance(data, dict):
+            raise EmulatedAPIError(ERROR_SAVED_QUERY,
+                                   "A saved query must be a dictionary.")
+        with self._lock:
+            saved = dict(self._get_saved_query(name))
+            saved.update(data)
+            saved['name'] = name
+            self._check_saved_query(saved)
+            self._saved_queries[name] = saved
+        response = dict(saved)
+        response['status'] = 'success'
+        return response
+
+    def delete_saved_query(self, name):
+        with self._lock:
+            saved = self._get_saved_query(name)
+            del self._saved_queries[name]
+        return {'status': 'success', 'deleted-query': name,
+                'type': saved.get('type'), 'query': saved.get('query')}
+
+    def get_saved_query(self, name):
+        """Run a saved query and return its result"""
+        with self._lock:
+            saved = self._get_saved_query(name)
+            method = getattr(self, self._SAVED_QUERY_TYPES[saved['type']])
+            query = saved['query']
+            if saved['type'] in ('count/entity', 'count/event'):
+                query = {'query-name': name, 'query': query}
+            response = method(query)
+        response['type'] = saved['type']
+        response['query'] = saved['query']
+        return response
+
+    def _get_saved_query(self, name):
+        saved = self._saved_queries.get(name)
+        if saved is None:
+            raise EmulatedAPIError(
+                ERROR_SAVED_QUERY,
+                "The saved query '{0}' does not exist.".format(name),
+                status=404)
+        return saved
+
+    def _check_saved_query(self, saved):
+        if saved.get('type') not in self._SAVED_QUERY_TYPES:
+            raise EmulatedAPIError(
+                ERROR_SAVED_QUERY, "Unknown saved query type, use one of: "
+                "{0}.".format(", ".join(sorted(self._SAVED_QUERY_TYPES))))
+        if 'query' not in saved:
+            raise EmulatedAPIError(ERROR_SAVED_QUERY,
+                                   "A saved query needs a 'query'.")
+
+
+def _sort_key(value):
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, _Event):
+        value = value.value
+    return value
+
+
+def _compute_metric(metric, values):
+    if metric == 'count-events':
+        return len(values)
+    if not values:
+        return None
+    if metric == 'min':
+        return min(values)
+    if metric == 'max':
+        return max(values)
+    total = sum(values)
+    if metric == 'sum':
+        return total
+    return total / float(len(values))
+
+
+def _conjunction(nodes):
+    if len(nodes) == 1:
+        return nodes[0]
+
+    def match(entity_id, row):
+        for node in nodes:
+            if not node(entity_id, row):
+                return 0
+        return 1
+    return match
+
+
+def _disjunction(nodes):
+    def match(entity_id, row):
+        return sum(node(entity_id, row) for node in nodes)
+    return match
+
+
+def _negation(node):
+    return lambda entity_id, row: 0 if node(entity_id, row) else 1
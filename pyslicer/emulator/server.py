@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A local stand-in for the SlicingDice API, to run the client offline.
+
+The server answers every endpoint of URLResources from an in-memory
+EmulatedDatabase, with configurable latency, injected errors and throughput
+limits, so client throughput can be measured on a laptop:
+
+    python -m pyslicer.emulator.server --port 8080 --latency 0.02
+
+    SD_API_ADDRESS=http://127.0.0.1:8080/v1 python my_benchmark.py
+
+Or from Python:
+
+    from pyslicer import SlicingDice
+    from pyslicer.emulator.server import EmulatorServer
+
+    with EmulatorServer(latency=0.01) as server:
+        SlicingDice.BASE_URL = server.url
+        sd = SlicingDice(master_key='any-key')
+"""
+import argparse
+import random
+import threading
+import time
+import zlib
+
+import six
+import ujson
+from six.moves import BaseHTTPServer, socketserver
+
+from ..core.rate_limiter import TokenBucket
+from ..url_resources import URLResources
+from ..utils.data_utils import gzip_compress
+from ..utils.validators import MAX_INSERTION_BATCH_BYTES
+from . import database as db
+from .database import EmulatedAPIError, EmulatedDatabase
+from .sql import execute_sql
+
+# Path prefix of the API, as in SlicingDiceAPI.BASE_URL
+BASE_PATH = '/v1'
+
+# HTTP status of the errors of the emulator, 400 for the others
+ERROR_STATUS = {
+    db.ERROR_INVALID_KEY: 401,
+    db.ERROR_NOT_FOUND: 404,
+    db.ERROR_RATE_LIMIT: 429,
+    db.ERROR_BODY_SIZE: 413,
+}
+
+_ERROR_MESSAGES = {
+    db.ERROR_RATE_LIMIT: "Too many requests, slow down.",
+    db.ERROR_BODY_SIZE: "The request body is too large.",
+    db.ERROR_ENTITIES_LIMIT: "Too many entities in the insertion.",
+    db.ERROR_COLUMNS_LIMIT: "Too many columns in the insertion.",
+}
+
+
+class EmulatedAPI(object):
+    """Answers HTTP requests of the SlicingDice API from an
+    EmulatedDatabase, independently of any transport.
+
+    Before a request is processed it may be delayed by latency, rejected
+    by an injected error or throttled by the throughput limits, so those
+    requests never change the database, like the API errors they emulate.
+    Thread-safe.
+    """
+
+    def __init__(self, database=None, latency=0.0, latency_jitter=0.0,
+                 error_rate=0.0, error_codes=(db.ERROR_RATE_LIMIT,),
+                 requests_per_second=None, bytes_per_second=None,
+                 max_body_bytes=MAX_INSERTION_BATCH_BYTES, api_keys=None,
+                 gzip_responses=False, seed=None):
+        """
+        Parameters:
+            database(EmulatedDatabase) -- The data, defaults to a new empty
+                database
+            latency(float) -- Seconds added to every response
+            latency_jitter(float) -- Up to this many random seconds are
+                added to latency
+            error_rate(float) -- Probability of answering a request with
+                one of error_codes instead of processing it
+            error_codes(tuple) -- API error codes injected, such as 1502
+                (rate limit) and 1507 (body size exceeded)
+            requests_per_second(float) -- Requests accepted per second,
+                the others are answered with error 1502 and Retry-After
+            bytes_per_second(float) -- Request body bytes accepted per
+                second, the others are answered with error 1502
+            max_body_bytes(int) -- Larger request bodies are answered with
+                error 1507
+            api_keys(dict) -- Accepted keys with their level: 0 read,
+                1 write, 2 master. Defaults to None, any key is a master key
+            gzip_responses(bool) -- Compress responses for clients accepting
+                gzip
+            seed -- Seed of the random latency and errors
+        """
+        self.database = database if database is not None \
+            else EmulatedDatabase()
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.max_body_bytes = max_body_bytes
+        self.api_keys = api_keys
+        self.gzip_responses = gzip_responses
+        self._random = random.Random(seed)
+        self._request_bucket = None
+        if requests_per_second:
+            self._request_bucket = TokenBucket(requests_per_second)
+        self._byte_bucket = None
+        if bytes_per_second:
+            self._byte_bucket = TokenBucket(bytes_per_second)
+        self._forced_errors = []
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'errors': 0, 'injected_errors': 0,
+                       'throttled': 0, 'bytes_received': 0, 'bytes_sent': 0,
+                       'paths': {}}
+        self._routes = self._make_routes()
+
+    def _make_routes(self):
+        """Returns the handler and key level of every (method, path)"""
+        data = self.database
+        return {
+            ('GET', URLResources.DATABASE): (
+                lambda body: data.get_database(), 2),
+            ('GET', URLResources.COLUMN): (
+                lambda body: data.get_columns(), 2),
+            ('POST', URLResources.COLUMN): (data.create_column, 1),
+            ('POST', URLResources.INSERT): (data.insert, 1),
+            ('POST', URLResources.QUERY_COUNT_ENTITY): (
+                data.count_entity, 0),
+            ('POST', URLResources.QUERY_COUNT_ENTITY_TOTAL): (
+                data.count_entity_total, 0),
+            ('POST', URLResources.QUERY_COUNT_EVENT): (data.count_event, 0),
+            ('POST', URLResources.QUERY_AGGREGATION): (data.aggregation, 0),
+            ('POST', URLResources.QUERY_TOP_VALUES): (data.top_values, 0),
+            ('POST', URLResources.QUERY_EXISTS_ENTITY): (
+                data.exists_entity, 0),
+            ('GET', URLResources.QUERY_SAVED): (
+                lambda body: data.get_saved_queries(), 2),
+            ('POST', URLResources.QUERY_SAVED): (
+                data.create_saved_query, 2),
+            ('POST', URLResources.QUERY_DATA_EXTRACTION_RESULT): (
+                data.result, 0),
+            ('POST', URLResources.QUERY_DATA_EXTRACTION_SCORE): (
+                data.score, 0),
+            ('POST', URLResources.QUERY_SQL): (
+                lambda body: execute_sql(data, body), 0),
+            ('POST', URLResources.DELETE): (data.delete, 2),
+            ('POST', URLResources.UPDATE): (data.update, 2),
+        }
+
+    def _saved_query_route(self, method, name):
+        """Returns the handler and key level of a request on a saved query,
+        or None"""
+        data = self.database
+        if method == 'GET':
+            return lambda body: data.get_saved_query(name), 0
+        if method == 'PUT':
+            return lambda body: data.update_saved_query(name, body), 2
+        if method == 'DELETE':
+            return lambda body: data.delete_saved_query(name), 2
+        return None
+
+    def inject_errors(self, code, count=1):
+        """Answer the next count requests with an API error
+
+        Keyword arguments:
+        code(int) -- The error code, such as 1502 or 1507
+        count(int) -- Number of requests to fail
+        """
+        with self._lock:
+            self._forced_errors.extend([code] * count)
+
+    def stats(self):
+        """Returns the number of requests, errors, injected errors and
+        throttled requests, the bytes received and sent, and the requests
+        per path"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['paths'] = dict(self._stats['paths'])
+            return stats
+
+    def handle(self, method, path, headers, body):
+        """Answer a request, returning (status, headers, body bytes)
+
+        Keyword arguments:
+        method(string) -- The HTTP method
+        path(string) -- The request path, with or without BASE_PATH
+        headers(dict) -- The request headers
+        body(bytes) -- The request body, as sent
+        """
+        started = time.time()
+        headers = dict((name.lower(), value)
+                       for name, value in six.iteritems(headers or {}))
+        if path.startswith(BASE_PATH + '/'):
+            path = path[len(BASE_PATH):]
+        path = path.split('?', 1)[0]
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['bytes_received'] += len(body or b'')
+            self._stats['paths'][path] = self._stats['paths'].get(path, 0) + 1
+        self._wait_latency()
+        response_headers = {'Content-Type': 'application/json'}
+        try:
+            result = self._process(method, path, headers, body)
+            result.setdefault('status', 'success')
+            result['took'] = round(time.time() - started, 6)
+            status = 200
+        except EmulatedAPIError as e:
+            result = e.body()
+            status = ERROR_STATUS.get(e.code, e.status)
+            if e.code == db.ERROR_RATE_LIMIT:
+                retry_after = getattr(e, 'retry_after', None) or 1
+                response_headers['Retry-After'] = str(
+                    int(retry_after) + (retry_after % 1 > 0))
+            with self._lock:
+                self._stats['errors'] += 1
+        content = ujson.dumps(result).encode('utf-8')
+        if self.gzip_responses and 'gzip' in headers.get(
+                'accept-encoding', ''):
+            content = gzip_compress(content)
+            response_headers['Content-Encoding'] = 'gzip'
+        response_headers['Content-Length'] = str(len(content))
+        with self._lock:
+            self._stats['bytes_sent'] += len(content)
+        return status, response_headers, content
+
+    def _wait_latency(self):
+        delay = self.latency
+        if self.latency_jitter:
+            delay += self._random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _process(self, method, path, headers, body):
+        route = self._routes.get((method, path))
+        if route is None and not path.endswith('/'):
+            route = self._routes.get((method, path + '/'))
+        if route is None and path.startswith(URLResources.QUERY_SAVED):
+            name = path[len(URLResources.QUERY_SAVED):].strip('/')
+            if name:
+                route = self._saved_query_route(method, name)
+        if route is None:
+            raise EmulatedAPIError(
+                db.ERROR_NOT_FOUND,
+                "No endpoint at {0} {1}.".format(method, path))
+        handler, key_level = route
+        self._check_key(headers.get('authorization'), key_level)
+        self._check_injected_error()
+        body = body or b''
+        self._check_throughput(len(body))
+        if len(body) > self.max_body_bytes:
+            raise EmulatedAPIError(db.ERROR_BODY_SIZE, _ERROR_MESSAGES[
+                db.ERROR_BODY_SIZE])
+        if headers.get('content-encoding') == 'gzip':
+            try:
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            except zlib.error:
+                raise EmulatedAPIError(db.ERROR_INVALID_BODY,
+                                       "The body is not valid gzip.")
+        if path == URLResources.QUERY_SQL:
+            return handler(body.decode('utf-8'))
+        data = None
+        if body:
+            try:
+                data = ujson.loads(body)
+            except ValueError:
+                raise EmulatedAPIError(db.ERROR_INVALID_BODY,
+                                       "The body is not valid JSON.")
+        return handler(data)
+
+    def _check_key(self, key, key_level):
+        if not key:
+            raise EmulatedAPIError(db.ERROR_INVALID_KEY,
+                                   "The request has no API key.")
+        if self.api_keys is None:
+            return
+        level = self.api_keys.get(key)
+        if level is None or (level != 2 and level != key_level):
+            raise EmulatedAPIError(
+                db.ERROR_INVALID_KEY,
+                "This key is not allowed to perform this operation.")
+
+    def _check_injected_error(self):
+        with self._lock:
+            code = self._forced_errors.pop(0) if self._forced_errors \
+                else None
+        if code is None and self.error_rate and self.error_codes and (
+                self._random.random() < self.error_rate):
+            code = self._random.choice(self.error_codes)
+        if code is None:
+            return
+        with self._lock:
+            self._stats['injected_errors'] += 1
+        raise EmulatedAPIError(
+            code, _ERROR_MESSAGES.get(code, "Injected error."),
+            ERROR_STATUS.get(code, 500))
+
+    def _check_throughput(self, size):
+        wait = 0.0
+        if self._request_bucket is not None:
+            wait = self._request_bucket.try_take(1)
+        if not wait and size and self._byte_bucket is not None:
+            # Bodies larger than the bucket take all of it
+            wait = self._byte_bucket.try_take(
+                min(size, self._byte_bucket.capacity))
+        if not wait:
+            return
+        with self._lock:
+            self._stats['throttled'] += 1
+        error = EmulatedAPIError(db.ERROR_RATE_LIMIT,
+                                 _ERROR_MESSAGES[db.ERROR_RATE_LIMIT])
+        error.retry_after = wait
+        raise error
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep connections open, as the API does
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm
+    # would hold for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def _answer(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, headers, content = self.server.api.handle(
+            self.command, self.path, dict(self.headers.items()), body)
+        self.send_response(status)
+        for name, value in six.iteritems(headers):
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _answer
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class EmulatorServer(object):
+    """Serves an EmulatedAPI over HTTP on a background thread.
+
+    Example usage:
+
+        with EmulatorServer(latency=0.005, error_rate=0.01) as server:
+            SlicingDice.BASE_URL = server.url
+            ...
+            print(server.api.stats())
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, api=None, verbose=False,
+                 **options):
+        """
+        Parameters:
+            host(string) -- Address to listen on
+            port(int) -- Port to listen on, defaults to 0, a free port
+            api(EmulatedAPI) -- The API to serve, defaults to a new one
+                built with options
+            verbose(bool) -- Log every request to stderr
+            options -- Arguments of EmulatedAPI
+        """
+        self.api = api if api is not None else EmulatedAPI(**options)
+        self._server = _HTTPServer((host, port), _RequestHandler)
+        self._server.api = self.api
+        self._server.verbose = verbose
+        self._thread = None
+
+    @property
+    def database(self):
+        return self.api.database
+
+    @property
+    def url(self):
+        """The base URL of the API, to be used as SlicingDice.BASE_URL or
+        SD_API_ADDRESS"""
+        host, port = self._server.server_address[:2]
+        return 'http://{0}:{1}{2}'.format(host, port, BASE_PATH)
+
+    def start(self):
+        """Start serving on a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._server.serve_forever,
+                name='slicingdice-emulator')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve on the current thread until interrupted"""
+        self._server.serve_forever()
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve an in-memory SlicingDice API emulator.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every response")
+    parser.add_argument('--latency-jitter', type=float, default=0.0,
+                        help="up to this many random seconds are added")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="probability of answering with an error")
+    parser.add_argument('--error-codes', type=int, nargs='+',
+                        default=[db.ERROR_RATE_LIMIT],
+                        help="API error codes injected, such as 1502 1507")
+    parser.add_argument('--requests-per-second', type=float)
+    parser.add_argument('--bytes-per-second', type=float)
+    parser.add_argument('--gzip-responses', action='store_true')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    server = EmulatorServer(
+        args.host, args.port, verbose=args.verbose, latency=args.latency,
+        latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+        error_codes=args.error_codes,
+        requests_per_second=args.requests_per_second,
+        bytes_per_second=args.bytes_per_second,
+        gzip_responses=args.gzip_responses)
+    print("SlicingDice emulator listening at {0}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
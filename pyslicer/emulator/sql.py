@@ -0,0 +1,600 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The subset of SQL answered by the emulator:
+
+    SELECT * | dimension.* | item, ... FROM dimension
+        [WHERE condition] [GROUP BY column, ...]
+        [HAVING [column.date] BETWEEN start AND end [AND ...]]
+        [ORDER BY name [ASC | DESC], ...] [LIMIT n]
+    INSERT INTO dimension([entity-id], column, ...) VALUES (...), ...
+
+Items are columns, [entity-id], score, COUNT(*), COUNT, AVG, MIN, MAX or
+SUM of a column, optionally named with AS, and CASE WHEN condition THEN
+value ... [ELSE value] END. Conditions compare a column with =, !=, <>, <,
+<=, >, >=, BETWEEN, [NOT] IN or [NOT] LIKE, combined with AND, OR, NOT and
+parentheses. Event columns are written [column.value] and [column.date].
+Conditions on the same column joined by AND are merged, so value and date
+conditions apply to the same events.
+
+As in the API, aggregations cover every entity matched, or each group of
+GROUP BY, or each entity when they are selected with columns or score.
+HAVING keeps the events of a column in a date range. SELECT * returns the
+columns that are not event columns. AVG is rounded to 6 decimals.
+
+DATEPART, GROUP BY INTERVAL and HAVING on aggregations are not supported
+and answered with error 3006.
+"""
+import re
+
+import six
+
+from .database import (DEFAULT_DIMENSION, ERROR_UNSUPPORTED_SQL,
+                       EmulatedAPIError)
+
+_TOKENS = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<bracket>\[[^\]]+\])
+      | (?P<operator><>|!=|<=|>=|[=<>(),*])
+      | (?P<word>[A-Za-z_][A-Za-z0-9_.-]*)
+    )""", re.VERBOSE)
+
+_KEYWORDS = ('SELECT', 'FROM', 'WHERE', 'AND', 'OR', 'NOT', 'BETWEEN', 'IN',
+             'LIKE', 'ORDER', 'BY', 'ASC', 'DESC', 'LIMIT', 'COUNT',
+             'INSERT', 'INTO', 'VALUES', 'GROUP', 'HAVING', 'NULL', 'TRUE',
+             'FALSE', 'AS', 'CASE', 'WHEN', 'THEN', 'ELSE', 'END')
+
+_AGGREGATIONS = ('COUNT', 'AVG', 'MIN', 'MAX', 'SUM')
+
+_COMPARISONS = {'=': 'equals', '!=': 'not-equals', '<>': 'not-equals',
+                '<': 'lt', '<=': 'lte', '>': 'gt', '>=': 'gte'}
+
+
+def _unsupported(message):
+    return EmulatedAPIError(ERROR_UNSUPPORTED_SQL, message)
+
+
+class _Token(object):
+    __slots__ = ('kind', 'value')
+
+    def __init__(self, kind, value):
+        self.kind = kind
+        self.value = value
+
+
+def _tokenize(statement):
+    tokens = []
+    position = 0
+    statement = statement.strip().rstrip(';')
+    while position < len(statement):
+        match = _TOKENS.match(statement, position)
+        if match is None or match.end() == position:
+            raise _unsupported("Can't parse the statement at '{0}'.".format(
+                statement[position:position + 20]))
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1].replace("''", "'")
+        elif kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'bracket':
+            kind, value = 'word', value[1:-1]
+        elif kind == 'word' and value.upper() in _KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        tokens.append(_Token(kind, value))
+    return tokens
+
+
+class _Parser(object):
+    def __init__(self, statement):
+        self.tokens = _tokenize(statement)
+        self.position = 0
+        # The dimension of the statement, dropped from qualified names
+        self.table = None
+
+    def peek(self, kind=None, value=None):
+        if self.position >= len(self.tokens):
+            return None
+        token = self.tokens[self.position]
+        if kind is not None and token.kind != kind:
+            return None
+        if value is not None and token.value != value:
+            return None
+        return token
+
+    def take(self, kind=None, value=None):
+        token = self.peek(kind, value)
+        if token is None:
+            found = self.peek()
+            raise _unsupported("Expected {0} but found {1}.".format(
+                value or kind, found.value if found else 'the end'))
+        self.position += 1
+        return token
+
+    def accept(self, kind=None, value=None):
+        if self.peek(kind, value) is None:
+            return None
+        return self.take()
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # Conditions, translated to the JSON queries of the database
+
+    def condition(self):
+        terms = [self.conjunction()]
+        while self.accept('keyword', 'OR'):
+            terms.append(self.conjunction())
+        if len(terms) == 1:
+            return terms[0]
+        expression = []
+        for term in terms:
+            if expression:
+                expression.append('or')
+            expression.append(term)
+        return expression
+
+    def conjunction(self):
+        factors = [self.factor()]
+        while self.accept('keyword', 'AND'):
+            factors.append(self.factor())
+        return _merge_events(factors)
+
+    def factor(self):
+        if self.accept('keyword', 'NOT'):
+            return ['not', self.factor()]
+        if self.accept('operator', '('):
+            condition = self.condition()
+            self.take('operator', ')')
+            return condition
+        return self.comparison()
+
+    def literal(self):
+        token = self.take()
+        if token.kind in ('string', 'number'):
+            return token.value
+        if token.kind == 'keyword' and token.value in ('TRUE', 'FALSE'):
+            return token.value.lower()
+        raise _unsupported("Expected a value but found {0}.".format(
+            token.value))
+
+    def values(self):
+        self.take('operator', '(')
+        values = [self.literal()]
+        while self.accept('operator', ','):
+            values.append(self.literal())
+        self.take('operator', ')')
+        return values
+
+    def comparison(self):
+        word = self.take('word').value
+        if self.peek('operator', '('):
+            raise _unsupported("The emulator doesn't support the function "
+                               "{0}.".format(word))
+        if self.table is not None:
+            word = _unqualified(word, self.table)
+        column, event_part = _split_event(word)
+        if self.accept('keyword', 'NOT'):
+            if self.accept('keyword', 'IN'):
+                return {column: {'not-in': self.values()}}
+            self.take('keyword', 'LIKE')
+            operators = _like(six.text_type(self.literal()))
+            if 'contains' in operators:
+                return {column: {'not-contains': operators['contains']}}
+            return ['not', {column: operators}]
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.literal()
+            self.take('keyword', 'AND')
+            high = self.literal()
+            if event_part == 'date':
+                operators = {'between': [low, high]}
+            else:
+                operators = {'range': [low, high]}
+        elif self.accept('keyword', 'IN'):
+            operators = {'in': self.values()}
+        elif self.accept('keyword', 'LIKE'):
+            pattern = six.text_type(self.literal())
+            operators = _like(pattern)
+        else:
+            operator = self.take('operator').value
+            if operator not in _COMPARISONS:
+                raise _unsupported("Unknown comparison '{0}'.".format(
+                    operator))
+            value = self.literal()
+            if event_part == 'date':
+                if operator != '=':
+                    raise _unsupported("Event dates only support = and "
+                                       "BETWEEN.")
+                operators = {'between': [value, value]}
+            else:
+                operators = {_COMPARISONS[operator]: value}
+        if column == 'entity-id' and 'range' in operators:
+            raise _unsupported("Entity ids only support = and IN.")
+        return {column: operators}
+
+
+def _split_event(name):
+    """Returns the column of a name and 'value' or 'date' for the
+    [column.value] and [column.date] of event columns, None otherwise"""
+    if name.endswith('.value') or name.endswith('.date'):
+        column, part = name.rsplit('.', 1)
+        return column, part
+    return name, None
+
+
+def _like(pattern):
+    """Returns the operators of a LIKE pattern: 'x%', '%x' or '%x%'"""
+    starts = pattern.startswith('%')
+    ends = pattern.endswith('%')
+    text = pattern.strip('%')
+    if '%' in text:
+        raise _unsupported("Only leading and trailing % are supported in "
+                           "LIKE.")
+    if starts and ends:
+        return {'contains': [text]}
+    if ends:
+        return {'starts-with': [text]}
+    if starts:
+        return {'ends-with': [text]}
+    return {'equals': text}
+
+
+def _merge_events(factors):
+    """Join factors with 'and', merging the operators of conditions on the
+    same column"""
+    merged = []
+    for factor in factors:
+        if (isinstance(factor, dict) and merged and
+                isinstance(merged[-1], dict)):
+            (name, operators), = factor.items()
+            previous = merged[-1]
+            if name in previous and not set(operators) & set(previous[name]):
+                previous[name] = dict(previous[name], **operators)
+                continue
+        merged.append(factor)
+    if len(merged) == 1:
+        return merged[0]
+    expression = []
+    for factor in merged:
+        if expression:
+            expression.append('and')
+        expression.append(factor)
+    return expression
+
+
+class _Item(object):
+    """An item of a SELECT: every column ('star'), a 'column', an
+    'aggregation' of a column or a 'case'"""
+
+    def __init__(self, kind, name=None, column=None):
+        self.kind = kind
+        self.name = name
+        self.column = column
+        self.key = None
+        self.cases = None
+        self.default = None
+
+    def resolve(self, dimension):
+        """Drop the dimension of qualified names and name the result"""
+        if self.column is not None:
+            self.column = _unqualified(self.column, dimension)
+        if self.key is None:
+            self.key = self.column if self.kind == 'column' else self.name
+
+
+def _unqualified(name, dimension):
+    """Returns a column name without the 'dimension.' prefix"""
+    prefix = dimension + '.'
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
+class _SelectParser(_Parser):
+    """Parses the clauses of a SELECT that are not conditions"""
+
+    def select_item(self):
+        token = self.take()
+        if token.kind == 'operator' and token.value == '*':
+            return _Item('star')
+        if token.kind == 'keyword' and token.value == 'CASE':
+            item = self.case()
+        elif (token.kind in ('word', 'keyword') and
+              token.value.upper() in _AGGREGATIONS and
+              self.accept('operator', '(')):
+            column = None
+            if not self.accept('operator', '*'):
+                column = self.take('word').value
+            self.take('operator', ')')
+            item = _Item('aggregation', token.value.upper(), column)
+        elif token.kind == 'word':
+            if token.value.endswith('.') and self.accept('operator', '*'):
+                return _Item('star')
+            if self.peek('operator', '('):
+                raise _unsupported("The emulator doesn't support the "
+                                   "function {0}.".format(token.value))
+            item = _Item('column', column=token.value)
+        else:
+            raise _unsupported("Unexpected {0} in SELECT.".format(
+                token.value))
+        if self.accept('keyword', 'AS'):
+            item.key = self.take('word').value
+        return item
+
+    def case(self):
+        item = _Item('case', 'CASE')
+        item.cases = []
+        while self.accept('keyword', 'WHEN'):
+            condition = self.condition()
+            self.take('keyword', 'THEN')
+            item.cases.append((condition, self.literal()))
+        if not item.cases:
+            raise _unsupported("CASE needs a WHEN.")
+        if self.accept('keyword', 'ELSE'):
+            item.default = self.literal()
+        self.take('keyword', 'END')
+        return item
+
+    def names(self):
+        names = [self.name()]
+        while self.accept('operator', ','):
+            names.append(self.name())
+        return names
+
+    def name(self):
+        word = self.take('word').value
+        if self.peek('operator', '('):
+            raise _unsupported("The emulator doesn't support the function "
+                               "{0}.".format(word))
+        return word
+
+    def having(self):
+        """Returns the [column.date] ranges of HAVING, keyed by column"""
+        ranges = {}
+        while True:
+            token = self.take()
+            column, part = _split_event(six.text_type(token.value))
+            if (token.kind != 'word' or part != 'date' or
+                    not self.accept('keyword', 'BETWEEN')):
+                raise _unsupported("HAVING only supports [column.date] "
+                                   "BETWEEN.")
+            low = self.literal()
+            self.take('keyword', 'AND')
+            ranges[column] = [low, self.literal()]
+            if not self.accept('keyword', 'AND'):
+                return ranges
+
+    def order(self):
+        order = []
+        while True:
+            name = self.name()
+            direction = 'asc'
+            if self.accept('keyword', 'DESC'):
+                direction = 'desc'
+            else:
+                self.accept('keyword', 'ASC')
+            order.append((name, direction))
+            if not self.accept('operator', ','):
+                return order
+
+
+def execute_sql(database, statement):
+    """Run a SQL statement on an EmulatedDatabase, returning the response
+    of the sql endpoint
+
+    Keyword arguments:
+    database(EmulatedDatabase) -- The database
+    statement(string) -- The statement
+    """
+    parser = _SelectParser(statement)
+    if parser.accept('keyword', 'INSERT'):
+        return _insert(database, parser)
+    parser.take('keyword', 'SELECT')
+    items = [parser.select_item()]
+    while parser.accept('operator', ','):
+        items.append(parser.select_item())
+    parser.take('keyword', 'FROM')
+    dimension = parser.take('word').value
+    parser.table = dimension
+    query = None
+    if parser.accept('keyword', 'WHERE'):
+        query = parser.condition()
+    groups = []
+    if parser.accept('keyword', 'GROUP'):
+        parser.take('keyword', 'BY')
+        groups = [_unqualified(name, dimension) for name in parser.names()]
+    ranges = {}
+    if parser.accept('keyword', 'HAVING'):
+        ranges = dict((column, database.resolve_between(between))
+                      for column, between in six.iteritems(parser.having()))
+    order = []
+    if parser.accept('keyword', 'ORDER'):
+        parser.take('keyword', 'BY')
+        order = parser.order()
+    limit = None
+    if parser.accept('keyword', 'LIMIT'):
+        limit = parser.take('number').value
+    if not parser.done():
+        raise _unsupported("The emulator doesn't support '{0}'.".format(
+            parser.peek().value))
+    for item in items:
+        item.resolve(dimension)
+
+    select = _Select(database, dimension, items, ranges)
+    entities = database.scan(dimension, query)
+    if groups:
+        rows = select.grouped(entities, groups)
+    elif any(item.kind != 'aggregation' for item in items):
+        rows = select.per_entity(entities)
+    else:
+        rows = [({}, select.aggregated(entities))]
+    # Sort by the last key first, stable sorts keep the previous order
+    for name, direction in reversed(order):
+        name = _unqualified(name, dimension)
+        rows.sort(key=lambda row: _sort_key(row, name),
+                  reverse=direction == 'desc')
+    rows = [result for _, result in rows[:limit]]
+    return {'status': 'success', 'result': rows, 'count': len(rows)}
+
+
+def _sort_key(row, name):
+    """Returns the sort key of a (columns, result) row, missing values
+    last"""
+    columns, result = row
+    value = result.get(name, columns.get(name))
+    return (value is None, value)
+
+
+def _is_events(value):
+    return bool(value) and isinstance(value, list) and isinstance(
+        value[0], tuple)
+
+
+class _Select(object):
+    """Computes the rows of a SELECT from the entities it matched"""
+
+    def __init__(self, database, dimension, items, ranges):
+        self.items = items
+        self.ranges = ranges
+        # The entities matching each WHEN of the CASE items
+        self.cases = {}
+        for item in items:
+            if item.kind == 'case':
+                self.cases[item] = [
+                    (set(entity_id for entity_id, _, _ in
+                         database.scan(dimension, condition)), value)
+                    for condition, value in item.cases]
+
+    def values(self, entity, name):
+        """Returns the values of a column of an entity, the values of the
+        events in the HAVING range for an event column"""
+        entity_id, _, columns = entity
+        column, _ = _split_event(name)
+        if column == 'entity-id':
+            return [entity_id]
+        value = columns.get(column)
+        if value is None:
+            return []
+        if _is_events(value):
+            between = self.ranges.get(column)
+            return [event_value for event_value, timestamp in value
+                    if between is None or
+                    between[0] <= timestamp <= between[1]]
+        return value if isinstance(value, list) else [value]
+
+    def aggregate(self, item, entities):
+        if item.column is None or item.column == 'entity-id':
+            values = [entity[0] for entity in entities]
+        else:
+            values = [value for entity in entities
+                      for value in self.values(entity, item.column)]
+        if item.name == 'COUNT':
+            return len(values)
+        if not values:
+            return None
+        if item.name == 'MIN':
+            return min(values)
+        if item.name == 'MAX':
+            return max(values)
+        if item.name == 'SUM':
+            return sum(values)
+        return round(sum(values) / float(len(values)), 6)
+
+    def aggregated(self, entities):
+        return dict((item.key, self.aggregate(item, entities))
+                    for item in self.items)
+
+    def per_entity(self, entities):
+        rows = []
+        for entity in entities:
+            entity_id, score, columns = entity
+            result = {}
+            for item in self.items:
+                if item.kind == 'star':
+                    for name, value in six.iteritems(columns):
+                        if not _is_events(value):
+                            result[name] = value
+                    result['entity-id'] = entity_id
+                    result['score'] = float(score)
+                elif item.kind == 'aggregation':
+                    result[item.key] = self.aggregate(item, [entity])
+                elif item.kind == 'case':
+                    result[item.key] = item.default
+                    for matched, value in self.cases[item]:
+                        if entity_id in matched:
+                            result[item.key] = value
+                            break
+                elif item.column == 'score':
+                    result[item.key] = float(score)
+                else:
+                    values = self.values(entity, item.column)
+                    if _is_events(columns.get(item.column)):
+                        values = values[-1:]
+                    if values:
+                        result[item.key] = values[0] if len(values) == 1 \
+                            else values
+            rows.append((columns, result))
+        return rows
+
+    def grouped(self, entities, groups):
+        for item in self.items:
+            if item.kind == 'column' and item.column not in groups or \
+                    item.kind in ('star', 'case'):
+                raise _unsupported("Every column selected with GROUP BY "
+                                   "must be grouped.")
+        members = {}
+        for entity in entities:
+            keys = [()]
+            for name in groups:
+                values = sorted(set(self.values(entity, name)))
+                keys = [key + (value,) for key in keys for value in values]
+            for key in keys:
+                members.setdefault(key, []).append(entity)
+        rows = []
+        for key in sorted(members):
+            result = dict(zip(groups, key))
+            for item in self.items:
+                if item.kind == 'aggregation':
+                    result[item.key] = self.aggregate(item, members[key])
+                elif item.key != item.column:
+                    result[item.key] = result[item.column]
+            rows.append((result, result))
+        return rows
+
+
+def _insert(database, parser):
+    parser.take('keyword', 'INTO')
+    dimension = parser.take('word').value
+    parser.take('operator', '(')
+    columns = [parser.take('word').value]
+    while parser.accept('operator', ','):
+        columns.append(parser.take('word').value)
+    parser.take('operator', ')')
+    if 'entity-id' not in columns:
+        raise _unsupported("INSERT needs an [entity-id] column.")
+    parser.take('keyword', 'VALUES')
+    insertion = {}
+    while True:
+        parser.take('operator', '(')
+        values = [parser.literal()]
+        while parser.accept('operator', ','):
+            values.append(parser.literal())
+        parser.take('operator', ')')
+        if len(values) != len(columns):
+            raise _unsupported("Each row needs one value per column.")
+        row = dict(zip(columns, values))
+        entity_id = six.text_type(row.pop('entity-id'))
+        if dimension != DEFAULT_DIMENSION:
+            row['dimension'] = dimension
+        insertion[entity_id] = row
+        if not parser.accept('operator', ','):
+            break
+    if not parser.done():
+        raise _unsupported("Unexpected '{0}' after VALUES.".format(
+            parser.peek().value))
+    insertion['auto-create'] = ['dimension', 'column']
+    response = database.insert(insertion)
+    count = response['inserted-entities']
+    return {'status': 'success', 'result': [{'inserted': count}],
+            'count': count}
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import calendar
+import datetime
+import re
+import time
+
+import six
+
+_ABSOLUTE = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[Tt ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?)?'
+    r'\s*([Zz]|[+-]\d{2}:?\d{2})?$')
+
+_RELATIVE = re.compile(
+    r'^([+-])?\s*(\d+)\s*([a-z]+?)s?(\s+ago)?$')
+
+_UNIT_SECONDS = {
+    'sec': 1, 'second': 1,
+    'min': 60, 'minute': 60,
+    'hr': 3600, 'hour': 3600,
+    'd': 86400, 'day': 86400,
+    'w': 604800, 'week': 604800,
+    'm': 2592000, 'month': 2592000,
+    'y': 31536000, 'year': 31536000,
+}
+
+# Length in seconds of the aggregation intervals
+INTERVAL_SECONDS = {
+    'minute': 60, 'minutes': 60,
+    'hour': 3600, 'hours': 3600,
+    'day': 86400, 'days': 86400,
+    'week': 604800, 'weeks': 604800,
+    'month': 2592000, 'months': 2592000,
+    'year': 31536000, 'years': 31536000,
+}
+
+
+def parse_time(value):
+    """Returns the UTC timestamp of an absolute date or datetime string, or
+    None if value is not one
+
+    Keyword arguments:
+    value(string) -- Such as '2016-01-01' or '2016-08-17T13:23:47+00:00'
+    """
+    if not isinstance(value, six.string_types):
+        return None
+    match = _ABSOLUTE.match(value.strip())
+    if match is None:
+        return None
+    (year, month, day, hour, minute, second, fraction,
+     offset) = match.groups()
+    try:
+        moment = datetime.datetime(
+            int(year), int(month), int(day), int(hour or 0),
+            int(minute or 0), int(second or 0))
+    except ValueError:
+        return None
+    timestamp = float(calendar.timegm(moment.timetuple()))
+    if fraction:
+        timestamp += float('0.' + fraction)
+    if offset and offset.upper() != 'Z':
+        offset = offset.replace(':', '')
+        seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+        timestamp -= seconds if offset[0] == '+' else -seconds
+    return timestamp
+
+
+def format_date(timestamp):
+    """Returns a timestamp as a 'YYYY-MM-DD' string"""
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+def format_datetime(timestamp):
+    """Returns a timestamp as a 'YYYY-MM-DDTHH:MM:SSZ' string"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def _resolve_point(value, now, base):
+    """Returns the timestamp of one bound of a 'between' range
+
+    Keyword arguments:
+    value(string) -- An absolute date, 'now', 'today' or a relative time
+        such as '-3hr', '+1w' or '7 days ago'
+    now(float) -- The current timestamp
+    base(float) -- Timestamp relative times are applied to, defaults to now
+    """
+    if not isinstance(value, six.string_types):
+        raise ValueError(value)
+    text = value.strip().lower()
+    if text == 'now':
+        return now
+    if text == 'today':
+        return now - now % 86400
+    timestamp = parse_time(value)
+    if timestamp is not None:
+        return timestamp
+    match = _RELATIVE.match(text)
+    if match is None or match.group(3) not in _UNIT_SECONDS:
+        raise ValueError(value)
+    sign, amount, unit, ago = match.groups()
+    seconds = int(amount) * _UNIT_SECONDS[unit]
+    if sign == '-' or ago:
+        seconds = -seconds
+    return (now if base is None else base) + seconds
+
+
+def resolve_between(between, now=None):
+    """Returns the (start, end) timestamps of a 'between' value, both
+    included. Raises ValueError if it is not valid.
+
+    Keyword arguments:
+    between(list) -- One or two bounds, see _resolve_point. The second bound
+        is relative to the first one when it is a relative time
+    now(float) -- The current timestamp (default time.time())
+    """
+    if now is None:
+        now = time.time()
+    if not isinstance(between, list) or len(between) not in (1, 2):
+        raise ValueError(between)
+    start = _resolve_point(between[0], now, None)
+    if len(between) == 1:
+        # A single day, such as ['today'] or ['2016-01-01']
+        start -= start % 86400
+        return start, start + 86399.999999
+    end = _resolve_point(between[1], now, start)
+    if end < start:
+        start, end = end, start
+    return start, end
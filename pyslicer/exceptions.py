@@ -9,6 +9,12 @@ class SlicingDiceException(Exception):
         self.code = kwargs.pop('code', None)
         self.message = kwargs.pop('message', None)
         self.more_info = kwargs.pop('more-info', None)
+        # Seconds the API asked to wait before retrying, if any
+        self.retry_after = kwargs.pop('retry_after', None)
+        # False when the request is known not to have reached the API
+        self.request_sent = kwargs.pop('request_sent', None)
+        # HTTP status of the response that raised the error, if any
+        self.status_code = kwargs.pop('status_code', None)
         super(SlicingDiceException, self).__init__(self, *args, **kwargs)
 
     def __str__(self):
@@ -112,3 +118,31 @@ class InvalidColumnDescriptionException(SlicingDiceException):
     def __init__(self, *args, **kwargs):
         super(InvalidColumnDescriptionException, self).__init__(self, *args,
                                                                 **kwargs)
+
+
+# Insert buffer exceptions
+
+class InsertBufferFullException(SlicingDiceException):
+    def __init__(self, *args, **kwargs):
+        super(InsertBufferFullException, self).__init__(self, *args,
+                                                        **kwargs)
+
+
+class InsertBufferClosedException(SlicingDiceException):
+    def __init__(self, *args, **kwargs):
+        super(InsertBufferClosedException, self).__init__(self, *args,
+                                                          **kwargs)
+
+
+class InsertBatchesFailedException(SlicingDiceException):
+    def __init__(self, *args, **kwargs):
+        # The exceptions raised by each of the failed requests
+        self.errors = kwargs.pop('errors', [])
+        super(InsertBatchesFailedException, self).__init__(self, *args,
+                                                           **kwargs)
+
+
+class InsertSpoolLockedException(SlicingDiceException):
+    def __init__(self, *args, **kwargs):
+        super(InsertSpoolLockedException, self).__init__(self, *args,
+                                                         **kwargs)
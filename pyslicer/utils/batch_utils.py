@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import six
+import ujson
+
+from .. import exceptions
+from .validators import (MAX_INSERTION_BATCH_BYTES, MAX_INSERTION_BATCH_SIZE,
+                         check_values)
+
+
+def encode_entity(entity_id, columns, check_columns=False):
+    """Serialize a single entity as a '"id":{...}' JSON fragment.
+
+    Keyword arguments:
+    entity_id -- The entity id
+    columns(dict) -- The columns to insert for this entity
+    check_columns(bool) -- Check every nested value of columns
+    """
+    if not isinstance(columns, dict) or not columns:
+        raise exceptions.WrongTypeException(
+            "The value for an id should be a dictionary")
+    if check_columns:
+        check_values(columns)
+    if not isinstance(entity_id, six.string_types):
+        entity_id = str(entity_id)
+    return ujson.dumps(entity_id) + ':' + ujson.dumps(columns)
+
+
+def iter_insert_batches(entities, auto_create=None,
+                        max_entities=MAX_INSERTION_BATCH_SIZE,
+                        max_bytes=MAX_INSERTION_BATCH_BYTES,
+                        validate_values=False):
+    """Pack entities into serialized insert bodies accepted by the API.
+
+    Each body holds up to max_entities entities and stays under max_bytes,
+    with 'auto-create' repeated in every body.
+
+    Keyword arguments:
+    entities -- An iterable of (entity_id, columns) pairs
+    auto_create(list) -- Value of the 'auto-create' parameter (default None)
+    max_entities(int) -- Maximum number of entities per body
+    max_bytes(int) -- Maximum size of each body
+    validate_values(bool) -- Check every nested value of the entities, as
+        the 'full' validation level does (default False)
+    """
+    fragments = ((entity_id, encode_entity(entity_id, columns,
+                                           validate_values))
+                 for entity_id, columns in entities)
+    return pack_insert_batches(fragments, auto_create, max_entities,
+                               max_bytes)
+
+
+def pack_insert_batches(fragments, auto_create=None,
+                        max_entities=MAX_INSERTION_BATCH_SIZE,
+                        max_bytes=MAX_INSERTION_BATCH_BYTES):
+    """Pack already serialized entities into insert bodies accepted by the
+    API, as iter_insert_batches.
+
+    Keyword arguments:
+    fragments -- An iterable of (entity_id, fragment) pairs, where fragment
+        is the '"id":{...}' JSON of the entity
+    auto_create(list) -- Value of the 'auto-create' parameter (default None)
+    max_entities(int) -- Maximum number of entities per body
+    max_bytes(int) -- Maximum size of each body
+    """
+    tail = '}'
+    if auto_create:
+        tail = ',"auto-create":' + ujson.dumps(auto_create) + '}'
+    overhead = 1 + len(tail)
+
+    batch = []
+    size = overhead
+    for entity_id, fragment in fragments:
+        if entity_id == 'auto-create':
+            raise exceptions.InvalidInsertException(
+                "'auto-create' must be passed as a parameter, not as an "
+                "entity.")
+        if overhead + len(fragment) > max_bytes:
+            raise exceptions.InvalidInsertException(
+                "The entity '{0}' alone exceeds the limit of {1} bytes per "
+                "request.".format(entity_id, max_bytes))
+        if batch and (len(batch) >= max_entities or
+                      size + len(fragment) + 1 > max_bytes):
+            yield '{' + ','.join(batch) + tail
+            batch = []
+            size = overhead
+        batch.append(fragment)
+        size += len(fragment) + 1
+
+    if batch:
+        yield '{' + ','.join(batch) + tail
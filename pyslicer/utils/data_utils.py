@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import zlib
+
+import six
+
 
 def is_dict_empty(dictionary):
     """Validate if a dictionary is empty or no. Returns a boolean value.
@@ -18,3 +22,30 @@ def is_str_empty(string):
     string(str) -- A string to analyze
     """
     return string.isspace() or not string
+
+
+def gzip_compress(data, level=6, chunk_size=64 * 1024):
+    """Compress a request body in the gzip format. Returns bytes.
+
+    Text is encoded chunk by chunk as it is compressed, so large bodies are
+    never copied whole into an encoded buffer.
+
+    Keyword arguments:
+    data(str or bytes) -- The body to compress
+    level(int) -- zlib compression level, from 1 to 9 (default 6)
+    chunk_size(int) -- Size of the slices fed to the compressor
+    """
+    # wbits 16 + MAX_WBITS writes a gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    encode = isinstance(data, six.text_type)
+    if not encode:
+        # Python 2's zlib rejects memoryview, but takes read-only buffers
+        data = buffer(data) if six.PY2 else memoryview(data)  # noqa: F821
+    parts = []
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        if encode:
+            chunk = chunk.encode('utf-8')
+        parts.append(compressor.compress(chunk))
+    parts.append(compressor.flush())
+    return b''.join(parts)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import six
+
+from .. import exceptions
+from .validators import QUERY_OPTIONS
+
+
+def chunks(items, size):
+    """Split a list in lists of up to size items
+
+    Keyword arguments:
+    items(list) -- The items to split
+    size(int) -- Maximum number of items in each chunk
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def iter_unique_chunks(items, size):
+    """Yield lists of up to size items from an iterable, skipping items
+    already seen. Items are consumed lazily.
+
+    Keyword arguments:
+    items -- An iterable of hashable items
+    size(int) -- Maximum number of items in each chunk
+    """
+    seen = set()
+    chunk = []
+    for item in items:
+        if item in seen:
+            continue
+        seen.add(item)
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def split_named_queries(query, size):
+    """Split a dictionary query keyed by query name, such as a top values
+    query, in sub-queries of up to size named queries. Returns None when the
+    query fits in one request.
+
+    QUERY_OPTIONS keys are copied to every sub-query.
+
+    Keyword arguments:
+    query(dict) -- A dictionary query
+    size(int) -- Maximum number of named queries per request
+    """
+    if not isinstance(query, dict):
+        return None
+    options = dict((key, value) for key, value in six.iteritems(query)
+                   if key in QUERY_OPTIONS)
+    names = [key for key in query if key not in QUERY_OPTIONS]
+    if len(names) <= size:
+        return None
+    sub_queries = []
+    for chunk in chunks(names, size):
+        sub_query = dict((name, query[name]) for name in chunk)
+        sub_query.update(options)
+        sub_queries.append(sub_query)
+    return sub_queries
+
+
+def split_aggregation(query):
+    """Split an aggregation query whose 'query' is a list of independent
+    aggregations, each one a list of nested columns, in one sub-query per
+    aggregation. Returns None when 'query' is a single list of nested
+    columns, which can't be split.
+
+    Other keys of the query, such as 'filter', are copied to every
+    sub-query.
+
+    Keyword arguments:
+    query(dict) -- An aggregation query
+    """
+    columns = query.get("query") if isinstance(query, dict) else None
+    if not isinstance(columns, list) or not any(
+            isinstance(group, list) for group in columns):
+        return None
+    if not all(isinstance(group, list) for group in columns):
+        raise exceptions.InvalidQueryException(
+            "An aggregation 'query' must be a list of columns or a list of "
+            "independent aggregations, each one a list of columns, not a "
+            "mix of both.")
+    sub_queries = []
+    for group in columns:
+        sub_query = dict(query)
+        sub_query["query"] = group
+        sub_queries.append(sub_query)
+    return sub_queries
+
+
+def merge_results(responses, unique=False):
+    """Merge the responses of sub-queries into a single response.
+
+    The 'result' dictionaries are merged, 'took' is the longest time since
+    sub-queries run concurrently, and other keys come from the first
+    response.
+
+    Keyword arguments:
+    responses -- The decoded responses, in the order of the sub-queries
+    unique(bool) -- Raise if two sub-queries return the same result key
+        instead of keeping the last one (default False)
+    """
+    merged = {}
+    result = {}
+    took = None
+    for response in responses:
+        for key, value in six.iteritems(response):
+            if key == 'result':
+                if not isinstance(value, dict):
+                    raise exceptions.SlicingDiceException(
+                        "Can't merge a non dictionary result.")
+                if unique:
+                    duplicates = set(value).intersection(result)
+                    if duplicates:
+                        raise exceptions.SlicingDiceException(
+                            "More than one sub-query returned {0}.".format(
+                                ", ".join(sorted(duplicates))))
+                result.update(value)
+            elif key == 'took':
+                took = value if took is None else max(took, value)
+            else:
+                merged.setdefault(key, value)
+    merged['result'] = result
+    if took is not None:
+        merged['took'] = took
+    return merged
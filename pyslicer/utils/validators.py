@@ -9,51 +9,101 @@ from pyslicer.utils.data_utils import is_str_empty
 
 MAX_QUERY_SIZE = 10
 
+MAX_TOP_VALUES_QUERY_SIZE = 5
+
+MAX_EXISTS_ENTITY_IDS = 100
+
+MAX_AGGREGATION_COLUMNS = 5
+
+# Keys of a dictionary query that apply to the whole request instead of
+# naming a query
+QUERY_OPTIONS = ('bypass-cache', 'cache-period')
+
 MAX_INSERTION_BATCH_SIZE = 1000
 
+MAX_INSERTION_BATCH_BYTES = 5 * 1024 * 1024
 
-class SDBaseValidator(object):
-    """Base column, query and insertion validator."""
-    __metaclass__ = abc.ABCMeta
+# Types a column can be created with
+COLUMN_TYPES = (
+    "unique-id", "boolean", "string", "integer", "decimal",
+    "enumerated", "date", "integer-event",
+    "decimal-event", "string-event", "datetime"
+)
 
-    def check_dictionary_value(self, dictionary_value):
-        if isinstance(dictionary_value, dict):
-            self.check_dictionary(dictionary_value)
-        elif isinstance(dictionary_value, list):
-            self.check_list(dictionary_value)
-        else:
-            if dictionary_value is None or dictionary_value == "":
-                raise exceptions.InvalidQueryException(
-                    "This query has invalid keys or values.")
 
-    def check_dictionary(self, dictionary):
-        if not dictionary:
-            raise exceptions.InvalidQueryException(
-                "This query has invalid keys or values.")
+# Validation levels:
+# - full: endpoint rules plus a walk over every nested value
+# - structural: endpoint rules only (limits, required keys and types)
+# - off: no client side validation
+VALIDATION_FULL = 'full'
+VALIDATION_STRUCTURAL = 'structural'
+VALIDATION_OFF = 'off'
 
-        for key in dictionary:
-            if isinstance(key, dict):
-                dictionary_value = key.get('query')
-            else:
-                dictionary_value = dictionary[key]
-            self.check_dictionary_value(dictionary_value)
+VALIDATION_LEVELS = (VALIDATION_FULL, VALIDATION_STRUCTURAL, VALIDATION_OFF)
+
+_CONTAINERS = (dict, list)
 
-    def check_list(self, dictionary_list):
-        if not dictionary_list:
-            raise exceptions.InvalidQueryException(
-                "This query has invalid keys or values.")
 
-        for dictionary_value in dictionary_list:
-            self.check_dictionary_value(dictionary_value)
+def _invalid_values():
+    return exceptions.InvalidQueryException(
+        "This query has invalid keys or values.")
+
+
+def check_values(data):
+    """Check that no dictionary or list nested in data is empty and that no
+    value is None or an empty string.
+
+    The walk is iterative, so deep payloads don't hit the recursion limit,
+    and visits every value exactly once. When data is a list of queries,
+    only the 'query' of each one is checked.
+
+    Keyword arguments:
+    data(dict or list) -- A query or insertion
+    """
+    if not data:
+        raise _invalid_values()
+    if isinstance(data, dict):
+        stack = list(data.values())
+    else:
+        stack = [item.get('query') if isinstance(item, dict) else item
+                 for item in data]
+
+    pop = stack.pop
+    extend = stack.extend
+    while stack:
+        value = pop()
+        if isinstance(value, _CONTAINERS):
+            if not value:
+                raise _invalid_values()
+            if isinstance(value, dict):
+                value = value.values()
+            extend(value)
+        elif value is None or value == "":
+            raise _invalid_values()
+
+
+def check_level(level):
+    """Raise if level is not a known validation level"""
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(
+            "Unknown validation level '{0}', use one of: {1}.".format(
+                level, ", ".join(VALIDATION_LEVELS)))
+    return level
+
+
+class SDBaseValidator(object):
+    """Base column, query and insertion validator."""
+    __metaclass__ = abc.ABCMeta
 
-    def __init__(self, dictionary):
+    def __init__(self, dictionary, level=VALIDATION_FULL):
         if not dictionary:
-            raise exceptions.InvalidQueryException(
-                "This query has invalid keys or values.")
+            raise _invalid_values()
 
-        self.check_dictionary(dictionary)
+        if level == VALIDATION_FULL:
+            check_values(dictionary)
 
         self.data = dictionary
+        self.level = level
 
     @abc.abstractmethod
     def validator(self):
@@ -61,12 +111,13 @@ class SDBaseValidator(object):
 
 
 class SavedQueryValidator(SDBaseValidator):
-    def __init__(self, dictionary_query):
+    def __init__(self, dictionary_query, level=VALIDATION_FULL):
         """
         Parameters:
             dictionary_query(dict) -- A dict query
+            level(string) -- The validation level
         """
-        super(SavedQueryValidator, self).__init__(dictionary_query)
+        super(SavedQueryValidator, self).__init__(dictionary_query, level)
         self._list_query_types = [
             "count/entity", "count/event", "count/entity/total",
             "aggregation", "top_values"]
@@ -93,12 +144,13 @@ class SavedQueryValidator(SDBaseValidator):
 
 
 class QueryCountValidator(SDBaseValidator):
-    def __init__(self, queries):
+    def __init__(self, queries, level=VALIDATION_FULL):
         """
         Parameters:
             queries(dict) -- A dict query
+            level(string) -- The validation level
         """
-        super(QueryCountValidator, self).__init__(queries)
+        super(QueryCountValidator, self).__init__(queries, level)
 
     def validator(self):
         """
@@ -118,12 +170,13 @@ class QueryCountValidator(SDBaseValidator):
 
 
 class QueryValidator(SDBaseValidator):
-    def __init__(self, queries):
+    def __init__(self, queries, level=VALIDATION_FULL):
         """
         Parameters:
             queries(dict) -- A dict query
+            level(string) -- The validation level
         """
-        super(QueryValidator, self).__init__(queries)
+        super(QueryValidator, self).__init__(queries, level)
 
     def exceeds_queries_limit(self):
         """Check if query exceeds the limit of 5 queries per request
@@ -132,7 +185,8 @@ class QueryValidator(SDBaseValidator):
             true if exceeds the limit
             false otherwise
         """
-        if len(self.data) > 5:
+        query_size = sum(1 for key in self.data if key not in QUERY_OPTIONS)
+        if query_size > MAX_TOP_VALUES_QUERY_SIZE:
             return True
         return False
 
@@ -176,12 +230,13 @@ class QueryValidator(SDBaseValidator):
 
 
 class QueryDataExtractionValidator(SDBaseValidator):
-    def __init__(self, queries):
+    def __init__(self, queries, level=VALIDATION_FULL):
         """
         Parameters:
             queries(dict) -- A dict query
+            level(string) -- The validation level
         """
-        super(QueryDataExtractionValidator, self).__init__(queries)
+        super(QueryDataExtractionValidator, self).__init__(queries, level)
 
     def _valid_keys(self):
         """Validate a data extraction query
@@ -213,28 +268,34 @@ class QueryDataExtractionValidator(SDBaseValidator):
 
 
 class InsertValidator(SDBaseValidator):
-    def __init__(self, dictionary_to_insert):
+    def __init__(self, dictionary_to_insert, level=VALIDATION_FULL):
         """
         Parameters:
             dictionary_to_insert(dict) -- A dict query
+            level(string) -- The validation level
         """
-        super(InsertValidator, self).__init__(dictionary_to_insert)
+        # Entities are walked one by one in _has_empty_column, so the base
+        # class only checks the insertion is not empty
+        super(InsertValidator, self).__init__(
+            dictionary_to_insert, VALIDATION_STRUCTURAL)
+        self.level = level
 
     def _has_empty_column(self):
         """Check empty columns in dictionary
         Returns:
             false if dictionary don't have empty columns
         """
-        for value in self.data.values():
+        full = self.level == VALIDATION_FULL
+        for value in six.itervalues(self.data):
             # Value is a dictionary when it is an entity being inserted:
             # "my-entity": {"year": 2016}
             # It can also be a parameter, such as "auto-create":
             # "auto-create": ["dimension", "column"]
-            if not isinstance(
-                    value, (dict, list)) or value is None or len(
-                        str(value)) == 0:
+            if not isinstance(value, (dict, list)) or not value:
                 raise exceptions.WrongTypeException(
                     "The value for an id should be a dictionary")
+            if full:
+                check_values(value)
         return False
 
     def check_insertion_size(self):
@@ -255,25 +316,25 @@ class InsertValidator(SDBaseValidator):
         Returns:
             true if query is valid
         """
-        if not self._has_empty_column() and self.check_insertion_size():
+        if self.check_insertion_size() and not self._has_empty_column():
             return True
 
 
 class ColumnValidator(SDBaseValidator):
-    def __init__(self, data_column):
+    def __init__(self, data_column, level=VALIDATION_FULL):
         """
         Parameters:
             data_column -- A dict or list of columns
+            level(string) -- The validation level
         """
         if not isinstance(data_column, list):
             data_column = [data_column]
+        if not data_column:
+            raise _invalid_values()
         for dictionary_column in data_column:
-            super(ColumnValidator, self).__init__(dictionary_column)
-            self._valid_type_columns = [
-                "unique-id", "boolean", "string", "integer", "decimal",
-                "enumerated", "date", "integer-event",
-                "decimal-event", "string-event", "datetime"
-            ]
+            super(ColumnValidator, self).__init__(dictionary_column, level)
+        self.columns = data_column
+        self._valid_type_columns = COLUMN_TYPES
 
     def _validate_name(self):
         """Validate column name"""
@@ -336,16 +397,18 @@ class ColumnValidator(SDBaseValidator):
     def validator(self):
         """
         Returns:
-            true if new column is valid
+            true if every new column is valid
         """
-        self._validate_name()
-        self._validate_column_type()
-        if self.data['type'] == "string":
-            self._check_str_type_integrity()
-        if self.data['type'] == "enumerated":
-            self._validate_enumerate_type()
-        if 'description' in self.data:
-            self._validate_description()
-        if 'decimal-place' in self.data:
-            self._validate_column_decimal_type()
+        for column in self.columns:
+            self.data = column
+            self._validate_name()
+            self._validate_column_type()
+            if self.data['type'] == "string":
+                self._check_str_type_integrity()
+            if self.data['type'] == "enumerated":
+                self._validate_enumerate_type()
+            if 'description' in self.data:
+                self._validate_description()
+            if 'decimal-place' in self.data:
+                self._validate_column_decimal_type()
         return True
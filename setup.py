@@ -13,12 +13,15 @@ setup(
     author_email="help@slicingdice.com",
     description="Official Python client for SlicingDice, Data Warehouse and "
                 "Analytics Database as a Service.",
-    install_requires=["requests", "six", "ujson"],
+    install_requires=["requests", "six", "ujson",
+                      'futures; python_version < "3"'],
+    extras_require={"async": ["aiohttp>=3.10"], "numpy": ["numpy"]},
     license="BSD",
     keywords="slicingdice slicing dice data analysis analytics database",
     packages=[
         'pyslicer',
         'pyslicer.core',
+        'pyslicer.emulator',
         'pyslicer.utils',
     ],
     package_dir={'pyslicer': 'pyslicer'},
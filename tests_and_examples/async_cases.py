@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.async_client, against pyslicer.emulator.
+
+They are written with async and await, which Python 2 can't compile, so
+this module doesn't match the test_*.py pattern and is only imported by
+test_async_client on Python 3.
+"""
+
+import asyncio
+import socket
+import threading
+import time
+import unittest
+
+from pyslicer import SlicingDice, exceptions
+from pyslicer.async_client import AsyncSlicingDice
+from pyslicer.core.cache import CacheBackend, MemoryCacheBackend, QueryCache
+from pyslicer.emulator.server import EmulatorServer
+from tests_and_examples import test_data_extraction
+
+QUERY = [{'query-name': 'adults', 'query': [{'age': {'gte': 18}}]}]
+
+
+class SlowBackend(CacheBackend):
+    """A MemoryCacheBackend taking delay seconds per call, recording the
+    threads it was called from"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.memory = MemoryCacheBackend()
+        self.threads = set()
+
+    def _wait(self):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+
+    def get(self, key):
+        self._wait()
+        return self.memory.get(key)
+
+    def set(self, key, body, ttl):
+        self._wait()
+        self.memory.set(key, body, ttl)
+
+    def clear(self):
+        self._wait()
+        self.memory.clear()
+
+
+class AsyncClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorServer().start()
+        self.base_url = SlicingDice.BASE_URL
+        SlicingDice.BASE_URL = self.server.url
+        self.server.database.insert({'auto-create': ['column'],
+                                     'user1': {'age': 20},
+                                     'user2': {'age': 10}})
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        SlicingDice.BASE_URL = self.base_url
+        self.server.stop()
+
+    def run_client(self, coroutine, **options):
+        async def run():
+            async with AsyncSlicingDice(master_key='key', **options) as client:
+                return await coroutine(client)
+        return self.loop.run_until_complete(run())
+
+
+class CacheTest(AsyncClientTestCase):
+
+    def test_blocking_backends_run_off_the_event_loop(self):
+        backend = SlowBackend(0.1)
+        ticks = []
+
+        async def tick():
+            for _ in range(20):
+                ticks.append(None)
+                await asyncio.sleep(0.01)
+
+        async def count(client):
+            ticking = asyncio.ensure_future(tick())
+            first = await client.count_entity(QUERY)
+            second = await client.count_entity(QUERY)
+            await ticking
+            return first, second, client.last_response
+
+        first, second, info = self.run_client(
+            count, cache=QueryCache(backend=backend))
+        self.assertEqual(first['result'], {'adults': 1})
+        self.assertEqual(second['result'], {'adults': 1})
+        self.assertTrue(info.cached)
+        self.assertNotIn(threading.current_thread().name, backend.threads)
+        # A get, a set and a get took 0.3 seconds, the loop kept ticking
+        self.assertGreaterEqual(len(ticks), 15)
+
+    def test_writes_clear_the_cache(self):
+        async def insert_and_count(client):
+            await client.count_entity(QUERY)
+            await client.insert({'user3': {'age': 30}})
+            return await client.count_entity(QUERY)
+
+        result = self.run_client(
+            insert_and_count, cache=QueryCache(backend=SlowBackend(0)))
+        self.assertEqual(result['result'], {'adults': 2})
+
+
+class PendingTimesTest(AsyncClientTestCase):
+
+    def test_are_kept_per_task(self):
+        async def measure(client):
+            async def validated():
+                client._add_pending_time('validation_time', 1.0)
+                await asyncio.sleep(0.01)
+                return client._take_pending_times()
+
+            async def other():
+                await asyncio.sleep(0)
+                return client._take_pending_times()
+
+            return await asyncio.gather(validated(), other())
+
+        mine, others = self.run_client(measure)
+        self.assertEqual(mine, {'validation_time': 1.0})
+        self.assertEqual(others, {})
+
+
+class PoolOptionsTest(AsyncClientTestCase):
+
+    def test_requests_use_only_the_aiohttp_pool(self):
+        async def count(client):
+            await client.count_entity(QUERY)
+            return client._requester, client.pool_stats()
+
+        requester, stats = self.run_client(count, pool_maxsize=2)
+        self.assertIsNone(requester)
+        self.assertEqual(stats['maxsize'], 2)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_keep_alive_is_set_on_the_sockets(self):
+        sockets = []
+
+        async def count(client):
+            create_socket = client._create_socket
+
+            def record(addr_info):
+                sockets.append(create_socket(addr_info))
+                return sockets[-1]
+            client._create_socket = record
+            result = await client.count_entity(QUERY)
+            # Sockets are closed with the client
+            return result, [sock.getsockopt(
+                socket.SOL_SOCKET, socket.SO_KEEPALIVE) for sock in sockets]
+
+        result, keep_alive = self.run_client(count, keep_alive={'idle': 30})
+        self.assertEqual(result['result'], {'adults': 1})
+        self.assertEqual(len(keep_alive), 1)
+        self.assertTrue(keep_alive[0])
+
+    def test_pool_block_false_is_rejected(self):
+        with self.assertRaises(exceptions.SlicingDiceException):
+            AsyncSlicingDice(master_key='key', pool_block=False)
+
+
+class UnavailableTest(AsyncClientTestCase):
+
+    def test_thread_based_producers_raise(self):
+        client = AsyncSlicingDice(master_key='key')
+        with self.assertRaises(exceptions.SlicingDiceException):
+            client.insert_buffer()
+        with self.assertRaises(exceptions.SlicingDiceException):
+            client.insert_spool('/tmp/unused')
+
+
+class IterResultTest(test_data_extraction.DataExtractionTestCase):
+
+    def test_yields_the_entities_of_the_sync_client(self):
+        async def collect():
+            async with AsyncSlicingDice(master_key='key') as client:
+                return [entity async for entity in client.iter_result(
+                    test_data_extraction.QUERY, page_size=2,
+                    max_in_flight=2)]
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(
+                loop.run_until_complete(collect()),
+                test_data_extraction.IterResultTest.expected)
+        finally:
+            loop.close()
@@ -14,6 +14,9 @@ tested:
 In order to execute the tests, simply replace API_KEY by the demo API key and
 run the script with:
     $ python run_tests.py
+
+Set SD_EMULATOR=1 to run them offline against pyslicer.emulator instead. Tests
+using SQL the emulator doesn't support (error 3006) are then skipped.
 """
 
 import json
@@ -22,6 +25,9 @@ import sys
 import time
 import copy
 from pyslicer import SlicingDice
+from pyslicer.emulator.database import (ERROR_UNSUPPORTED_SQL,
+                                       EmulatedDatabase)
+from pyslicer.emulator.server import EmulatorServer
 from pyslicer.exceptions import SlicingDiceException
 
 # Suppress HTTPS warnings
@@ -30,10 +36,16 @@ from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
+# Dimensions of the demo database that the examples expect to exist
+DEMO_DIMENSIONS = ['users', 'jobs', 'delete-test']
+
 
 class SlicingDiceTester(object):
     per_test_insertion = False
     insert_sql_data = False
+    # Skip the tests failing with an unsupported SQL error of the emulator
+    skip_unsupported = False
+    _last_timestamp = 0
 
     """Test orchestration class."""
 
@@ -54,6 +66,7 @@ class SlicingDiceTester(object):
         self.num_successes = 0
         self.num_fails = 0
         self.failed_tests = []
+        self.num_skips = 0
 
         self.verbose = verbose
 
@@ -103,6 +116,12 @@ class SlicingDiceTester(object):
 
                 result = self.execute_query(_query_type, test)
             except SlicingDiceException as e:
+                if self.skip_unsupported and \
+                        str(e.code) == str(ERROR_UNSUPPORTED_SQL):
+                    self.num_skips += 1
+                    print('  Status: Skipped ({})'.format(e.message))
+                    print
+                    continue
                 result = {'result': {'error': str(e)}}
                 if query_type in ('delete', 'update'):
                     self.num_fails += 1
@@ -217,8 +236,12 @@ class SlicingDiceTester(object):
         Return:
         String with integer timestamp.
         """
-        # Appending integer timestamp including second decimals
-        return str(int(time.time() * 10))
+        # Appending integer timestamp including second decimals, kept unique
+        # when tests run faster than that
+        timestamp = max(int(time.time() * 10),
+                        SlicingDiceTester._last_timestamp + 1)
+        SlicingDiceTester._last_timestamp = timestamp
+        return str(timestamp)
 
     def get_columns_from_insertion_data(self, test):
         """Get all column names from inserted data and translate them.
@@ -464,15 +487,31 @@ def main():
         api_key=api_key,
         verbose=True)
 
+    emulator = None
+    if os.environ.get("SD_EMULATOR"):
+        emulator = EmulatorServer(
+            database=EmulatedDatabase(dimensions=DEMO_DIMENSIONS)).start()
+        SlicingDice.BASE_URL = emulator.url
+        # The SQL examples query data inserted beforehand in the demo
+        # database
+        sd_tester.insert_sql_data = True
+        sd_tester.skip_unsupported = True
+        sd_tester.sleep_time = 0
+
     try:
         for query_type in query_types:
             sd_tester.run_tests(query_type)
     except KeyboardInterrupt:
         pass
+    finally:
+        if emulator is not None:
+            emulator.stop()
 
     print('Results:')
     print('  Successes:', sd_tester.num_successes)
     print('  Fails:', sd_tester.num_fails)
+    if sd_tester.skip_unsupported:
+        print('  Skipped:', sd_tester.num_skips)
 
     for failed_test in sd_tester.failed_tests:
         print('    - {}'.format(failed_test))
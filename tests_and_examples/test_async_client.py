@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.async_client, see async_cases. They only run on
+Python 3, Python 2 can't compile async and await."""
+
+import unittest
+
+import six
+
+if six.PY3:
+    from tests_and_examples.async_cases import (  # noqa: F401
+        CacheTest, IterResultTest, PendingTimesTest, PoolOptionsTest,
+        UnavailableTest)
+
+
+if __name__ == '__main__':
+    unittest.main()
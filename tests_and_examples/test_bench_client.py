@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for benchmarks/bench_client.py."""
+
+import os
+import sys
+import unittest
+
+import ujson
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'benchmarks'))
+
+import bench_client  # noqa: E402
+from pyslicer.emulator.database import EmulatedDatabase  # noqa: E402
+
+
+class ExtractionBodyTest(unittest.TestCase):
+
+    def test_matches_the_response_of_the_emulator(self):
+        database = EmulatedDatabase()
+        database.insert(dict(
+            [('auto-create', ['column'])] +
+            list(bench_client.iter_extraction_entities(3, 10))))
+        expected = database.result({
+            'query': [{'segment': {'equals': 'bench'}}],
+            'columns': ['bio', 'score', 'segment']})
+        body = ujson.loads(bench_client.make_extraction_body(3, 10))
+        self.assertEqual(body['data'], expected['data'])
+
+
+class CompareTest(unittest.TestCase):
+
+    def test_reports_the_benchmarks_slower_than_the_threshold(self):
+        baseline = {'fast': {'seconds': 1.0}, 'slow': {'seconds': 1.0},
+                    'removed': {'seconds': 1.0}}
+        results = {'fast': {'seconds': 1.1}, 'slow': {'seconds': 1.2},
+                   'added': {'seconds': 9.0}}
+        self.assertEqual(
+            bench_client.compare(results, baseline, threshold=0.15),
+            ['slow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.cache."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+import zlib
+
+from pyslicer import SlicingDice
+from pyslicer.core.cache import (MemcachedCacheBackend, MemoryCacheBackend,
+                                 QueryCache, SQLiteCacheBackend)
+from pyslicer.emulator.server import EmulatorServer
+from pyslicer.url_resources import URLResources
+
+QUERY = [{'query-name': 'adults', 'query': [{'age': {'gte': 18}}]}]
+
+
+class FakeMemcache(object):
+    """A memcached client keeping values in a dictionary, recording the
+    calls made"""
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append('get')
+        return self.values.get(key)
+
+    def set(self, key, value, expire=0):
+        self.calls.append('set')
+        self.values[key] = value
+        self.expires[key] = expire
+
+    def add(self, key, value):
+        self.calls.append('add')
+        self.values.setdefault(key, value)
+
+    def incr(self, key, delta):
+        self.calls.append('incr')
+        if key not in self.values:
+            return None
+        self.values[key] = str(int(self.values[key]) + delta)
+        return int(self.values[key])
+
+
+class MemoryCacheBackendTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used_entries(self):
+        backend = MemoryCacheBackend(max_bytes=10)
+        backend.set('a', b'aaaa', 60)
+        backend.set('b', b'bbbb', 60)
+        backend.get('a')
+        backend.set('c', b'cccc', 60)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), b'aaaa')
+        self.assertEqual(backend.stats(), {'evictions': 1, 'entries': 2,
+                                           'bytes': 8})
+
+    def test_expired_entries_are_missing(self):
+        backend = MemoryCacheBackend()
+        backend.set('a', b'body', -1)
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.stats()['bytes'], 0)
+
+
+class SQLiteCacheBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def stored_bytes(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(
+                'SELECT COALESCE(SUM(LENGTH(body)), 0) FROM entries'
+            ).fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_running_size_follows_every_write(self):
+        backend = SQLiteCacheBackend(self.path)
+        backend.set('a', b'a' * 100, 60)
+        backend.set('b', os.urandom(100), 60)
+        backend.set('a', os.urandom(200), 60)
+        self.assertIsNotNone(backend.get('a'))
+        self.assertEqual(backend.stats(),
+                         {'entries': 2, 'bytes': self.stored_bytes()})
+        backend.set('c', b'c', -1)
+        backend.set('d', b'd', 60)
+        self.assertEqual(backend.stats()['bytes'], self.stored_bytes())
+        backend.clear()
+        self.assertEqual(backend.stats(), {'entries': 0, 'bytes': 0})
+
+    def test_evicts_when_too_large(self):
+        backend = SQLiteCacheBackend(self.path, max_bytes=1000)
+        for i in range(10):
+            backend.set(str(i), os.urandom(200), 60 + i)
+        stats = backend.stats()
+        self.assertLessEqual(stats['bytes'], 1000)
+        self.assertEqual(stats['bytes'], self.stored_bytes())
+        self.assertIsNotNone(backend.get('9'))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Needs os.fork")
+    def test_forked_processes_open_their_own_connection(self):
+        backend = SQLiteCacheBackend(self.path)
+        backend.set('parent', b'parent body', 60)
+        inherited = backend._connection()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                if backend._connection() is not inherited:
+                    backend.set('child', b'child body', 60)
+                    status = 0
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertIs(backend._connection(), inherited)
+        self.assertEqual(backend.get('child'), b'child body')
+        self.assertEqual(backend.get('parent'), b'parent body')
+
+    def test_is_shared_and_counts_files_of_earlier_versions(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            'CREATE TABLE entries ('
+            'key TEXT PRIMARY KEY, expires_at REAL, body BLOB)')
+        connection.execute('INSERT INTO entries VALUES (?, ?, ?)', (
+            'old', time.time() + 60,
+            sqlite3.Binary(zlib.compress(b'old body'))))
+        connection.commit()
+        connection.close()
+        first = SQLiteCacheBackend(self.path)
+        second = SQLiteCacheBackend(self.path)
+        self.assertEqual(second.get('old'), b'old body')
+        first.set('new', b'new body', 60)
+        self.assertEqual(second.get('new'), b'new body')
+        self.assertEqual(second.stats()['bytes'], self.stored_bytes())
+
+
+class MemcachedCacheBackendTest(unittest.TestCase):
+
+    def test_namespace_is_read_once_per_generation_ttl(self):
+        client = FakeMemcache()
+        backend = MemcachedCacheBackend(client, generation_ttl=60)
+        backend.set('a', b'body', 10)
+        self.assertEqual(backend.get('a'), b'body')
+        self.assertEqual(backend.get('b'), None)
+        self.assertEqual(client.calls,
+                         ['get', 'add', 'get', 'set', 'get', 'get'])
+
+    def test_clear_switches_namespace(self):
+        client = FakeMemcache()
+        backend = MemcachedCacheBackend(client, generation_ttl=60)
+        backend.set('a', b'body', 10)
+        backend.clear()
+        self.assertIsNone(backend.get('a'))
+
+    def test_clear_of_another_process_is_seen_after_generation_ttl(self):
+        client = FakeMemcache()
+        backend = MemcachedCacheBackend(client, generation_ttl=0.05)
+        other = MemcachedCacheBackend(client, generation_ttl=0.05)
+        backend.set('a', b'body', 10)
+        self.assertEqual(other.get('a'), b'body')
+        other.clear()
+        time.sleep(0.06)
+        self.assertIsNone(backend.get('a'))
+
+    def test_long_ttls_are_sent_as_timestamps(self):
+        client = FakeMemcache()
+        backend = MemcachedCacheBackend(client)
+        backend.set('short', b'body', 60.5)
+        backend.set('long', b'body', 31 * 24 * 60 * 60)
+        expires = dict((key.rsplit(':', 1)[1], expire)
+                       for key, expire in client.expires.items())
+        self.assertEqual(expires['short'], 61)
+        self.assertGreater(expires['long'], time.time())
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def test_equivalent_queries_share_a_key(self):
+        url = URLResources.QUERY_COUNT_ENTITY
+        key = QueryCache.make_key(url, 'key', 0, {'a': 1, 'b': [1, 2]})
+        self.assertEqual(
+            QueryCache.make_key(url, 'key', 0, {'b': [1, 2], 'a': 1}), key)
+        self.assertEqual(QueryCache.make_key(
+            url, 'key', 0, {'a': 1, 'b': [1, 2], 'bypass-cache': True}), key)
+        self.assertNotEqual(
+            QueryCache.make_key(url, 'other', 0, {'a': 1, 'b': [1, 2]}), key)
+        self.assertNotEqual(QueryCache.make_key(
+            URLResources.QUERY_COUNT_EVENT, 'key', 0, {'a': 1, 'b': [1, 2]}),
+            key)
+
+    def test_ttls(self):
+        cache = QueryCache(default_ttl=60,
+                           ttls={URLResources.QUERY_TOP_VALUES: 300})
+        self.assertEqual(cache.ttl_for(URLResources.QUERY_COUNT_ENTITY), 60)
+        self.assertEqual(cache.ttl_for(
+            'https://api.slicingdice.com/v1' + URLResources.QUERY_TOP_VALUES),
+            300)
+        self.assertEqual(cache.ttl_for(
+            URLResources.QUERY_COUNT_ENTITY,
+            [{'cache-period': 20}, {'cache-period': 10}, {}]), 10)
+
+    def test_zero_ttls_are_not_stored(self):
+        cache = QueryCache()
+        cache.set('a', b'body', 0)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class ClientCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorServer().start()
+        self.base_url = SlicingDice.BASE_URL
+        SlicingDice.BASE_URL = self.server.url
+        self.server.database.insert({'auto-create': ['column'],
+                                     'user1': {'age': 20}})
+        self.client = SlicingDice(master_key='key', cache=QueryCache())
+
+    def tearDown(self):
+        SlicingDice.BASE_URL = self.base_url
+        self.server.stop()
+
+    def count_requests(self):
+        return self.server.api.stats()['paths'].get(
+            URLResources.QUERY_COUNT_ENTITY, 0)
+
+    def test_repeated_queries_are_answered_from_the_cache(self):
+        first = self.client.count_entity(QUERY)
+        second = self.client.count_entity(QUERY)
+        self.assertEqual(first, second)
+        self.assertEqual(self.count_requests(), 1)
+        self.assertTrue(self.client.last_response.cached)
+
+    def test_bypass_cache_refreshes_the_entry(self):
+        self.client.count_entity(QUERY)
+        self.server.database.insert({'user2': {'age': 30}})
+        bypassing = [dict(QUERY[0], **{'bypass-cache': True})]
+        self.assertEqual(self.client.count_entity(bypassing)['result'],
+                         {'adults': 2})
+        self.assertEqual(self.client.count_entity(QUERY)['result'],
+                         {'adults': 2})
+        self.assertEqual(self.count_requests(), 2)
+
+    def test_writes_invalidate_the_cache(self):
+        self.client.count_entity(QUERY)
+        self.client.insert({'user2': {'age': 30}})
+        self.assertEqual(self.client.count_entity(QUERY)['result'],
+                         {'adults': 2})
+        self.assertEqual(self.count_requests(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
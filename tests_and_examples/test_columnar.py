@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.columnar."""
+
+import unittest
+
+from pyslicer import SlicingDice
+from pyslicer.core.columnar import ColumnarResult
+from pyslicer.emulator.server import EmulatorServer
+
+PAGE = {
+    'status': 'success', 'page': 1, 'next-page': None, 'took': 0.5,
+    'data': [
+        {'entity-id': 'user1', 'age': '30', 'salary': '10.5',
+         'active': 'true', 'name': 'alice'},
+        {'entity-id': 'user2', 'age': '17', 'active': 'false'},
+    ],
+}
+
+TYPES = {'age': 'integer', 'salary': 'decimal', 'active': 'boolean',
+         'name': 'string'}
+
+
+class AppendPageTest(unittest.TestCase):
+
+    def test_rows_are_keyed_by_their_entity_id(self):
+        columns = ColumnarResult(TYPES)
+        columns.append_page(PAGE)
+        self.assertEqual(columns.entity_ids, ['user1', 'user2'])
+        self.assertEqual(len(columns), 2)
+        self.assertNotIn('entity-id', columns.names)
+        self.assertEqual(columns.row('user2'), {'age': 17, 'active': False})
+
+    def test_text_values_of_typed_columns_are_parsed_into_arrays(self):
+        columns = ColumnarResult(TYPES)
+        columns.append_page(PAGE)
+        self.assertEqual(columns.column('age').tolist(), [30, 17])
+        self.assertEqual(columns.column('salary')[0], 10.5)
+        self.assertEqual(columns.mask('salary').tolist(), [0, 1])
+        self.assertEqual(columns.column('active').tolist(), [1, 0])
+        self.assertEqual(columns.column('name'), ['alice', None])
+
+    def test_unparsable_values_fall_back_to_a_list(self):
+        columns = ColumnarResult({'age': 'integer'})
+        columns.append_rows([{'age': '30'}, {'age': 'unknown'}])
+        self.assertEqual(columns.column('age'), [30, 'unknown'])
+
+    def test_sql_results_have_no_entity_ids(self):
+        columns = ColumnarResult()
+        columns.append_page({'result': [{'age': 30}, {'age': 17}]})
+        self.assertEqual(columns.column('age').tolist(), [30, 17])
+        self.assertEqual(columns.entity_ids, [])
+
+    def test_pages_add_up(self):
+        columns = ColumnarResult(TYPES)
+        columns.append_page(PAGE)
+        columns.append_page(PAGE)
+        self.assertEqual(columns.pages, 2)
+        self.assertEqual(columns.took, 1.0)
+        self.assertEqual(len(columns.column('age')), 4)
+
+
+class ResultColumnsTest(unittest.TestCase):
+
+    def test_follows_every_page_with_the_schema_types(self):
+        base_url = SlicingDice.BASE_URL
+        with EmulatorServer() as server:
+            SlicingDice.BASE_URL = server.url
+            try:
+                server.database.insert(dict(
+                    [('auto-create', ['column'])] +
+                    [('user{0}'.format(i), {'age': i}) for i in range(5)]))
+                client = SlicingDice(master_key='key')
+                columns = client.result_columns(
+                    {'query': [{'age': {'gte': 1}}], 'columns': ['age']},
+                    page_size=2)
+            finally:
+                SlicingDice.BASE_URL = base_url
+        self.assertEqual(columns.pages, 2)
+        self.assertEqual(columns.entity_ids,
+                         ['user1', 'user2', 'user3', 'user4'])
+        self.assertEqual(columns.column('age').tolist(), [1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
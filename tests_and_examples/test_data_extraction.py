@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the paginated data extraction of SlicingDice, against
+pyslicer.emulator."""
+
+import unittest
+
+from pyslicer import SlicingDice
+from pyslicer.emulator.server import EmulatorServer
+
+QUERY = {'query': [{'age': {'gte': 18}}], 'columns': ['age']}
+
+
+class DataExtractionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorServer().start()
+        self.base_url = SlicingDice.BASE_URL
+        SlicingDice.BASE_URL = self.server.url
+        self.server.database.insert(dict(
+            [('auto-create', ['column'])] +
+            [('user{0}'.format(i), {'age': 10 + i * 5}) for i in range(7)]))
+
+    def tearDown(self):
+        SlicingDice.BASE_URL = self.base_url
+        self.server.stop()
+
+
+class IterResultTest(DataExtractionTestCase):
+
+    expected = [('user{0}'.format(i), {'age': str(10 + i * 5)})
+                for i in range(2, 7)]
+
+    def test_yields_every_entity_of_every_page(self):
+        client = SlicingDice(master_key='key')
+        for max_in_flight in (1, 3):
+            entities = list(client.iter_result(
+                QUERY, page_size=2, max_in_flight=max_in_flight))
+            self.assertEqual(entities, self.expected)
+        self.assertEqual(self.server.api.stats()['requests'], 6)
+
+    def test_score_rows_keep_their_score(self):
+        client = SlicingDice(master_key='key')
+        entities = list(client.iter_score(QUERY, page_size=10))
+        self.assertEqual([entity_id for entity_id, _ in entities],
+                         [entity_id for entity_id, _ in self.expected])
+        self.assertTrue(all(columns['score'] == 1
+                            for _, columns in entities))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.utils.data_utils."""
+
+import gzip
+import io
+import unittest
+
+import six
+import ujson
+
+from pyslicer.utils.data_utils import gzip_compress
+
+
+def gunzip(data):
+    with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as stream:
+        return stream.read()
+
+
+class GzipCompressTest(unittest.TestCase):
+
+    def test_round_trips_serialized_body(self):
+        # ujson.dumps returns str, which is bytes on Python 2
+        body = ujson.dumps({'1': {'name': u'valu\xe9' * 10}})
+        expected = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.assertEqual(gunzip(gzip_compress(body)), expected)
+
+    def test_round_trips_bytes_over_several_chunks(self):
+        body = b'0123456789abcdef' * 1000
+        self.assertEqual(gunzip(gzip_compress(body, chunk_size=1000)), body)
+
+    def test_round_trips_text_over_several_chunks(self):
+        body = six.text_type(u'\xe7\xe3o-') * 500
+        self.assertEqual(gunzip(gzip_compress(body, chunk_size=7)),
+                         body.encode('utf-8'))
+
+    def test_empty_body(self):
+        self.assertEqual(gunzip(gzip_compress(b'')), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
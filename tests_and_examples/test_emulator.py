@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the data extraction, SQL and HTTP answers of
+pyslicer.emulator."""
+
+import unittest
+import zlib
+
+import ujson
+
+from pyslicer.emulator.database import (ERROR_BODY_SIZE, ERROR_INVALID_KEY,
+                                        ERROR_RATE_LIMIT,
+                                        ERROR_UNSUPPORTED_SQL,
+                                        EmulatedAPIError, EmulatedDatabase)
+from pyslicer.emulator.server import EmulatedAPI
+from pyslicer.emulator.sql import execute_sql
+from pyslicer.url_resources import URLResources
+from pyslicer.utils.data_utils import gzip_compress
+
+NOW = 1514764800.0  # 2018-01-01T00:00:00Z
+
+
+class EmulatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.database = EmulatedDatabase(now=lambda: NOW,
+                                         dimensions=['users'])
+        self.database.insert({
+            'auto-create': ['dimension', 'column'],
+            'User1': {'name': 'Alice', 'age': 30, 'dimension': 'users',
+                      'clicks': [
+                          {'value': 'Home', 'date': '2017-12-01T00:00:00Z'},
+                          {'value': 'Cart', 'date': '2017-12-20T00:00:00Z'}]},
+            'User2': {'name': 'Bob', 'age': 17, 'dimension': 'users',
+                      'clicks': [
+                          {'value': 'Home', 'date': '2017-12-05T00:00:00Z'}]},
+            'User3': {'name': 'Carol', 'age': 45, 'dimension': 'users'},
+        })
+
+    def sql(self, statement):
+        return execute_sql(self.database, statement)['result']
+
+
+class DataExtractionTest(EmulatorTestCase):
+
+    def test_rows_carry_their_entity_id(self):
+        response = self.database.result({
+            'query': [{'age': {'gte': 18}}], 'columns': ['name', 'age'],
+            'dimension': 'users'})
+        self.assertEqual(response['data'], [
+            {'entity-id': 'user1', 'name': 'alice', 'age': '30'},
+            {'entity-id': 'user3', 'name': 'carol', 'age': '45'}])
+
+    def test_event_columns_give_the_latest_event_in_range(self):
+        response = self.database.result({
+            'query': [{'entity-id': {'equals': 'USER1'}}],
+            'columns': [{'clicks': ['2017-12-01T00:00:00Z',
+                                    '2017-12-10T00:00:00Z']}],
+            'dimension': 'users'})
+        self.assertEqual(response['data'], [
+            {'entity-id': 'user1',
+             'clicks': {'value': 'home', 'date': '2017-12-01T00:00:00Z'}}])
+
+    def test_score_counts_conditions_and_groups(self):
+        response = self.database.score({
+            'query': [
+                [{'name': {'equals': 'alice'}}, 'and', {'age': {'gte': 18}}],
+                'or', {'age': {'gte': 18}},
+                'or', {'name': {'equals': 'ALICE'}}],
+            'columns': [], 'dimension': 'users'})
+        self.assertEqual(response['data'], [
+            {'entity-id': 'user1', 'score': 3},
+            {'entity-id': 'user3', 'score': 1}])
+
+    def test_pages(self):
+        query = {'query': [{'age': {'gte': 0}}], 'columns': [], 'limit': 2,
+                 'dimension': 'users'}
+        first = self.database.result(query)
+        query['page'] = first['next-page']
+        second = self.database.result(query)
+        self.assertEqual([row['entity-id'] for row in first['data']],
+                         ['user1', 'user2'])
+        self.assertEqual(second['data'], [{'entity-id': 'user3'}])
+        self.assertIsNone(second['next-page'])
+
+
+class SQLTest(EmulatorTestCase):
+
+    def test_select_star(self):
+        self.assertEqual(self.sql("SELECT * FROM users WHERE age > 40"), [
+            {'entity-id': 'user3', 'name': 'carol', 'age': 45,
+             'score': 1.0}])
+        self.assertEqual(
+            self.sql("SELECT users.* FROM users WHERE users.age > 40"),
+            self.sql("SELECT * FROM users WHERE age > 40"))
+
+    def test_not_in_and_not_like(self):
+        self.assertEqual(
+            self.sql("SELECT [entity-id] FROM users "
+                     "WHERE name NOT IN ('alice', 'bob')"),
+            [{'entity-id': 'user3'}])
+        self.assertEqual(
+            self.sql("SELECT name FROM users WHERE NOT name LIKE 'a%' "
+                     "AND name NOT LIKE '%ro%'"),
+            [{'name': 'bob'}])
+
+    def test_aggregations_with_aliases(self):
+        self.assertEqual(
+            self.sql("SELECT COUNT(*), AVG(age) AS mean, MAX(age) "
+                     "FROM users"),
+            [{'COUNT': 3, 'mean': 30.666667, 'MAX': 45}])
+
+    def test_group_by_event_values_in_having_range(self):
+        self.assertEqual(
+            self.sql("SELECT [clicks.value], COUNT(*) FROM users "
+                     "GROUP BY [clicks.value] HAVING [clicks.date] "
+                     "BETWEEN '2017-12-01T00:00:00Z' AND "
+                     "'2017-12-10T00:00:00Z'"),
+            [{'clicks.value': 'home', 'COUNT': 2}])
+
+    def test_case_and_order(self):
+        self.assertEqual(
+            self.sql("SELECT name, CASE WHEN age >= 18 THEN 'adult' "
+                     "ELSE 'minor' END AS kind FROM users "
+                     "ORDER BY kind, age DESC LIMIT 2"),
+            [{'name': 'carol', 'kind': 'adult'},
+             {'name': 'alice', 'kind': 'adult'}])
+
+    def test_unsupported_sql_is_reported(self):
+        for statement in (
+                "SELECT COUNT(*) FROM users WHERE DATEPART(year, age) = 1",
+                "SELECT COUNT(*) FROM users GROUP BY INTERVAL(clicks)",
+                "SELECT name FROM users HAVING COUNT(*) > 1"):
+            with self.assertRaises(EmulatedAPIError) as context:
+                execute_sql(self.database, statement)
+            self.assertEqual(context.exception.code, ERROR_UNSUPPORTED_SQL)
+
+
+class EmulatedAPITest(unittest.TestCase):
+
+    def post(self, api, path, data, key='key', headers=None):
+        headers = dict(headers or {}, Authorization=key)
+        body = data if isinstance(data, bytes) else \
+            ujson.dumps(data).encode('utf-8')
+        status, response_headers, content = api.handle(
+            'POST', '/v1' + path, headers, body)
+        if response_headers.get('Content-Encoding') == 'gzip':
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        return status, response_headers, ujson.loads(content)
+
+    def error_code(self, response):
+        return response[2]['errors'][0]['code']
+
+    def test_keys_are_checked_by_level(self):
+        api = EmulatedAPI(api_keys={'reader': 0, 'master': 2})
+        insert = {'auto-create': ['column'], 'user1': {'age': 1}}
+        response = self.post(api, URLResources.INSERT, insert, 'reader')
+        self.assertEqual(response[0], 401)
+        self.assertEqual(self.error_code(response), ERROR_INVALID_KEY)
+        self.assertEqual(
+            self.post(api, URLResources.INSERT, insert, 'master')[0], 200)
+        self.assertEqual(self.post(
+            api, URLResources.QUERY_COUNT_ENTITY_TOTAL, {}, 'reader')[2][
+                'result'], {'total': 1})
+
+    def test_errors_leave_the_database_unchanged(self):
+        api = EmulatedAPI(max_body_bytes=100)
+        api.inject_errors(ERROR_RATE_LIMIT)
+        insert = {'auto-create': ['column'], 'user1': {'age': 1}}
+        status, headers, _ = self.post(api, URLResources.INSERT, insert)
+        self.assertEqual((status, headers['Retry-After']), (429, '1'))
+        response = self.post(api, URLResources.INSERT,
+                             dict(insert, user2={'bio': 'x' * 100}))
+        self.assertEqual(self.error_code(response), ERROR_BODY_SIZE)
+        self.assertEqual(api.database.count_entity_total()['result'],
+                         {'total': 0})
+        stats = api.stats()
+        self.assertEqual((stats['requests'], stats['errors'],
+                          stats['injected_errors']), (2, 2, 1))
+
+    def test_throughput_limits_answer_retry_after(self):
+        api = EmulatedAPI(requests_per_second=1)
+        path = URLResources.QUERY_COUNT_ENTITY_TOTAL
+        self.assertEqual(self.post(api, path, {})[0], 200)
+        status, headers, _ = self.post(api, path, {})
+        self.assertEqual((status, headers['Retry-After']), (429, '1'))
+        self.assertEqual(api.stats()['throttled'], 1)
+
+    def test_gzip_bodies(self):
+        api = EmulatedAPI(gzip_responses=True)
+        insert = ujson.dumps({'auto-create': ['column'],
+                              'user1': {'age': 1}}).encode('utf-8')
+        status, _, _ = self.post(
+            api, URLResources.INSERT, gzip_compress(insert),
+            headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(status, 200)
+        status, headers, response = self.post(
+            api, URLResources.QUERY_COUNT_ENTITY_TOTAL, {},
+            headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response['result'], {'total': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
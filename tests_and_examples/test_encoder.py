@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.encoder."""
+
+import datetime
+import unittest
+
+import ujson
+
+from pyslicer import exceptions
+from pyslicer.core import encoder
+from pyslicer.core.encoder import RowEncoder
+from pyslicer.utils import validators
+
+TYPES = {'id': 'unique-id', 'active': 'boolean', 'name': 'string',
+         'age': 'integer', 'score': 'decimal', 'state': 'enumerated',
+         'born': 'date', 'seen': 'datetime', 'clicks': 'integer-event',
+         'spent': 'decimal-event', 'pages': 'string-event'}
+
+
+def decode(fragment):
+    return ujson.loads('{' + fragment + '}')
+
+
+class ColumnTypesTest(unittest.TestCase):
+
+    def test_every_column_type_has_an_encoder(self):
+        self.assertEqual(set(encoder._ENCODERS),
+                         set(validators.COLUMN_TYPES))
+
+    def test_types_without_encoder_fail(self):
+        self.assertEqual(encoder._encoder_of('integer'),
+                         encoder._encode_integer)
+        for column_type in ('geolocation', 'geolocation-event'):
+            with self.assertRaises(exceptions.InvalidColumnTypeException):
+                encoder._encoder_of(column_type)
+
+
+class RowEncoderTest(unittest.TestCase):
+
+    def test_encodes_every_type(self):
+        row_encoder = RowEncoder(sorted(TYPES), TYPES)
+        values = dict(
+            id='u1', active=True, name=u'Jo\xe3o', age=22, score=1.5,
+            state='RJ', born=datetime.datetime(1990, 5, 1, 10, 30),
+            seen=datetime.datetime(2018, 1, 2, 3, 4, 5),
+            clicks=[(1, '2018-01-01T00:00:00Z'),
+                    {'value': 2, 'date': datetime.date(2018, 1, 2)}],
+            spent=(2.5, 'now'), pages=None)
+        fragment = row_encoder.encode(
+            'user1', [values[name] for name in sorted(TYPES)])
+        self.assertEqual(decode(fragment), {'user1': {
+            'id': 'u1', 'active': True, 'name': u'Jo\xe3o', 'age': 22,
+            'score': 1.5, 'state': 'RJ', 'born': '1990-05-01',
+            'seen': '2018-01-02T03:04:05',
+            'clicks': [{'value': 1, 'date': '2018-01-01T00:00:00Z'},
+                       {'value': 2, 'date': '2018-01-02'}],
+            'spent': {'value': 2.5, 'date': 'now'}}})
+
+    def test_wrong_values_are_rejected(self):
+        for name, value in (('age', True), ('age', 1.5), ('score', 'x'),
+                            ('score', float('nan')), ('active', 1),
+                            ('name', ''), ('clicks', []),
+                            ('clicks', {'value': 1}),
+                            ('clicks', ('a', 'now'))):
+            row_encoder = RowEncoder([name], TYPES)
+            with self.assertRaises(exceptions.WrongTypeException):
+                row_encoder.encode('user1', [value])
+
+    def test_unchecked_values_are_serialized_as_they_are(self):
+        row_encoder = RowEncoder(['age', 'born'], TYPES, check_types=False)
+        self.assertEqual(
+            decode(row_encoder.encode(
+                'user1', ['22', datetime.date(2018, 1, 2)])),
+            {'user1': {'age': '22', 'born': '2018-01-02'}})
+
+    def test_invalid_columns_are_rejected(self):
+        with self.assertRaises(exceptions.InvalidColumnException):
+            RowEncoder(['missing'], TYPES)
+        with self.assertRaises(exceptions.InvalidColumnTypeException):
+            RowEncoder(['where'], {'where': 'geolocation'})
+        with self.assertRaises(exceptions.InvalidInsertException):
+            RowEncoder(['age', 'age'], TYPES)
+        row_encoder = RowEncoder(['age', 'name'], TYPES)
+        with self.assertRaises(exceptions.InvalidInsertException):
+            row_encoder.encode('user1', [1])
+        with self.assertRaises(exceptions.InvalidInsertException):
+            row_encoder.encode('user1', [None, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
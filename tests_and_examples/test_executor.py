@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.executor."""
+
+import threading
+import time
+import unittest
+
+from pyslicer.core.executor import ordered_map
+
+
+class OrderedMapTest(unittest.TestCase):
+
+    def test_results_keep_the_submission_order(self):
+        def slow_for_small(item):
+            time.sleep(0.01 * (10 - item))
+            return item * 2
+
+        for max_workers in (1, 4):
+            self.assertEqual(
+                list(ordered_map(slow_for_small, range(10), max_workers)),
+                [item * 2 for item in range(10)])
+
+    def test_items_are_pulled_only_when_there_is_room(self):
+        pulled = []
+        lock = threading.Lock()
+
+        def items():
+            for item in range(100):
+                with lock:
+                    pulled.append(item)
+                yield item
+
+        results = ordered_map(lambda item: item, items(), 2, max_pending=3)
+        self.assertEqual(next(results), 0)
+        self.assertLessEqual(len(pulled), 4)
+        self.assertEqual(list(results), list(range(1, 100)))
+
+    def test_errors_are_raised_at_their_result(self):
+        def fail_on_three(item):
+            if item == 3:
+                raise ValueError(item)
+            return item
+
+        results = ordered_map(fail_on_three, range(6), 3)
+        self.assertEqual([next(results) for _ in range(3)], [0, 1, 2])
+        with self.assertRaises(ValueError):
+            next(results)
+
+
+if __name__ == '__main__':
+    unittest.main()
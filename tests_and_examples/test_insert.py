@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the batched inserts of SlicingDice, against
+pyslicer.emulator."""
+
+import time
+import unittest
+
+import ujson
+
+from pyslicer import SlicingDice, exceptions
+from pyslicer.core.schema import SchemaCache
+from pyslicer.emulator.database import ERROR_BODY_SIZE
+from pyslicer.emulator.server import EmulatorServer
+from pyslicer.url_resources import URLResources
+
+
+class InsertTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorServer().start()
+        self.base_url = SlicingDice.BASE_URL
+        SlicingDice.BASE_URL = self.server.url
+
+    def tearDown(self):
+        SlicingDice.BASE_URL = self.base_url
+        self.server.stop()
+
+    def total(self):
+        return self.server.database.count_entity_total()['result']['total']
+
+    def insert_requests(self):
+        return self.server.api.stats()['paths'].get(URLResources.INSERT, 0)
+
+
+class BulkInsertTest(InsertTestCase):
+
+    def test_generators_are_split_into_batches(self):
+        client = SlicingDice(master_key='key')
+        entities = (('user{0}'.format(i), {'age': i}) for i in range(2500))
+        responses = client.bulk_insert(entities, auto_create=['column'])
+        self.assertEqual(len(responses), 3)
+        self.assertTrue(all(response['status'] == 'success'
+                            for response in responses))
+        self.assertEqual(self.total(), 2500)
+
+    def test_batches_stay_under_max_batch_bytes(self):
+        client = SlicingDice(master_key='key')
+        entities = dict(('user{0}'.format(i), {'bio': 'x' * 1000})
+                        for i in range(20))
+        entities['auto-create'] = ['column']
+        responses = client.bulk_insert(entities, max_batch_bytes=5000)
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(self.insert_requests(), 5)
+        self.assertEqual(self.total(), 20)
+
+    def test_invalid_entities_are_rejected_before_sending(self):
+        client = SlicingDice(master_key='key')
+        with self.assertRaises(exceptions.InvalidInsertException):
+            client.bulk_insert([('user1', {'bio': 'x' * 100})],
+                               max_batch_bytes=50)
+        with self.assertRaises(exceptions.WrongTypeException):
+            client.bulk_insert([('user1', 'not columns')])
+        self.assertEqual(self.insert_requests(), 0)
+
+
+class InsertManyTest(InsertTestCase):
+
+    def batches(self, count):
+        for i in range(count):
+            yield {'auto-create': ['column'],
+                   'user{0}'.format(i): {'age': i}}
+
+    def test_batches_are_sent_concurrently_in_order(self):
+        self.server.api.latency = 0.1
+        client = SlicingDice(master_key='key', max_workers=4)
+        started = time.time()
+        responses = client.insert_many(self.batches(8))
+        # Sent one at a time, they would take 0.8 seconds
+        self.assertLess(time.time() - started, 0.6)
+        self.assertEqual(len(responses), 8)
+        self.assertEqual(self.total(), 8)
+
+    def test_errors_are_raised(self):
+        client = SlicingDice(master_key='key', max_workers=2)
+        self.server.api.inject_errors(ERROR_BODY_SIZE)
+        with self.assertRaises(
+                exceptions.RequestBodySizeExceededException):
+            client.insert_many(self.batches(4))
+
+
+class InsertRowsTest(InsertTestCase):
+
+    def column_requests(self):
+        return self.server.api.stats()['paths'].get(URLResources.COLUMN, 0)
+
+    def test_rows_of_columns_created_by_the_client(self):
+        for key, name in (('master_key', 'age'), ('write_key', 'level')):
+            client = SlicingDice(**{key: 'key'})
+            if key == 'master_key':
+                client.load_schema()
+            client.create_column({'name': name.title(), 'type': 'integer'})
+            responses = client.insert_rows(
+                [('user1', (1,)), ('user2', (2,))], [name])
+            self.assertEqual(responses[0]['status'], 'success')
+        self.assertEqual(self.total(), 2)
+        # The api-names come from the create_column responses, the schema
+        # loaded before isn't loaded again
+        self.assertEqual(self.column_requests(), 3)
+
+    def test_unnamed_columns_reload_the_schema(self):
+        client = SlicingDice(master_key='key')
+        client.load_schema()
+        self.server.database.create_column({'name': 'Age', 'type': 'integer'})
+        client.schema.add({'name': 'Age', 'type': 'integer'})
+        self.assertTrue(client.schema.stale)
+        client.insert_rows([('user1', (1,))], ['age'])
+        self.assertFalse(client.schema.stale)
+        self.assertEqual(self.total(), 1)
+
+
+class SchemaCacheTest(unittest.TestCase):
+
+    def test_created_columns_are_named_by_the_response(self):
+        schema = SchemaCache()
+        schema.add([{'name': 'Age', 'type': 'integer'},
+                    {'api-name': 'name', 'type': 'string'}],
+                   {'status': 'success', 'api-names': ['age', 'name']})
+        self.assertEqual(schema.types(), {'age': 'integer',
+                                          'name': 'string'})
+        self.assertFalse(schema.stale)
+        schema.add({'name': 'City', 'type': 'string'}, {'status': 'success'})
+        self.assertTrue(schema.stale)
+        schema.load({'active': [{'api-name': 'city', 'type': 'string'}]})
+        self.assertFalse(schema.stale)
+
+
+class CompressTest(InsertTestCase):
+
+    def test_large_bodies_are_sent_compressed(self):
+        client = SlicingDice(master_key='key', compress=True,
+                             compress_min_size=1024)
+        data = dict(('user{0}'.format(i), {'bio': 'the same bio ' * 20})
+                    for i in range(50))
+        data['auto-create'] = ['column']
+        client.insert(data)
+        self.assertEqual(self.total(), 50)
+        # Over 13000 bytes uncompressed
+        self.assertLess(self.server.api.stats()['bytes_received'], 2000)
+
+    def test_small_bodies_are_sent_as_they_are(self):
+        client = SlicingDice(master_key='key', compress=True,
+                             compress_min_size=1024)
+        data = {'auto-create': ['column'], 'user1': {'age': 1}}
+        client.insert(data)
+        self.assertEqual(self.server.api.stats()['bytes_received'],
+                         len(ujson.dumps(data)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.insert_buffer."""
+
+import threading
+import unittest
+
+import ujson
+
+from pyslicer import SlicingDice, exceptions
+from pyslicer.core.insert_buffer import merge_columns
+
+
+class RecordingClient(SlicingDice):
+    """A client recording the insert bodies it sends instead of sending
+    them, failing with the queued errors first. While gate is cleared,
+    requests wait for it to be set."""
+
+    def __init__(self, errors=(), **options):
+        super(RecordingClient, self).__init__(master_key='key', **options)
+        self.errors = list(errors)
+        self.bodies = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.lock = threading.Lock()
+
+    def _send_insert_body(self, body):
+        self.gate.wait()
+        with self.lock:
+            if self.errors:
+                raise self.errors.pop(0)
+            self.bodies.append(ujson.loads(body))
+        return {'status': 'success'}
+
+    def entity_ids(self):
+        return [entity_id for body in self.bodies for entity_id in body
+                if entity_id != 'auto-create']
+
+
+def api_error(code):
+    return exceptions.SlicingDiceException(code=code, message='error')
+
+
+class BatchingTest(unittest.TestCase):
+
+    def test_sends_full_batches_and_flushes_the_rest(self):
+        client = RecordingClient()
+        with client.insert_buffer(linger_ms=10000, max_batch_size=2,
+                                  auto_create=['column']) as buffer:
+            for i in range(5):
+                buffer.add('user{0}'.format(i), {'age': i})
+            self.assertTrue(buffer.flush(timeout=5))
+            self.assertEqual(buffer.pending, 0)
+        self.assertEqual(sorted(len(body) for body in client.bodies),
+                         [2, 3, 3])
+        self.assertEqual(sorted(client.entity_ids()),
+                         ['user{0}'.format(i) for i in range(5)])
+        self.assertTrue(all(body['auto-create'] == ['column']
+                            for body in client.bodies))
+
+    def test_writes_to_an_entity_are_sent_in_order(self):
+        client = RecordingClient(max_workers=4)
+        with client.insert_buffer(linger_ms=0, max_batch_size=1) as buffer:
+            for i in range(20):
+                buffer.add('user', {'age': i})
+        self.assertEqual([body['user']['age'] for body in client.bodies],
+                         list(range(20)))
+
+
+class BackPressureTest(unittest.TestCase):
+
+    def test_coalesced_writes_wait_for_room(self):
+        client = RecordingClient()
+        client.gate.clear()
+        buffer = client.insert_buffer(
+            linger_ms=0, max_in_flight=1, coalesce=True, max_block=0.05,
+            max_buffered_bytes=60)
+        try:
+            # The first batch waits on the gate, the next writes stay
+            # pending and are merged
+            buffer.add('first', {'age': 1})
+            buffer.add('user', {'name': 'x' * 20})
+            with self.assertRaises(exceptions.InsertBufferFullException):
+                for _ in range(5):
+                    buffer.add('user', {'name': 'x' * 20})
+            self.assertLessEqual(buffer.stats()['coalesced'], 1)
+        finally:
+            client.gate.set()
+            buffer.close()
+
+    def test_callback_can_add_with_one_batch_in_flight(self):
+        client = RecordingClient()
+        added = []
+
+        def callback(result):
+            for entity_id in result.entity_ids:
+                if not entity_id.startswith('retry-'):
+                    buffer.add('retry-' + entity_id, {'age': 1})
+                    added.append(entity_id)
+
+        buffer = client.insert_buffer(
+            linger_ms=0, max_batch_size=1, max_in_flight=1,
+            max_buffered_bytes=40, max_block=5, callback=callback)
+        with buffer:
+            for i in range(10):
+                buffer.add('user{0}'.format(i), {'age': i})
+            self.assertTrue(buffer.flush(timeout=5))
+            self.assertTrue(buffer.flush(timeout=5))
+        self.assertEqual(len(added), 10)
+        self.assertEqual(len(client.entity_ids()), 20)
+
+
+class ErrorTest(unittest.TestCase):
+
+    def test_flush_raises_the_error_of_a_single_failure(self):
+        client = RecordingClient(errors=[api_error(1502)])
+        buffer = client.insert_buffer(linger_ms=0)
+        buffer.add('user', {'age': 1})
+        with self.assertRaises(exceptions.SlicingDiceException) as context:
+            buffer.flush()
+        self.assertEqual(context.exception.code, 1502)
+        buffer.close()
+
+    def test_flush_raises_every_error_of_several_failures(self):
+        errors = [api_error(1502), api_error(2012), api_error(2013)]
+        client = RecordingClient(errors=list(errors))
+        buffer = client.insert_buffer(linger_ms=0, max_batch_size=1)
+        for i in range(4):
+            buffer.add('user{0}'.format(i), {'age': i})
+        with self.assertRaises(
+                exceptions.InsertBatchesFailedException) as context:
+            buffer.flush()
+        self.assertEqual(
+            sorted(error.code for error in context.exception.errors),
+            [1502, 2012, 2013])
+        self.assertEqual(len(client.bodies), 1)
+        # Errors are raised once
+        self.assertTrue(buffer.flush())
+        buffer.close()
+        self.assertEqual(buffer.stats()['failed_batches'], 3)
+
+    def test_callback_receives_failures_instead(self):
+        client = RecordingClient(errors=[api_error(1502)])
+        results = []
+        with client.insert_buffer(linger_ms=0,
+                                  callback=results.append) as buffer:
+            buffer.add('user', {'age': 1})
+        self.assertEqual(len(results), 1)
+        self.assertFalse(results[0].succeeded)
+        self.assertEqual(results[0].entity_ids, ['user'])
+
+    def test_flush_errors_raise_when_leaving_the_block(self):
+        client = RecordingClient(errors=[api_error(1502)])
+        with self.assertRaises(exceptions.SlicingDiceException) as context:
+            with client.insert_buffer(linger_ms=0) as buffer:
+                buffer.add('user', {'age': 1})
+        self.assertEqual(context.exception.code, 1502)
+
+    def test_errors_of_the_block_are_not_replaced(self):
+        client = RecordingClient(errors=[api_error(1502)])
+        with self.assertRaises(ValueError):
+            with client.insert_buffer(linger_ms=0) as buffer:
+                buffer.add('user', {'age': 1})
+                raise ValueError('error in the block')
+        self.assertEqual(buffer.stats()['failed_batches'], 1)
+        with self.assertRaises(exceptions.InsertBufferClosedException):
+            buffer.add('user', {'age': 1})
+
+    def test_add_after_close_raises(self):
+        client = RecordingClient()
+        buffer = client.insert_buffer()
+        buffer.close()
+        with self.assertRaises(exceptions.InsertBufferClosedException):
+            buffer.add('user', {'age': 1})
+
+
+class MergeColumnsTest(unittest.TestCase):
+
+    def test_latest_values_replace_and_events_are_appended(self):
+        event = {'value': 1, 'date': 'now'}
+        target = {'age': 1, 'clicks': event, 'tags': ['a']}
+        merge_columns(target, {'age': 2, 'clicks': [event, event],
+                               'tags': ['b'], 'name': 'x'})
+        self.assertEqual(target, {'age': 2, 'clicks': [event] * 3,
+                                  'tags': ['a', 'b'], 'name': 'x'})
+
+    def test_list_columns_keep_every_value(self):
+        target = {'tag': 'a'}
+        merge_columns(target, {'tag': 'b'}, list_columns=('tag',))
+        self.assertEqual(target, {'tag': ['a', 'b']})
+
+    def test_lists_of_earlier_writes_are_not_changed(self):
+        first = ['a']
+        target = {'tags': first}
+        owned = set()
+        merge_columns(target, {'tags': ['b']}, owned=owned)
+        merge_columns(target, {'tags': ['c']}, owned=owned)
+        self.assertEqual(first, ['a'])
+        self.assertEqual(target['tags'], ['a', 'b', 'c'])
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def test_writes_to_a_pending_entity_are_merged(self):
+        client = RecordingClient()
+        client.schema.load({'active': [
+            {'api-name': 'tag', 'type': 'string',
+             'storage': 'list-of-values'}]})
+        with client.insert_buffer(linger_ms=10000, coalesce=True) as buffer:
+            buffer.add('user1', {'age': 1, 'tag': 'a'})
+            buffer.add('user1', {'age': 2, 'tag': 'b'})
+            buffer.add('user1', {'dimension': 'other', 'age': 3})
+            buffer.add('user2', {'age': 4})
+            stats = buffer.stats()
+        # Writes to another dimension are separate entities
+        self.assertEqual(client.bodies, [
+            {'user1': {'age': 2, 'tag': ['a', 'b']}, 'user2': {'age': 4}},
+            {'user1': {'dimension': 'other', 'age': 3}}])
+        self.assertEqual((stats['writes'], stats['coalesced']), (4, 1))
+        self.assertAlmostEqual(stats['coalescing_ratio'], 4 / 3.0)
+
+    def test_writes_are_not_merged_by_default(self):
+        client = RecordingClient()
+        with client.insert_buffer(linger_ms=10000) as buffer:
+            buffer.add('user1', {'age': 1})
+            buffer.add('user1', {'age': 2})
+        self.assertEqual(client.entity_ids(), ['user1', 'user1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.metrics and the request hooks, against
+pyslicer.emulator."""
+
+import random
+import socket
+import unittest
+
+from pyslicer import SlicingDice, exceptions
+from pyslicer.core.cache import QueryCache
+from pyslicer.core.instrumentation import (RequestEvent, RequestHook,
+                                           endpoint_of)
+from pyslicer.core.metrics import (Histogram, MetricsCollector,
+                                   PrometheusExporter, StatsDExporter)
+from pyslicer.emulator.database import ERROR_RATE_LIMIT
+from pyslicer.emulator.server import EmulatorServer
+from pyslicer.url_resources import URLResources
+
+QUERY = [{'query-name': 'adults', 'query': [{'age': {'gte': 18}}]}]
+
+
+class RecordingHook(RequestHook):
+
+    def __init__(self):
+        self.before = []
+        self.after = []
+
+    def before_request(self, event):
+        self.before.append(event.endpoint)
+
+    def after_request(self, event):
+        self.after.append(event)
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_percentiles_keep_the_significant_figures(self):
+        rng = random.Random(7)
+        values = sorted(rng.uniform(0.001, 10) for _ in range(10000))
+        histogram = Histogram(significant_figures=2)
+        for value in values:
+            histogram.record(value)
+        for percent in (50, 90, 99):
+            expected = values[int(percent / 100.0 * len(values)) - 1]
+            self.assertAlmostEqual(histogram.percentile(percent), expected,
+                                   delta=expected * 0.01)
+        self.assertEqual(histogram.max, values[-1])
+        self.assertLessEqual(histogram.percentile(100), values[-1])
+        self.assertEqual(histogram.count, 10000)
+
+    def test_empty_summary(self):
+        self.assertEqual(Histogram().summary((50,)), {
+            'count': 0, 'sum': 0.0, 'min': None, 'max': None, 'p50': None})
+
+
+class EndpointTest(unittest.TestCase):
+
+    def test_saved_queries_share_an_endpoint(self):
+        self.assertEqual(
+            endpoint_of('https://api.slicingdice.com/v1' +
+                        URLResources.QUERY_SAVED + 'my-query'),
+            URLResources.QUERY_SAVED)
+        self.assertEqual(
+            endpoint_of('https://api.slicingdice.com/v1' +
+                        URLResources.QUERY_COUNT_ENTITY_TOTAL),
+            URLResources.QUERY_COUNT_ENTITY_TOTAL)
+
+
+class HooksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorServer().start()
+        self.base_url = SlicingDice.BASE_URL
+        SlicingDice.BASE_URL = self.server.url
+        self.server.database.insert({'auto-create': ['column'],
+                                     'user1': {'age': 20}})
+        self.hook = RecordingHook()
+        self.metrics = MetricsCollector()
+        self.client = SlicingDice(master_key='key', cache=QueryCache(),
+                                  hooks=[self.hook, self.metrics])
+
+    def tearDown(self):
+        SlicingDice.BASE_URL = self.base_url
+        self.server.stop()
+
+    def test_hooks_see_every_request(self):
+        self.client.count_entity(QUERY)
+        self.client.count_entity(QUERY)
+        self.server.api.inject_errors(ERROR_RATE_LIMIT)
+        with self.assertRaises(exceptions.RequestRateLimitException):
+            self.client.insert({'user2': {'age': 1}})
+        self.assertEqual(self.hook.before, [
+            URLResources.QUERY_COUNT_ENTITY,
+            URLResources.QUERY_COUNT_ENTITY, URLResources.INSERT])
+        sent, cached, failed = self.hook.after
+        self.assertEqual((sent.attempts, sent.cached, sent.status_code),
+                         (1, False, 200))
+        self.assertGreater(sent.validation_time, 0)
+        self.assertGreater(sent.bytes_received, 0)
+        self.assertEqual((cached.attempts, cached.cached), (0, True))
+        self.assertEqual(failed.error, 'RequestRateLimitException')
+
+    def test_metrics_per_endpoint(self):
+        for _ in range(3):
+            self.client.count_entity(QUERY)
+        self.server.api.inject_errors(ERROR_RATE_LIMIT)
+        with self.assertRaises(exceptions.RequestRateLimitException):
+            self.client.insert({'user2': {'age': 1}})
+        snapshot = self.metrics.snapshot()
+        count = snapshot[URLResources.QUERY_COUNT_ENTITY]
+        self.assertEqual((count['requests'], count['cached']), (3, 2))
+        self.assertEqual(count['total_time']['count'], 3)
+        self.assertEqual(count['latency']['count'], 1)
+        self.assertEqual(snapshot[URLResources.INSERT]['errors'],
+                         {'RequestRateLimitException': 1})
+
+        text = PrometheusExporter().export(self.metrics)
+        self.assertIn('# TYPE pyslicer_requests_total counter', text)
+        self.assertIn('pyslicer_requests_total{endpoint="/query/count/'
+                      'entity/"} 3.0', text)
+        self.assertIn('pyslicer_cache_hits_total{endpoint="/query/count/'
+                      'entity/"} 2.0', text)
+        self.metrics.reset()
+        self.assertEqual(self.metrics.snapshot(), {})
+
+
+class StatsDExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_counters_send_what_changed(self):
+        metrics = MetricsCollector()
+        exporter = StatsDExporter(*self.server.getsockname(),
+                                  max_packet_size=100)
+        metrics.after_request(self.event())
+        exporter.export(metrics)
+        packets = self.receive_all()
+        self.assertTrue(all(len(packet) <= 100 for packet in packets))
+        lines = '\n'.join(packets).splitlines()
+        self.assertIn('pyslicer.insert.requests:1|c', lines)
+        self.assertIn('pyslicer.insert.bytes_sent:100|c', lines)
+
+        metrics.after_request(self.event())
+        self.assertIn('pyslicer.insert.requests:1|c',
+                      exporter.lines(metrics))
+        self.assertNotIn('pyslicer.insert.requests:1|c',
+                         exporter.lines(metrics))
+
+    @staticmethod
+    def event():
+        event = RequestEvent(URLResources.INSERT, 'post', 1)
+        event.bytes_sent = 100
+        event.latency = 0.25
+        event.finish()
+        return event
+
+    def receive_all(self):
+        packets = []
+        self.server.settimeout(1)
+        try:
+            while True:
+                packets.append(self.server.recv(65535).decode('utf-8'))
+                self.server.settimeout(0.1)
+        except socket.timeout:
+            pass
+        return packets
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.prepared."""
+
+import datetime
+import unittest
+
+import six
+import ujson
+
+from pyslicer import SlicingDice, exceptions
+from pyslicer.core.cache import QueryCache
+from pyslicer.core.prepared import (Param, compile_json, compile_sql,
+                                    sql_literal)
+from pyslicer.emulator.server import EmulatorServer
+from pyslicer.url_resources import URLResources
+
+
+class SQLLiteralTest(unittest.TestCase):
+
+    def test_numbers(self):
+        self.assertEqual(sql_literal(12), '12')
+        self.assertEqual(sql_literal(10 ** 20), '100000000000000000000')
+        self.assertEqual(sql_literal(0.1), '0.1')
+        self.assertEqual(sql_literal(2350.5), '2350.5')
+
+    @unittest.skipUnless(six.PY2, "Python 2 longs")
+    def test_longs_have_no_suffix(self):
+        self.assertEqual(sql_literal(long(10)), '10')  # noqa: F821
+
+    def test_infinite_and_nan_are_rejected(self):
+        for value in (float('inf'), float('-inf'), float('nan')):
+            with self.assertRaises(exceptions.WrongTypeException):
+                sql_literal(value)
+
+    def test_other_values(self):
+        self.assertEqual(sql_literal(None), 'NULL')
+        self.assertEqual(sql_literal(True), 'TRUE')
+        self.assertEqual(sql_literal("o'brien"), "'o''brien'")
+        self.assertEqual(sql_literal(datetime.date(2018, 1, 2)),
+                         "'2018-01-02'")
+        self.assertEqual(sql_literal(['a', 1]), "'a', 1")
+        with self.assertRaises(exceptions.WrongTypeException):
+            sql_literal(object())
+
+
+class CompileSQLTest(unittest.TestCase):
+
+    def test_renders_placeholders(self):
+        template = compile_sql("SELECT COUNT(*) FROM default WHERE "
+                               "name LIKE 'a%%' AND age IN (%(ages)s) "
+                               "AND city = %(city)s")
+        self.assertEqual(
+            template.render({'ages': [18, 19], 'city': 'Rio'}),
+            "SELECT COUNT(*) FROM default WHERE name LIKE 'a%' AND "
+            "age IN (18, 19) AND city = 'Rio'")
+
+    def test_wrong_parameters_are_reported(self):
+        template = compile_sql("SELECT * FROM default WHERE age = %(age)s")
+        with self.assertRaises(exceptions.InvalidQueryException):
+            template.render({'agee': 1})
+
+
+class CompileJSONTest(unittest.TestCase):
+
+    def test_renders_like_the_bound_query(self):
+        names = ['p{0}'.format(i) for i in range(30)]
+        query = [dict(('column-{0}'.format(name), {'equals': Param(name)})
+                      for name in names)]
+        query.append({'between': [Param('start'), Param('end')],
+                      'reused': Param('p0')})
+        params = dict((name, 'value-' + name) for name in names)
+        params.update({'start': '7 days ago', 'end': 'now'})
+        bound = [dict(('column-{0}'.format(name),
+                       {'equals': params[name]}) for name in names),
+                 {'between': ['7 days ago', 'now'],
+                  'reused': params['p0']}]
+        rendered = compile_json(query).render(params)
+        self.assertEqual(ujson.loads(rendered), bound)
+
+    def test_values_are_encoded_as_json(self):
+        template = compile_json({'query': [{'name': {'equals': Param('x')}}]})
+        self.assertEqual(
+            ujson.loads(template.render({'x': 'say "hi"'})),
+            {'query': [{'name': {'equals': 'say "hi"'}}]})
+        self.assertEqual(template.param_names, frozenset(['x']))
+
+
+class PreparedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorServer().start()
+        self.base_url = SlicingDice.BASE_URL
+        SlicingDice.BASE_URL = self.server.url
+        self.server.database.insert({'auto-create': ['column'],
+                                     'user1': {'age': 20}})
+        self.cache = QueryCache(default_ttl=60)
+        self.client = SlicingDice(master_key='key', cache=self.cache)
+
+    def tearDown(self):
+        SlicingDice.BASE_URL = self.base_url
+        self.server.stop()
+
+    def requests_to(self, path):
+        return self.server.api.stats()['paths'].get(path, 0)
+
+    def test_shares_the_entries_of_the_unprepared_query(self):
+        count = self.client.prepare('count_entity', [{
+            'query-name': 'adults',
+            'query': [{'age': {'gte': Param('age')}}]}])
+        query = [{'query': [{'age': {'gte': 18}}], 'query-name': 'adults'}]
+        self.assertEqual(count(age=18), self.client.count_entity(query))
+        self.assertTrue(self.client.last_response.cached)
+        self.assertEqual(
+            self.requests_to(URLResources.QUERY_COUNT_ENTITY), 1)
+
+    def test_sql_shares_the_entries_of_the_unprepared_query(self):
+        select = self.client.prepare(
+            'sql', 'SELECT COUNT(*) FROM default WHERE age >= %(age)s')
+        select(age=18)
+        self.client.sql('SELECT COUNT(*) FROM default WHERE age >= 18')
+        self.assertEqual(self.requests_to(URLResources.QUERY_SQL), 1)
+
+    def test_cache_period_sets_the_ttl(self):
+        count = self.client.prepare('count_entity', [{
+            'query-name': 'adults', 'cache-period': 0,
+            'query': [{'age': {'gte': Param('age')}}]}])
+        count(age=18)
+        count(age=18)
+        self.assertEqual(
+            self.requests_to(URLResources.QUERY_COUNT_ENTITY), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
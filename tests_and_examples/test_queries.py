@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the queries SlicingDice splits in several requests,
+against pyslicer.emulator."""
+
+import io
+import unittest
+
+import ujson
+
+from pyslicer import SlicingDice, exceptions
+from pyslicer.emulator.server import EmulatorServer
+from pyslicer.url_resources import URLResources
+
+
+class SplitQueryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorServer().start()
+        self.base_url = SlicingDice.BASE_URL
+        SlicingDice.BASE_URL = self.server.url
+        self.server.database.insert(dict(
+            [('auto-create', ['column'])] +
+            [('user{0}'.format(i), {'age': i, 'name': 'name{0}'.format(i)})
+             for i in range(30)]))
+        self.client = SlicingDice(master_key='key', max_workers=4)
+
+    def tearDown(self):
+        SlicingDice.BASE_URL = self.base_url
+        self.server.stop()
+
+    def requests_to(self, path):
+        return self.server.api.stats()['paths'].get(path, 0)
+
+
+class CountTest(SplitQueryTestCase):
+
+    def test_long_lists_are_split_and_merged(self):
+        query = [{'query-name': 'over{0}'.format(i),
+                  'query': [{'age': {'gt': i}}]} for i in range(25)]
+        response = self.client.count_entity(query)
+        self.assertEqual(response['status'], 'success')
+        self.assertEqual(response['result'], dict(
+            ('over{0}'.format(i), 29 - i) for i in range(25)))
+        self.assertEqual(
+            self.requests_to(URLResources.QUERY_COUNT_ENTITY), 3)
+
+    def test_raw_merged_responses_are_bytes(self):
+        query = [{'query-name': 'over{0}'.format(i),
+                  'query': [{'age': {'gt': i}}]} for i in range(11)]
+        body = self.client.count_entity(query, raw=True)
+        self.assertEqual(len(ujson.loads(body)['result']), 11)
+
+    def test_every_sub_query_is_validated_before_sending(self):
+        query = [{'query-name': 'over{0}'.format(i),
+                  'query': [{'age': {'gt': i}}]} for i in range(15)]
+        query[12]['query'] = []
+        with self.assertRaises(exceptions.SlicingDiceException):
+            self.client.count_entity(query)
+        self.assertEqual(
+            self.requests_to(URLResources.QUERY_COUNT_ENTITY), 0)
+
+
+class TopValuesTest(SplitQueryTestCase):
+
+    def test_many_named_queries_are_split_and_merged(self):
+        query = dict(('top{0}'.format(i), {'age': i + 1}) for i in range(12))
+        response = self.client.top_values(query)
+        self.assertEqual(sorted(response['result']), sorted(query))
+        self.assertEqual(len(response['result']['top11']['age']), 12)
+        self.assertEqual(
+            self.requests_to(URLResources.QUERY_TOP_VALUES), 3)
+
+
+class ExistsEntitiesTest(SplitQueryTestCase):
+
+    ids = (['user{0}'.format(i) for i in range(0, 60, 2)] +
+           ['missing{0}'.format(i) for i in range(200)] +
+           ['user0', 'missing0'])
+
+    def test_any_number_of_ids_are_checked_once(self):
+        found = self.client.exists_entities(iter(self.ids), max_in_flight=2)
+        self.assertEqual(sorted(found['exists']),
+                         sorted('user{0}'.format(i) for i in range(0, 30, 2)))
+        self.assertEqual(len(found['not-exists']), 215)
+        self.assertEqual(
+            self.requests_to(URLResources.QUERY_EXISTS_ENTITY), 3)
+
+    def test_results_are_written_to_a_sink(self):
+        sink = io.StringIO()
+        counts = self.client.exists_entities(self.ids, sink=sink)
+        self.assertEqual(counts, {'exists': 15, 'not-exists': 215})
+        lines = sink.getvalue().splitlines()
+        self.assertEqual(len(lines), 230)
+        self.assertIn(u'exists\tuser0', lines)
+        self.assertIn(u'not-exists\tmissing0', lines)
+
+    def test_single_requests_keep_the_api_limit(self):
+        with self.assertRaises(exceptions.MaxLimitException):
+            self.client.exists_entity(self.ids)
+
+
+class AggregationTest(SplitQueryTestCase):
+
+    def test_independent_aggregations_are_sent_concurrently(self):
+        response = self.client.aggregation({
+            'query': [[{'age': 2}], [{'name': 3}, {'age': 1}]]})
+        self.assertEqual(len(response['result']['age']), 2)
+        self.assertEqual(len(response['result']['name']), 3)
+        self.assertTrue(all(len(bucket['age']) == 1
+                            for bucket in response['result']['name']))
+        self.assertEqual(
+            self.requests_to(URLResources.QUERY_AGGREGATION), 2)
+
+    def test_aggregations_returning_the_same_column_raise(self):
+        with self.assertRaises(exceptions.SlicingDiceException):
+            self.client.aggregation(
+                {'query': [[{'age': 2}], [{'age': 3}]]})
+
+    def test_nested_columns_keep_the_api_limit(self):
+        with self.assertRaises(exceptions.MaxLimitException):
+            self.client.aggregation({'query': [
+                {'age': 1}, {'name': 1}, {'age': 1}, {'name': 1},
+                {'age': 1}, {'name': 1}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.utils.query_utils."""
+
+import unittest
+
+from pyslicer import exceptions
+from pyslicer.utils import query_utils
+
+
+class IterUniqueChunksTest(unittest.TestCase):
+
+    def test_chunks_skip_repeated_items(self):
+        items = iter([1, 2, 1, 3, 2, 4, 5, 5])
+        self.assertEqual(list(query_utils.iter_unique_chunks(items, 2)),
+                         [[1, 2], [3, 4], [5]])
+
+    def test_items_are_consumed_lazily(self):
+        def items():
+            yield 'a'
+            yield 'b'
+            raise AssertionError("Consumed past the first chunk")
+
+        self.assertEqual(next(query_utils.iter_unique_chunks(items(), 2)),
+                         ['a', 'b'])
+
+
+class SplitNamedQueriesTest(unittest.TestCase):
+
+    def test_small_queries_are_not_split(self):
+        self.assertIsNone(query_utils.split_named_queries(
+            {'a': {}, 'b': {}, 'bypass-cache': True}, 2))
+        self.assertIsNone(query_utils.split_named_queries([{}] * 10, 2))
+
+    def test_options_are_copied_to_every_sub_query(self):
+        query = dict(('q{0}'.format(i), {'age': i}) for i in range(5))
+        query['cache-period'] = 30
+        sub_queries = query_utils.split_named_queries(query, 2)
+        self.assertEqual([len(sub_query) for sub_query in sub_queries],
+                         [3, 3, 2])
+        merged = {}
+        for sub_query in sub_queries:
+            self.assertEqual(sub_query.pop('cache-period'), 30)
+            merged.update(sub_query)
+        del query['cache-period']
+        self.assertEqual(merged, query)
+
+
+class SplitAggregationTest(unittest.TestCase):
+
+    def test_nested_columns_are_not_split(self):
+        self.assertIsNone(query_utils.split_aggregation(
+            {'query': [{'age': 2}, {'name': 2}]}))
+
+    def test_independent_aggregations_keep_the_other_keys(self):
+        query = {'query': [[{'age': 2}], [{'name': 2}]],
+                 'filter': [{'age': {'gt': 1}}]}
+        self.assertEqual(query_utils.split_aggregation(query), [
+            {'query': [{'age': 2}], 'filter': [{'age': {'gt': 1}}]},
+            {'query': [{'name': 2}], 'filter': [{'age': {'gt': 1}}]}])
+
+    def test_mixed_lists_are_rejected(self):
+        with self.assertRaises(exceptions.InvalidQueryException):
+            query_utils.split_aggregation({'query': [[{'age': 2}],
+                                                     {'name': 2}]})
+
+
+class MergeResultsTest(unittest.TestCase):
+
+    def test_results_are_merged_and_took_is_the_longest(self):
+        merged = query_utils.merge_results([
+            {'status': 'success', 'result': {'a': 1}, 'took': 0.2},
+            {'status': 'success', 'result': {'b': 2}, 'took': 0.5}])
+        self.assertEqual(merged, {'status': 'success',
+                                  'result': {'a': 1, 'b': 2}, 'took': 0.5})
+
+    def test_unique_results(self):
+        responses = [{'result': {'a': 1}}, {'result': {'a': 2}}]
+        self.assertEqual(query_utils.merge_results(responses)['result'],
+                         {'a': 2})
+        with self.assertRaises(exceptions.SlicingDiceException):
+            query_utils.merge_results(responses, unique=True)
+
+    def test_non_dictionary_results_are_rejected(self):
+        with self.assertRaises(exceptions.SlicingDiceException):
+            query_utils.merge_results([{'result': [1]}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.rate_limiter."""
+
+import threading
+import unittest
+
+from pyslicer.core.rate_limiter import RateLimiter, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_reservations_queue_up_after_the_burst(self):
+        bucket = TokenBucket(10, capacity=2)
+        delays = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(delays[:2], [0.0, 0.0])
+        self.assertAlmostEqual(delays[2], 0.1, delta=0.01)
+        self.assertAlmostEqual(delays[3], 0.2, delta=0.01)
+
+    def test_try_take_leaves_missing_tokens(self):
+        bucket = TokenBucket(10, capacity=1)
+        self.assertEqual(bucket.try_take(), 0.0)
+        self.assertAlmostEqual(bucket.try_take(), 0.1, delta=0.01)
+        self.assertAlmostEqual(bucket.try_take(), 0.1, delta=0.01)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_levels_are_paced_independently(self):
+        limiter = RateLimiter(requests_per_second={'read': 10, 'write': 1})
+        self.assertEqual([limiter.reserve(0) for _ in range(10)], [0.0] * 10)
+        self.assertEqual(limiter.reserve(1), 0.0)
+        self.assertGreater(limiter.reserve(0), 0)
+        self.assertAlmostEqual(limiter.reserve(1), 1.0, delta=0.01)
+        # Master requests are not limited
+        self.assertEqual(limiter.reserve(2), 0.0)
+        stats = limiter.stats()
+        self.assertEqual(stats['read']['requests'], 11)
+        self.assertEqual(stats['read']['delayed'], 1)
+        self.assertEqual(stats['write']['delayed'], 1)
+        self.assertEqual(stats['master']['delayed'], 0)
+
+    def test_bytes_are_limited(self):
+        limiter = RateLimiter(bytes_per_second={'write': 1000})
+        self.assertEqual(limiter.reserve(1, 1000), 0.0)
+        self.assertAlmostEqual(limiter.reserve(1, 500), 0.5, delta=0.01)
+
+    def test_concurrent_callers_share_the_quota(self):
+        limiter = RateLimiter(requests_per_second={'read': 100}, burst=0.1)
+        delays = []
+        lock = threading.Lock()
+
+        def reserve():
+            for _ in range(50):
+                delay = limiter.reserve(0)
+                with lock:
+                    delays.append(delay)
+
+        threads = [threading.Thread(target=reserve) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 200 requests at 100 per second after a burst of 10
+        self.assertAlmostEqual(max(delays), 1.9, delta=0.1)
+        self.assertEqual(limiter.stats()['read']['requests'], 200)
+
+    def test_unknown_levels_are_rejected(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(requests_per_second={'admin': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.requester, against pyslicer.emulator."""
+
+import socket
+import unittest
+
+from pyslicer import SlicingDice
+from pyslicer.core.requester import Requester, keep_alive_socket_options
+from pyslicer.emulator.server import EmulatorServer
+
+QUERY = [{'query-name': 'adults', 'query': [{'age': {'gte': 18}}]}]
+
+
+class OptionsTest(unittest.TestCase):
+
+    def test_keep_alive_socket_options(self):
+        options = keep_alive_socket_options(idle=30, interval=5, count=3)
+        self.assertEqual(options[0],
+                         (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            self.assertIn((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30),
+                          options)
+
+    def test_keep_alive_reaches_the_pool(self):
+        requester = Requester(True, 60, keep_alive={'idle': 30})
+        adapter = requester.session.get_adapter('https://')
+        socket_options = adapter.poolmanager.connection_pool_kw[
+            'socket_options']
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+                      socket_options)
+
+    def test_connect_timeout(self):
+        self.assertEqual(Requester(True, 60).timeout, 60)
+        self.assertEqual(Requester(True, 60, connect_timeout=3).timeout,
+                         (3, 60))
+
+    def test_pool_size_follows_max_workers(self):
+        self.assertEqual(
+            SlicingDice(master_key='key')._requester.pool_maxsize, 10)
+        self.assertEqual(SlicingDice(
+            master_key='key', max_workers=32)._requester.pool_maxsize, 32)
+        self.assertEqual(SlicingDice(
+            master_key='key', pool_maxsize=4)._requester.pool_maxsize, 4)
+
+
+class PoolStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorServer().start()
+        self.base_url = SlicingDice.BASE_URL
+        SlicingDice.BASE_URL = self.server.url
+        self.server.database.insert({'auto-create': ['column'],
+                                     'user1': {'age': 20}})
+
+    def tearDown(self):
+        SlicingDice.BASE_URL = self.base_url
+        self.server.stop()
+
+    def test_connections_are_reused(self):
+        client = SlicingDice(master_key='key')
+        self.assertEqual(client.pool_stats(), {})
+        for _ in range(5):
+            client.count_entity(QUERY)
+        (stats,) = client.pool_stats().values()
+        self.assertEqual(stats, {'connections_opened': 1, 'requests': 5,
+                                 'in_use': 0, 'idle': 1, 'maxsize': 10})
+
+    def test_concurrent_requests_open_up_to_max_workers(self):
+        self.server.api.latency = 0.05
+        client = SlicingDice(master_key='key', max_workers=4)
+        client.insert_many({'user{0}'.format(i): {'age': i}}
+                           for i in range(12))
+        (stats,) = client.pool_stats().values()
+        self.assertLessEqual(stats['connections_opened'], 4)
+        self.assertEqual(stats['requests'], 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the response handling of SlicingDice, against
+pyslicer.emulator."""
+
+import threading
+import unittest
+
+import ujson
+
+from pyslicer import SlicingDice, exceptions
+from pyslicer.core.cache import QueryCache
+from pyslicer.core.response_info import ContextLocal
+from pyslicer.emulator.database import ERROR_RATE_LIMIT
+from pyslicer.emulator.server import EmulatorServer
+
+QUERY = [{'query-name': 'adults', 'query': [{'age': {'gte': 18}}]}]
+
+
+class ResponseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmulatorServer().start()
+        self.base_url = SlicingDice.BASE_URL
+        SlicingDice.BASE_URL = self.server.url
+        self.server.database.insert({'auto-create': ['column'],
+                                     'user1': {'age': 20},
+                                     'user2': {'age': 10}})
+
+    def tearDown(self):
+        SlicingDice.BASE_URL = self.base_url
+        self.server.stop()
+
+
+class RawTest(ResponseTestCase):
+
+    def test_raw_bodies_decode_to_the_result(self):
+        client = SlicingDice(master_key='key')
+        body = client.count_entity(QUERY, raw=True)
+        self.assertIsInstance(body, bytes)
+        self.assertEqual(ujson.loads(body)['result'], {'adults': 1})
+        self.assertEqual(
+            ujson.loads(client.sql('SELECT COUNT(*) AS total FROM default',
+                                   raw=True))['result'],
+            [{'total': 2}])
+
+    def test_cached_bodies_stay_raw(self):
+        client = SlicingDice(master_key='key', cache=QueryCache())
+        first = client.count_entity(QUERY, raw=True)
+        self.assertEqual(client.count_entity(QUERY, raw=True), first)
+        self.assertTrue(client.last_response.cached)
+        self.assertEqual(client.count_entity(QUERY),
+                         ujson.loads(first))
+
+    def test_errors_are_raised(self):
+        client = SlicingDice(master_key='key')
+        self.server.api.inject_errors(ERROR_RATE_LIMIT)
+        with self.assertRaises(exceptions.RequestRateLimitException):
+            client.count_entity(QUERY, raw=True)
+        with self.assertRaises(exceptions.SlicingDiceException):
+            client.count_entity([{'query-name': 'q',
+                                  'query': [{'missing': {'gte': 1}}]}],
+                                raw=True)
+
+
+class LastResponseTest(ResponseTestCase):
+
+    def test_describes_the_last_call(self):
+        client = SlicingDice(master_key='key')
+        self.assertIsNone(client.last_response)
+        self.assertIsNone(client.status_code)
+        client.count_entity(QUERY)
+        info = client.last_response
+        self.assertEqual((info.status_code, info.attempts, info.cached),
+                         (200, 1, False))
+        self.assertEqual(client.status_code, 200)
+        self.assertEqual(client.headers['Content-Type'], 'application/json')
+        self.assertIsNotNone(info.took)
+        self.assertGreater(info.bytes_sent, 0)
+        self.assertGreater(info.bytes_received, 0)
+
+    def test_is_kept_per_thread(self):
+        client = SlicingDice(master_key='key', cache=QueryCache())
+        client.count_entity(QUERY)
+        seen = []
+
+        def other():
+            seen.append(client.last_response)
+            client.count_entity(QUERY)
+            seen.append(client.last_response)
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        self.assertIsNone(seen[0])
+        self.assertTrue(seen[1].cached)
+        self.assertFalse(client.last_response.cached)
+
+
+class ContextLocalTest(unittest.TestCase):
+
+    def test_values_are_kept_per_thread(self):
+        local = ContextLocal('test_value')
+        local.set(1)
+        seen = []
+        thread = threading.Thread(
+            target=lambda: seen.append(local.get('unset')))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, ['unset'])
+        self.assertEqual(local.get(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.retry."""
+
+import unittest
+
+from pyslicer import exceptions
+from pyslicer.core.retry import RetryPolicy
+
+
+def rate_limited(retry_after=None):
+    return exceptions.RequestRateLimitException(retry_after=retry_after)
+
+
+class DelayTest(unittest.TestCase):
+
+    def test_backoff_windows_grow_up_to_the_cap(self):
+        policy = RetryPolicy(backoff_base=1, backoff_cap=4)
+        for attempt, window in ((1, 1), (2, 2), (3, 4), (10, 4)):
+            delays = [policy.delay(rate_limited(), attempt)
+                      for _ in range(50)]
+            self.assertTrue(all(0 <= delay <= window for delay in delays))
+
+    def test_retry_after_takes_precedence(self):
+        policy = RetryPolicy(backoff_cap=30)
+        self.assertEqual(policy.delay(rate_limited(7), 1), 7)
+        self.assertEqual(policy.delay(rate_limited(0), 3), 0)
+
+    def test_retry_after_is_capped(self):
+        self.assertEqual(
+            RetryPolicy(backoff_cap=30).delay(rate_limited(86400), 1), 30)
+        self.assertEqual(
+            RetryPolicy(backoff_cap=30, max_retry_after=120).delay(
+                rate_limited(86400), 1), 120)
+
+    def test_retry_after_can_be_ignored(self):
+        policy = RetryPolicy(backoff_cap=1, respect_retry_after=False)
+        self.assertLessEqual(policy.delay(rate_limited(60), 1), 1)
+
+
+class ShouldRetryTest(unittest.TestCase):
+
+    def test_stops_after_max_attempts(self):
+        policy = RetryPolicy(max_attempts=3)
+        self.assertTrue(policy.should_retry(rate_limited(), 2, True))
+        self.assertFalse(policy.should_retry(rate_limited(), 3, True))
+
+    def test_only_retries_retry_on_errors(self):
+        policy = RetryPolicy()
+        self.assertFalse(policy.should_retry(
+            exceptions.InvalidQueryException(), 1, True))
+
+    def test_inserts_are_retried_only_when_not_processed(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.should_retry(rate_limited(), 1, False))
+        self.assertFalse(policy.should_retry(
+            exceptions.SlicingDiceHTTPError(), 1, False))
+        self.assertTrue(policy.should_retry(
+            exceptions.SlicingDiceHTTPError(request_sent=False), 1, False))
+
+    def test_permanent_http_statuses_are_not_retried(self):
+        policy = RetryPolicy()
+        for status in (400, 401, 403, 404):
+            self.assertFalse(policy.should_retry(
+                exceptions.SlicingDiceHTTPError(status_code=status), 1, True))
+
+    def test_server_errors_and_rate_limits_are_retried(self):
+        policy = RetryPolicy()
+        for status in (429, 500, 503):
+            self.assertTrue(policy.should_retry(
+                exceptions.SlicingDiceHTTPError(status_code=status), 1, True))
+        # Connection errors and timeouts carry no status
+        self.assertTrue(policy.should_retry(
+            exceptions.SlicingDiceHTTPError(), 1, True))
+
+    def test_retry_statuses_can_be_changed(self):
+        policy = RetryPolicy(retry_statuses=(404,))
+        self.assertTrue(policy.should_retry(
+            exceptions.SlicingDiceHTTPError(status_code=404), 1, True))
+        self.assertFalse(policy.should_retry(
+            exceptions.SlicingDiceHTTPError(status_code=503), 1, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
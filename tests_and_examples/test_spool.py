@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.core.spool."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import unittest
+
+from pyslicer import exceptions
+from pyslicer.core import spool as spool_module
+from pyslicer.core.spool import InsertSpool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClient(object):
+    """Records the insert bodies sent, failing with the queued errors
+    first"""
+
+    max_workers = 2
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def _send_insert_body(self, body):
+        with self.lock:
+            if self.errors:
+                raise self.errors.pop(0)
+            self.sent.append(bytes(body))
+        return {'status': 'success'}
+
+
+def api_error(code):
+    return exceptions.SlicingDiceException(code=code, message='error')
+
+
+class InsertSpoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def spool(self, client, **options):
+        options.setdefault('fsync', 'always')
+        options.setdefault('backoff_base', 0.001)
+        options.setdefault('backoff_cap', 0.01)
+        return InsertSpool(client, self.directory, **options)
+
+
+class ReplayTest(InsertSpoolTestCase):
+
+    def test_sends_appended_bodies(self):
+        client = FakeClient()
+        with self.spool(client) as spool:
+            spool.append(b'{"1": {"a": 1}}')
+            spool.append(u'{"2": {"a": 2}}')
+            self.assertTrue(spool.flush(5))
+            self.assertEqual(spool.stats()['sent'], 2)
+        self.assertEqual(sorted(client.sent),
+                         [b'{"1": {"a": 1}}', b'{"2": {"a": 2}}'])
+
+    def test_reopen_sends_requests_left_by_close(self):
+        unreachable = FakeClient([exceptions.SlicingDiceHTTPError()] * 100)
+        spool = self.spool(unreachable, backoff_base=10, backoff_cap=10)
+        spool.append(b'first')
+        spool.append(b'second')
+        spool.close()
+        self.assertEqual(unreachable.sent, [])
+
+        client = FakeClient()
+        with self.spool(client) as spool:
+            self.assertEqual(spool.stats()['replayed'], 2)
+            self.assertTrue(spool.flush(5))
+        self.assertEqual(sorted(client.sent), [b'first', b'second'])
+
+        # Everything was acknowledged, nothing is replayed a second time
+        with self.spool(FakeClient()) as spool:
+            self.assertEqual(spool.stats()['replayed'], 0)
+
+    def test_replays_requests_after_a_crash(self):
+        script = textwrap.dedent("""
+            import os, sys, threading
+            sys.path.insert(0, {root!r})
+            from pyslicer.core.spool import InsertSpool
+
+            class Hanging(object):
+                max_workers = 1
+                def _send_insert_body(self, body):
+                    threading.Event().wait()
+
+            spool = InsertSpool(Hanging(), {directory!r}, fsync='always')
+            for i in range(5):
+                spool.append('{{"%d": {{"a": %d}}}}' % (i, i))
+            os._exit(0)
+        """).format(root=ROOT, directory=self.directory)
+        subprocess.check_call([sys.executable, '-c', script])
+
+        client = FakeClient()
+        with self.spool(client) as spool:
+            self.assertEqual(spool.stats()['replayed'], 5)
+            self.assertTrue(spool.flush(5))
+        expected = [('{"%d": {"a": %d}}' % (i, i)).encode('utf-8')
+                    for i in range(5)]
+        self.assertEqual(sorted(client.sent), expected)
+
+    def test_ignores_a_torn_record(self):
+        spool = self.spool(FakeClient([exceptions.SlicingDiceHTTPError()]),
+                           backoff_base=10, backoff_cap=10)
+        spool.append(b'complete')
+        spool.close()
+        segment = [name for name in os.listdir(self.directory)
+                   if name.endswith('.spool')][0]
+        with open(os.path.join(self.directory, segment), 'r+b') as f:
+            # Header of a record whose body was never written
+            f.seek(8 + len(b'complete'))
+            f.write(b'\x00\x00\x00\x10\xde\xad\xbe\xef')
+
+        client = FakeClient()
+        with self.spool(client) as spool:
+            self.assertTrue(spool.flush(5))
+        self.assertEqual(client.sent, [b'complete'])
+
+
+class RejectTest(InsertSpoolTestCase):
+
+    def assert_retried(self, error):
+        client = FakeClient([error])
+        with self.spool(client) as spool:
+            spool.append(b'body')
+            self.assertTrue(spool.flush(5))
+            stats = spool.stats()
+        self.assertEqual(client.sent, [b'body'])
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['rejected'], 0)
+
+    def assert_rejected(self, error):
+        client = FakeClient([error])
+        rejected = []
+        with self.spool(client, on_reject=lambda body, e: rejected.append(
+                (bytes(body), e))) as spool:
+            spool.append(b'body')
+            self.assertTrue(spool.flush(5))
+            self.assertEqual(spool.stats()['rejected'], 1)
+        self.assertEqual(client.sent, [])
+        self.assertEqual(rejected, [(b'body', error)])
+
+    def test_retries_rate_limit(self):
+        self.assert_retried(exceptions.RequestRateLimitException(code=1502))
+
+    def test_retries_connection_errors(self):
+        self.assert_retried(exceptions.SlicingDiceHTTPError())
+
+    def test_retries_invalid_keys(self):
+        self.assert_retried(exceptions.InvalidSlicingDiceKeysException(
+            "This key is not allowed to perform this operation."))
+
+    def test_retries_unmapped_server_errors(self):
+        self.assert_retried(api_error(9999))
+        self.assert_retried(api_error(None))
+
+    def test_retries_client_errors(self):
+        self.assert_retried(IOError('disk hiccup'))
+
+    def test_rejects_body_size_exceeded(self):
+        self.assert_rejected(
+            exceptions.RequestBodySizeExceededException(code=1507))
+
+    def test_rejects_payload_errors(self):
+        self.assert_rejected(exceptions.IndexEntitiesLimitException(
+            code=2012))
+        self.assert_rejected(api_error('2001'))
+
+    def test_rejects_validation_errors(self):
+        self.assert_rejected(exceptions.InvalidInsertException('bad'))
+        self.assert_rejected(exceptions.WrongTypeException('bad'))
+
+    def test_flush_raises_rejection_without_on_reject(self):
+        error = api_error(2013)
+        with self.spool(FakeClient([error])) as spool:
+            spool.append(b'body')
+            with self.assertRaises(exceptions.SlicingDiceException) as raised:
+                spool.flush(5)
+        self.assertIs(raised.exception, error)
+
+    def test_flush_raises_every_rejection(self):
+        errors = [api_error(2012), api_error(1507)]
+        with self.spool(FakeClient(list(errors))) as spool:
+            spool.append(b'first')
+            spool.append(b'second')
+            spool.append(b'third')
+            with self.assertRaises(
+                    exceptions.InsertBatchesFailedException) as raised:
+                spool.flush(5)
+            self.assertTrue(spool.flush(5))
+        self.assertEqual(sorted(error.code for error in
+                                raised.exception.errors), [1507, 2012])
+
+    def test_retry_after_waits_at_most_backoff_cap(self):
+        error = exceptions.RequestRateLimitException(retry_after=86400)
+        client = FakeClient([error])
+        with self.spool(client, backoff_cap=0.05) as spool:
+            spool.append(b'body')
+            self.assertTrue(spool.flush(5))
+        self.assertEqual(client.sent, [b'body'])
+
+    def test_retried_requests_survive_a_reopen(self):
+        spool = self.spool(FakeClient([api_error(9999)] * 100),
+                           backoff_base=10, backoff_cap=10)
+        spool.append(b'body')
+        spool.close()
+        client = FakeClient()
+        with self.spool(client) as spool:
+            self.assertTrue(spool.flush(5))
+        self.assertEqual(client.sent, [b'body'])
+
+
+@unittest.skipIf(spool_module.fcntl is None, "Requires fcntl")
+class LockTest(InsertSpoolTestCase):
+
+    def test_a_directory_is_used_by_one_spool_at_a_time(self):
+        spool = self.spool(FakeClient())
+        with self.assertRaises(exceptions.InsertSpoolLockedException):
+            self.spool(FakeClient())
+        spool.close()
+        with self.spool(FakeClient()) as spool:
+            self.assertEqual(spool.stats()['replayed'], 0)
+
+    def test_the_lock_is_held_against_other_processes(self):
+        script = textwrap.dedent("""
+            import sys
+            sys.path.insert(0, {root!r})
+            from pyslicer import exceptions
+            from pyslicer.core.spool import InsertSpool
+
+            class Client(object):
+                max_workers = 1
+
+            try:
+                InsertSpool(Client(), {directory!r})
+            except exceptions.InsertSpoolLockedException:
+                sys.exit(3)
+        """).format(root=ROOT, directory=self.directory)
+        with self.spool(FakeClient()):
+            self.assertEqual(
+                subprocess.call([sys.executable, '-c', script]), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pyslicer.utils.validators."""
+
+import random
+import unittest
+
+from pyslicer import exceptions
+from pyslicer.utils import batch_utils, validators
+
+
+def recursive_check(data):
+    """The recursive walk check_values replaced, kept as a reference"""
+    def check_value(value):
+        if isinstance(value, dict):
+            check_dictionary(value)
+        elif isinstance(value, list):
+            if not value:
+                raise validators._invalid_values()
+            for item in value:
+                check_value(item)
+        elif value is None or value == "":
+            raise validators._invalid_values()
+
+    def check_dictionary(dictionary):
+        if not dictionary:
+            raise validators._invalid_values()
+        for key in dictionary:
+            check_value(dictionary[key])
+
+    if not data:
+        raise validators._invalid_values()
+    if isinstance(data, dict):
+        check_dictionary(data)
+    else:
+        for item in data:
+            check_value(item.get('query') if isinstance(item, dict)
+                        else item)
+
+
+def outcome(check, data):
+    """Returns None if data is valid, the error class and message
+    otherwise"""
+    try:
+        check(data)
+    except exceptions.SlicingDiceException as e:
+        return type(e), str(e)
+    return None
+
+
+def random_value(rng, depth):
+    """Returns a random payload value, sometimes invalid"""
+    kind = rng.random()
+    if depth <= 0 or kind < 0.4:
+        return rng.choice([1, 0, 1.5, True, False, 'text', 'text', 'text',
+                           'text', u'ção', None, ''])
+    if kind < 0.7:
+        return [random_value(rng, depth - 1)
+                for _ in range(rng.randint(0, 4))]
+    return dict(('key{0}'.format(i), random_value(rng, depth - 1))
+                for i in range(rng.randint(0, 4)))
+
+
+class CheckValuesTest(unittest.TestCase):
+
+    def test_matches_the_recursive_walk(self):
+        rng = random.Random(2018)
+        invalid = 0
+        for _ in range(3000):
+            data = random_value(rng, rng.randint(1, 6))
+            if not isinstance(data, (dict, list)):
+                continue
+            if isinstance(data, list) and rng.random() < 0.5:
+                data = [{'query-name': 'q', 'query': item} for item in data]
+            expected = outcome(recursive_check, data)
+            invalid += expected is not None
+            self.assertEqual(outcome(validators.check_values, data),
+                             expected, data)
+        # Both outcomes were exercised
+        self.assertTrue(300 < invalid < 2700)
+
+    def test_deep_payloads(self):
+        valid = {'value': 1}
+        invalid = {'value': ''}
+        for _ in range(100000):
+            valid = {'nested': [valid]}
+            invalid = {'nested': [invalid]}
+        validators.check_values(valid)
+        with self.assertRaises(exceptions.InvalidQueryException) as context:
+            validators.check_values(invalid)
+        self.assertIn("This query has invalid keys or values.",
+                      context.exception.args)
+
+    def test_list_queries_only_check_their_query(self):
+        validators.check_values([{'query-name': '', 'query': [{'a': 1}]}])
+        with self.assertRaises(exceptions.InvalidQueryException):
+            validators.check_values([{'query-name': 'q', 'query': []}])
+
+
+class LevelTest(unittest.TestCase):
+
+    def test_structural_level_skips_value_checks(self):
+        query = {'query': [{'age': {'equals': None}}]}
+        with self.assertRaises(exceptions.InvalidQueryException):
+            validators.QueryDataExtractionValidator(
+                query, validators.VALIDATION_FULL).validator()
+        self.assertTrue(validators.QueryDataExtractionValidator(
+            query, validators.VALIDATION_STRUCTURAL).validator())
+
+    def test_unknown_levels_are_rejected(self):
+        with self.assertRaises(ValueError):
+            validators.check_level('strict')
+
+
+class InsertBatchesTest(unittest.TestCase):
+
+    def test_validate_values_checks_each_entity(self):
+        entities = [('user1', {'age': 1}), ('user2', {'name': ''})]
+        bodies = list(batch_utils.iter_insert_batches(entities))
+        self.assertEqual(len(bodies), 1)
+        with self.assertRaises(exceptions.InvalidQueryException):
+            list(batch_utils.iter_insert_batches(
+                entities, validate_values=True))
+
+    def test_batches_stay_under_the_limits(self):
+        entities = [('user{0}'.format(i), {'bio': 'x' * 100})
+                    for i in range(50)]
+        bodies = list(batch_utils.iter_insert_batches(
+            entities, auto_create=['column'], max_entities=20,
+            max_bytes=1000))
+        self.assertTrue(all(len(body) <= 1000 for body in bodies))
+        self.assertEqual(sum(body.count('"bio"') for body in bodies), 50)
+        self.assertTrue(all(body.endswith(',"auto-create":["column"]}')
+                            for body in bodies))
+
+
+if __name__ == '__main__':
+    unittest.main()